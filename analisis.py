@@ -1,10 +1,12 @@
 import streamlit as st
 import requests
-import json
 from docx import Document
 from docx.shared import Pt
 from io import BytesIO
 
+from cliente_llm import OPENROUTER_URL, chat_completion
+from telemetria import formatear_resumen, trabajo_telemetria
+
 # Configuración de la página
 st.set_page_config(
     page_title="Analizador de Novelas",
@@ -44,7 +46,7 @@ def analizar_escena(escena, api_key):
     """
     Envía una escena a la API de OpenRouter para su análisis.
     """
-    url = "https://openrouter.ai/api/v1/chat/completions"
+    url = OPENROUTER_URL
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}"
@@ -60,9 +62,7 @@ def analizar_escena(escena, api_key):
     }
 
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        result = response.json()
+        result = chat_completion(url, headers, payload, usar_cache=True)
         # Asumiendo que la respuesta está en 'choices' y 'message' según la estructura de OpenAI
         analisis = result['choices'][0]['message']['content']
         return analisis
@@ -147,16 +147,18 @@ if uploaded_file is not None:
 
         analisis_resultados = []
 
-        for idx, escena in enumerate(escenas, 1):
-            analisis = analizar_escena(escena, api_key)
-            analisis_resultados.append(analisis)
-            # Actualizar la barra de progreso
-            progress = idx / num_escenas
-            progress_bar.progress(progress)
-            progreso_text.text(f"Analizando escena {idx} de {num_escenas}...")
+        with trabajo_telemetria("análisis") as trabajo:
+            for idx, escena in enumerate(escenas, 1):
+                analisis = analizar_escena(escena, api_key)
+                analisis_resultados.append(analisis)
+                # Actualizar la barra de progreso
+                progress = idx / num_escenas
+                progress_bar.progress(progress)
+                progreso_text.text(f"Analizando escena {idx} de {num_escenas}...")
 
         progreso_text.text("Análisis completado.")
         progress_bar.empty()
+        st.caption(f"Telemetría del análisis: {formatear_resumen(trabajo.resumen())}")
 
         # Generar el informe
         with st.spinner("Generando el informe en Word..."):
@@ -1,8 +1,9 @@
 import streamlit as st
 import requests
-import json
 import time
 
+from cliente_llm import OPENROUTER_URL, chat_completion
+
 # Configuración de la página
 st.set_page_config(
     page_title="Editor de Escenas de Novela",
@@ -46,7 +47,7 @@ def process_scene(scene, feedback):
         time.sleep(0.05)  # Simular tiempo de procesamiento
 
     # Preparar la solicitud a la API de OpenRouter
-    api_url = "https://openrouter.ai/api/v1/chat/completions"
+    api_url = OPENROUTER_URL
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}",
@@ -73,12 +74,10 @@ def process_scene(scene, feedback):
     }
     
     try:
-        # Enviar la solicitud a la API
-        response = requests.post(api_url, headers=headers, data=json.dumps(data))
-        response.raise_for_status()  # Verificar si hubo un error en la solicitud
+        # Enviar la solicitud a la API (la caché persistente evita repetir la misma reescritura)
+        result = chat_completion(api_url, headers, data, usar_cache=True)
         
         # Parsear la respuesta
-        result = response.json()
         regenerated_scene = result['choices'][0]['message']['content'].strip()
         
         # Actualizar la barra de progreso a 100%
@@ -1,26 +1,29 @@
 import streamlit as st
 import requests
 from io import BytesIO
-import re
 from docx import Document
 from docx.shared import Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml.ns import qn
 import json
 
+from artefactos import artefacto
+from cliente_llm import OPENROUTER_URL, chat_completion
+from manuscrito import Manuscrito
+
 # =====================
 # Configuración Inicial
 # =====================
 
 OPENROUTER_API_KEY = st.secrets["OPENROUTER_API_KEY"]
-API_URL = "https://openrouter.ai/api/v1/chat/completions"
+API_URL = OPENROUTER_URL
 MODEL = "openai/gpt-4o-mini"  # Asegúrate de que este es el nombre correcto del modelo
 
 # =====================
 # Funciones Auxiliares
 # =====================
 
-def generar_contenido(prompt, max_tokens=2000, temperature=0.7, repetition_penalty=1.2, frequency_penalty=0.5):
+def generar_contenido(prompt, max_tokens=2000, temperature=0.7, repetition_penalty=1.2, frequency_penalty=0.5, usar_cache=False):
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {OPENROUTER_API_KEY}"
@@ -39,9 +42,8 @@ def generar_contenido(prompt, max_tokens=2000, temperature=0.7, repetition_penal
         "frequency_penalty": frequency_penalty
     }
     try:
-        response = requests.post(API_URL, headers=headers, json=data, timeout=120)  # Aumentar timeout si es necesario
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        respuesta = chat_completion(API_URL, headers, data, usar_cache=usar_cache, timeout=120)  # Aumentar timeout si es necesario
+        return respuesta["choices"][0]["message"]["content"]
     except requests.exceptions.Timeout:
         st.error("La solicitud a la API de OpenRouter ha excedido el tiempo de espera.")
         return ""
@@ -59,7 +61,7 @@ def generar_contenido(prompt, max_tokens=2000, temperature=0.7, repetition_penal
         st.error(f"Ocurrió un error inesperado: {e}")
         return ""
 
-def exportar_a_docx(contenido_novela, titulo="Novela Mejorada"):
+def exportar_a_docx(manuscrito, titulo="Novela Mejorada"):
     doc = Document()
     try:
         # Configuración de la página
@@ -91,22 +93,24 @@ def exportar_a_docx(contenido_novela, titulo="Novela Mejorada"):
         doc.add_heading(titulo, level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
         doc.add_paragraph("\n")  # Espacio después del título
 
-        # Procesar el contenido
-        for linea in contenido_novela.split('\n'):
-            linea = linea.strip()
-            if not linea:
-                continue
-
-            if re.match(r"^Escena\s+\d+", linea, re.IGNORECASE):
-                p = doc.add_heading(linea, level=2)
-                p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                p.paragraph_format.line_spacing = 1.15
-                p.paragraph_format.space_after = Pt(6)
-            else:
-                p = doc.add_paragraph(linea, style='Normal')
-                p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                p.paragraph_format.line_spacing = 1.15
-                p.paragraph_format.space_after = Pt(6)
+        # Recorrer los capítulos y escenas del manuscrito
+        for capitulo in manuscrito.capitulos:
+            if capitulo.titulo:
+                doc.add_heading(capitulo.titulo, level=1)
+            for escena in capitulo.escenas:
+                if escena.titulo:
+                    p = doc.add_heading(escena.titulo, level=2)
+                    p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+                    p.paragraph_format.line_spacing = 1.15
+                    p.paragraph_format.space_after = Pt(6)
+                for linea in escena.texto.split('\n'):
+                    linea = linea.strip()
+                    if not linea:
+                        continue
+                    p = doc.add_paragraph(linea, style='Normal')
+                    p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+                    p.paragraph_format.line_spacing = 1.15
+                    p.paragraph_format.space_after = Pt(6)
 
         buffer = BytesIO()
         doc.save(buffer)
@@ -130,30 +134,32 @@ def leer_docx(file):
 
 def dividir_en_escenas(texto_novela):
     """
-    Divide el texto de la novela en escenas basándose en delimitadores específicos.
+    Divide el texto de la novela en capítulos y escenas basándose en delimitadores específicos.
     Por ejemplo, se espera que cada escena comience con "Escena X" donde X es un número.
+    Retorna un `Manuscrito` (vacío si no se encontraron escenas).
     """
     try:
-        # Regex para detectar el inicio de una escena
-        escenas = re.split(r'(?i)(Escena\s+\d+)', texto_novela)
-        # Combina los encabezados de escena con su contenido
-        escenas_combinadas = []
-        for i in range(1, len(escenas), 2):
-            encabezado = escenas[i].strip()
-            contenido = escenas[i+1].strip() if i+1 < len(escenas) else ""
-            escenas_combinadas.append(f"{encabezado}\n{contenido}")
-        return escenas_combinadas
+        return Manuscrito.desde_texto(texto_novela)
     except Exception as e:
         st.error(f"Error al dividir la novela en escenas: {e}")
-        return []
+        return Manuscrito()
 
 # =====================
 # Cacheo de Funciones
 # =====================
 
-@st.cache_data(show_spinner=False, ttl=3600)
+# La caché persistente en disco (cache_llm.py) sobrevive a reinicios y redespliegues
 def generar_contenido_cache(prompt, max_tokens=2000, temperature=0.7, repetition_penalty=1.2, frequency_penalty=0.5):
-    return generar_contenido(prompt, max_tokens, temperature, repetition_penalty, frequency_penalty)
+    return generar_contenido(prompt, max_tokens, temperature, repetition_penalty, frequency_penalty, usar_cache=True)
+
+def crear_prompt_mejora(correcciones, contenido):
+    return (
+        f"Corrige los defectos señalados y aplica las mejoras sugeridas en la siguiente escena de una novela. "
+        f"Defectos y mejoras a aplicar:\n{correcciones}\n\n"
+        f"Texto de la escena:\n{contenido}\n\n"
+        f"Por favor, reescribe la escena incorporando las correcciones y mejoras mencionadas. "
+        f"Mantén la coherencia, el estilo y el tono original de la obra."
+    )
 
 # =====================
 # Validación de Entrada
@@ -215,29 +221,27 @@ if st.button("Aplicar Correcciones y Mejoras", key="aplicar_mejoras"):
                 else:
                     # Dividir la novela en escenas
                     escenas = dividir_en_escenas(contenido_novela)
-                    if not escenas:
+                    if not len(escenas):
                         st.error("No se encontraron escenas delimitadas en la novela. Asegúrate de que cada escena comience con 'Escena X' donde X es un número.")
                     else:
-                        escenas_mejoradas = []
+                        manuscrito_mejorado = Manuscrito()
+                        capitulos_mejorados = {}
                         total_escenas = len(escenas)
                         tareas_completadas = 0
 
                         progress_bar = st.progress(0)
                         status_text = st.empty()
 
-                        for escena in escenas:
-                            # Extraer el encabezado de la escena
-                            encabezado = escena.split('\n')[0]
-                            contenido = '\n'.join(escena.split('\n')[1:]).strip()
+                        for capitulo, escena in escenas.escenas():
+                            # Capítulo del manuscrito mejorado que corresponde al original
+                            if id(capitulo) not in capitulos_mejorados:
+                                capitulos_mejorados[id(capitulo)] = manuscrito_mejorado.agregar_capitulo(capitulo.titulo, capitulo.numero)
+                            capitulo_mejorado = capitulos_mejorados[id(capitulo)]
+                            encabezado = escena.titulo or "Escena sin título"
+                            contenido = escena.texto
 
                             # Crear el prompt para mejorar la escena
-                            prompt_mejora = (
-                                f"Corrige los defectos señalados y aplica las mejoras sugeridas en la siguiente escena de una novela. "
-                                f"Defectos y mejoras a aplicar:\n{correcciones}\n\n"
-                                f"Texto de la escena:\n{contenido}\n\n"
-                                f"Por favor, reescribe la escena incorporando las correcciones y mejoras mencionadas. "
-                                f"Mantén la coherencia, el estilo y el tono original de la obra."
-                            )
+                            prompt_mejora = crear_prompt_mejora(correcciones, contenido)
 
                             # Generar el contenido mejorado de la escena
                             contenido_mejorado = generar_contenido_cache(
@@ -250,21 +254,22 @@ if st.button("Aplicar Correcciones y Mejoras", key="aplicar_mejoras"):
 
                             if contenido_mejorado:
                                 # Añadir el encabezado y el contenido mejorado
-                                escena_mejorada = f"{encabezado}\n{contenido_mejorado}"
-                                escenas_mejoradas.append(escena_mejorada)
+                                manuscrito_mejorado.agregar_escena(capitulo_mejorado, contenido_mejorado, escena.titulo, escena.numero)
                             else:
                                 # Si hubo un error, conservar la escena original y notificar al usuario
-                                escenas_mejoradas.append(escena)
+                                manuscrito_mejorado.agregar_escena(capitulo_mejorado, contenido, escena.titulo, escena.numero)
                                 st.warning(f"No se pudo mejorar la escena: {encabezado}")
 
                             tareas_completadas += 1
                             status_text.text(f"Mejorada Escena {tareas_completadas} de {total_escenas}")
                             progress_bar.progress(tareas_completadas / total_escenas)
 
-                        # Unir todas las escenas mejoradas en una sola novela
-                        novela_mejorada = '\n\n'.join(escenas_mejoradas)
+                        # Texto de la novela mejorada para revisarlo en la interfaz
+                        novela_mejorada = manuscrito_mejorado.texto(marcas=False)
 
                         if novela_mejorada:
+                            st.session_state.manuscrito_original = escenas
+                            st.session_state.manuscrito_mejorado = manuscrito_mejorado
                             st.session_state.contenido_mejorado = novela_mejorada
                             st.session_state.novela_mejorada = True
                             st.success("Tu novela ha sido mejorada exitosamente.")
@@ -274,6 +279,30 @@ if st.button("Aplicar Correcciones y Mejoras", key="aplicar_mejoras"):
 # Mostrar el contenido mejorado y permitir la descarga
 if 'contenido_mejorado' in st.session_state and st.session_state.novela_mejorada:
     st.subheader("Paso 3: Revisa y Descarga tu Novela Mejorada")
+
+    # Volver a mejorar una sola escena a partir de su texto original, sin reprocesar toda la novela
+    with st.expander("Volver a mejorar una escena"):
+        pares = list(zip(st.session_state.manuscrito_original.escenas(), st.session_state.manuscrito_mejorado.escenas()))
+        indice = st.selectbox(
+            "Escena:",
+            range(len(pares)),
+            format_func=lambda i: " - ".join(t for t in (pares[i][0][0].titulo, pares[i][0][1].titulo) if t) or f"Fragmento {i + 1}",
+            key="escena_a_mejorar"
+        )
+        indicaciones_escena = st.text_area("Indicaciones adicionales para esta escena (opcional):", key="indicaciones_escena")
+        if st.button("Mejorar de nuevo esta escena", key="mejorar_escena"):
+            (_, escena_original), (capitulo_mejorado, escena_mejorada) = pares[indice]
+            correcciones_escena = f"{correcciones}\n{indicaciones_escena}".strip()
+            with st.spinner("Mejorando la escena..."):
+                # Sin caché, para obtener una versión distinta de la anterior
+                contenido_mejorado = generar_contenido(crear_prompt_mejora(correcciones_escena, escena_original.texto), max_tokens=2000)
+            if contenido_mejorado:
+                st.session_state.manuscrito_mejorado.reemplazar(capitulo_mejorado, escena_mejorada, contenido_mejorado)
+                st.session_state.contenido_mejorado = st.session_state.manuscrito_mejorado.texto(marcas=False)
+                st.success("Escena mejorada de nuevo. Las ediciones manuales del texto se han sustituido por la nueva versión.")
+            else:
+                st.warning("No se pudo mejorar la escena; se conserva la versión anterior.")
+
     contenido_editable_mejorado = st.text_area(
         "Revisa y edita el contenido mejorado si es necesario:", 
         st.session_state.contenido_mejorado, 
@@ -282,7 +311,15 @@ if 'contenido_mejorado' in st.session_state and st.session_state.novela_mejorada
 
     # Botón para descargar el archivo mejorado
     if st.button("Descargar Novela Mejorada", key="descargar_mejorada"):
-        buffer_docx_mejorada = exportar_a_docx(contenido_editable_mejorado, titulo="Novela Mejorada")
+        # Si el texto no se editó se exporta el manuscrito tal cual; si se editó, se vuelve a dividir
+        if contenido_editable_mejorado == st.session_state.contenido_mejorado:
+            manuscrito_final = st.session_state.manuscrito_mejorado
+        else:
+            manuscrito_final = dividir_en_escenas(contenido_editable_mejorado)
+        # El documento se guarda por contenido: sin cambios en el texto no se vuelve a construir
+        buffer_docx_mejorada = artefacto("novela_mejorada_docx",
+                                         lambda: exportar_a_docx(manuscrito_final, titulo="Novela Mejorada"),
+                                         "Novela Mejorada", manuscrito_final.texto())
         if buffer_docx_mejorada:
             st.download_button(
                 label="Descargar Novela Mejorada en DOCX",
@@ -296,7 +333,7 @@ if 'contenido_mejorado' in st.session_state and st.session_state.novela_mejorada
 
     # Botón para resetear la sección de mejora
     if st.button("Mejorar Otra Novela", key="reset_mejorar_novela"):
-        for key in ['contenido_mejorado', 'novela_mejorada']:
+        for key in ['contenido_mejorado', 'manuscrito_original', 'manuscrito_mejorado', 'novela_mejorada']:
             if key in st.session_state:
                 del st.session_state[key]
         st.experimental_rerun()
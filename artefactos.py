@@ -0,0 +1,291 @@
+"""
+Almacén en disco de artefactos exportados (documentos Word), direccionados por contenido.
+
+Cada exportación se guarda bajo el hash de su tipo, del contenido exportado y
+de los ajustes de exportación (título, idioma...). Mientras el contenido no
+cambie, las reejecuciones del script de Streamlit sirven los bytes guardados a
+`st.download_button` en lugar de reconstruir el documento con python-docx;
+cualquier cambio en el contenido produce otra clave y, por tanto, un documento
+nuevo. Los artefactos menos usados se borran cuando el almacén supera su tamaño
+máximo.
+
+Los documentos de una generación larga (un libro, una novela) se escriben
+además por partes con `documento_incremental`: cada capítulo se añade al
+documento en cuanto se termina y el documento se guarda en el almacén, así que
+se puede descargar lo generado hasta el momento y el documento final está listo
+en cuanto llega el último capítulo.
+
+Configuración mediante variables de entorno:
+    LLM_ARTEFACTOS_DIR     Directorio de los artefactos (por defecto `.cache_llm/artefactos`).
+    LLM_ARTEFACTOS_MAX_MB  Tamaño máximo del almacén en MB (por defecto 500).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import weakref
+from io import BytesIO
+
+
+def clave_artefacto(tipo, *elementos):
+    """Calcula la clave de un artefacto a partir de su tipo y de los elementos que lo definen."""
+    canonico = json.dumps([tipo, *elementos], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+class AlmacenArtefactos:
+    """
+    Artefactos exportados en disco, seguros entre hilos y entre procesos.
+
+    Parámetros:
+        directorio (str): Directorio donde se guardan los artefactos.
+        tamano_maximo (int): Tamaño total en bytes a partir del cual se borran los menos usados.
+    """
+
+    def __init__(self, directorio, tamano_maximo=500 * 1024 * 1024):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.tamano_maximo = tamano_maximo
+        self._lock = threading.Lock()
+        self._construyendo = {}
+        self._aciertos = 0
+        self._construidos = 0
+
+    def ruta(self, clave, extension=".docx"):
+        return os.path.join(self.directorio, clave + extension)
+
+    def obtener(self, clave, extension=".docx"):
+        """Devuelve los bytes del artefacto o None si no está guardado."""
+        ruta = self.ruta(clave, extension)
+        try:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+        except FileNotFoundError:
+            return None
+        # Marcar el artefacto como usado para que la purga borre antes los demás
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+        return datos
+
+    def guardar(self, clave, datos, extension=".docx"):
+        """Guarda el artefacto de forma atómica (un lector nunca ve un archivo a medias)."""
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(datos)
+            os.replace(temporal, self.ruta(clave, extension))
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        self._purgar()
+
+    def obtener_o_crear(self, clave, construir, extension=".docx"):
+        """
+        Devuelve el artefacto `clave`, construyéndolo con `construir()` solo si no está guardado.
+
+        Si varias sesiones piden a la vez el mismo artefacto, solo una lo construye.
+
+        Parámetros:
+            construir (callable): Devuelve los bytes del artefacto (o un `BytesIO`), o None si falla.
+
+        Retorna:
+            bytes: El contenido del artefacto, o None si `construir` falló.
+        """
+        datos = self.obtener(clave, extension)
+        if datos is not None:
+            with self._lock:
+                self._aciertos += 1
+            return datos
+        with self._lock:
+            lock_clave = self._construyendo.setdefault(clave, threading.Lock())
+        with lock_clave:
+            datos = self.obtener(clave, extension)
+            if datos is None:
+                datos = construir()
+                if hasattr(datos, "getvalue"):
+                    datos = datos.getvalue()
+                if datos is not None:
+                    self.guardar(clave, datos, extension)
+                    with self._lock:
+                        self._construidos += 1
+            else:
+                with self._lock:
+                    self._aciertos += 1
+        with self._lock:
+            self._construyendo.pop(clave, None)
+        return datos
+
+    def eliminar(self, clave, extension=".docx"):
+        try:
+            os.remove(self.ruta(clave, extension))
+        except FileNotFoundError:
+            pass
+
+    def estadisticas(self):
+        with self._lock:
+            return {"aciertos": self._aciertos, "construidos": self._construidos}
+
+    def _purgar(self):
+        artefactos = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith(".tmp"):
+                continue
+            try:
+                info = os.stat(os.path.join(self.directorio, nombre))
+            except FileNotFoundError:
+                continue
+            artefactos.append((info.st_mtime, info.st_size, nombre))
+        total = sum(tamano for _, tamano, _ in artefactos)
+        for _, tamano, nombre in sorted(artefactos):
+            if total <= self.tamano_maximo:
+                break
+            try:
+                os.remove(os.path.join(self.directorio, nombre))
+            except FileNotFoundError:
+                pass
+            total -= tamano
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def obtener_artefactos():
+    """Devuelve el almacén de artefactos del proceso, creándolo la primera vez."""
+    global _almacen
+    if _almacen is None:
+        with _almacen_lock:
+            if _almacen is None:
+                try:
+                    max_mb = float(os.environ.get("LLM_ARTEFACTOS_MAX_MB", 500))
+                except ValueError:
+                    max_mb = 500
+                _almacen = AlmacenArtefactos(
+                    os.environ.get("LLM_ARTEFACTOS_DIR", os.path.join(".cache_llm", "artefactos")),
+                    tamano_maximo=int(max_mb * 1024 * 1024),
+                )
+    return _almacen
+
+
+def artefacto(tipo, construir, *elementos, extension=".docx"):
+    """
+    Atajo para exportar con memoización: la clave es el hash de `tipo` y `elementos`.
+
+    Los `elementos` deben describir por completo el resultado (el contenido y
+    los ajustes de exportación) y ser serializables en JSON. Si cambia el
+    formato que produce un exportador, cambia también su `tipo` para no servir
+    los documentos guardados con el formato anterior.
+    """
+    return obtener_artefactos().obtener_o_crear(clave_artefacto(tipo, *elementos), construir, extension)
+
+
+class DocumentoIncremental:
+    """
+    Documento Word que se escribe por partes (capítulo a capítulo) mientras se genera.
+
+    Después de cada parte el documento se guarda en el almacén de artefactos,
+    de forma atómica, con su propia clave: cualquier sesión puede descargar lo
+    escrito hasta el momento. El documento abierto se conserva en memoria entre
+    partes para no volver a leerlo; tras reiniciar el proceso se abre desde el
+    almacén. La revisión del documento (propiedades básicas) cuenta las partes
+    añadidas, para saber dónde continuar al reanudar una generación.
+
+    Parámetros:
+        almacen (AlmacenArtefactos): Almacén donde se guarda el documento.
+        clave (str): Clave del documento en el almacén.
+    """
+
+    def __init__(self, almacen, clave):
+        self.almacen = almacen
+        self.clave = clave
+        self._lock = threading.Lock()
+        self._documento = None
+
+    def _abrir(self, iniciar):
+        if self._documento is None:
+            # python-docx solo hace falta para escribir documentos, no para servirlos
+            from docx import Document
+
+            datos = self.almacen.obtener(self.clave)
+            if datos is not None:
+                self._documento = Document(BytesIO(datos))
+            else:
+                self._documento = Document()
+                if iniciar is not None:
+                    iniciar(self._documento)
+                self._documento.core_properties.revision = 1
+        return self._documento
+
+    def partes(self):
+        """Número de partes que contiene el documento guardado (0 si aún no existe)."""
+        with self._lock:
+            if self._documento is None and self.almacen.obtener(self.clave) is None:
+                return 0
+            return self._abrir(None).core_properties.revision - 1
+
+    def agregar(self, escribir, iniciar=None):
+        """
+        Añade una parte con `escribir(documento)` y guarda el documento.
+
+        Parámetros:
+            escribir (callable): Escribe la parte en el `docx.Document`.
+            iniciar (callable): Prepara el documento (página, estilos, título) si aún no existe.
+        """
+        with self._lock:
+            documento = self._abrir(iniciar)
+            escribir(documento)
+            documento.core_properties.revision += 1
+            buffer = BytesIO()
+            documento.save(buffer)
+            self.almacen.guardar(self.clave, buffer.getvalue())
+
+    def contenido(self):
+        """Devuelve los bytes del documento escrito hasta el momento, o None si aún no tiene partes."""
+        return self.almacen.obtener(self.clave)
+
+    def publicar(self, tipo, *elementos):
+        """
+        Guarda el documento también como el artefacto `tipo` de `elementos` (ver `artefacto`),
+        para que la exportación final lo sirva sin reconstruirlo.
+        """
+        datos = self.contenido()
+        if datos is not None:
+            self.almacen.guardar(clave_artefacto(tipo, *elementos), datos)
+        return datos
+
+    def cerrar(self):
+        """Libera el documento en memoria (se vuelve a abrir desde el almacén si se añaden más partes)."""
+        with self._lock:
+            self._documento = None
+
+    def eliminar(self):
+        with self._lock:
+            self._documento = None
+            self.almacen.eliminar(self.clave)
+
+
+# Solo se conservan los documentos que algún trabajo o sesión sigue usando
+_documentos = weakref.WeakValueDictionary()
+_documentos_lock = threading.Lock()
+
+
+def documento_incremental(tipo, id):
+    """
+    Devuelve el documento incremental `tipo` de la generación `id` (un libro, una ejecución...).
+
+    Dentro del proceso siempre se devuelve el mismo objeto para el mismo documento,
+    de modo que el trabajo que escribe y las sesiones que leen comparten su lock.
+    El registro no retiene los documentos: al dejar de usarse se liberan.
+    """
+    clave = clave_artefacto(tipo, id)
+    with _documentos_lock:
+        documento = _documentos.get(clave)
+        if documento is None:
+            documento = DocumentoIncremental(obtener_artefactos(), clave)
+            _documentos[clave] = documento
+        return documento
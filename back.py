@@ -1,6 +1,12 @@
 import streamlit as st
 import requests
-import re
+
+from enrutador import chat_enrutado, claves_api
+from manuscrito import Manuscrito
+from salida_json import TEXTO, objeto, pedir_json
+
+# Esquema de los elementos de la novela que se piden en JSON
+ESQUEMA_ELEMENTOS = objeto(personajes=TEXTO, trama=TEXTO, ambientacion=TEXTO, tecnica_narrativa=TEXTO)
 
 # Configuración de la página
 st.set_page_config(page_title="Asistente para Escribir Novelas", layout="wide")
@@ -9,31 +15,26 @@ st.set_page_config(page_title="Asistente para Escribir Novelas", layout="wide")
 st.title("📚 Asistente para Escribir tu Novela Capítulo por Capítulo")
 
 # Función para llamar a la API de Together con el modelo Mixtral-8x7B-Instruct-v0.1
-def call_together_api(prompt, max_tokens=6000):
-    api_url = "https://api.together.xyz/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {st.secrets['TOGETHER_API_KEY']}",
-        "Content-Type": "application/json"
-    }
+# `formato` es el `response_format` de una respuesta JSON
+def call_together_api(prompt, max_tokens=6000, temperature=0.7, formato=None):
     payload = {
-        "model": "qwen/qwen-2.5-72b-instruct",
         "messages": [
             {"role": "system", "content": "Eres un escritor creativo que ayuda a desarrollar novelas."},
             {"role": "user", "content": prompt}
         ],
         "max_tokens": max_tokens,  # Ajustado para escenas de 6000 tokens
-        "temperature": 0.7,
+        "temperature": temperature,
         "top_p": 0.7,
         "top_k": 50,
         "repetition_penalty": 1.2,
         "stop": ["<|eot_id|>"],
         "stream": False
     }
+    if formato:
+        payload["response_format"] = formato
 
     try:
-        response = requests.post(api_url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
+        data = chat_enrutado("qwen-2.5-72b", payload, claves_api(st.secrets), continuar_si_truncado=True)
         # Verificar si la respuesta contiene errores
         if 'error' in data:
             st.error(f"Error en la API: {data['error']['message']}")
@@ -50,8 +51,8 @@ def call_together_api(prompt, max_tokens=6000):
 # Inicialización del estado de la sesión
 if 'elements' not in st.session_state:
     st.session_state.elements = {}
-if 'chapters' not in st.session_state:
-    st.session_state.chapters = []  # Ahora cada capítulo será una lista de escenas
+if 'manuscrito' not in st.session_state:
+    st.session_state.manuscrito = Manuscrito()  # Capítulos con sus escenas (manuscrito.py)
 if 'genre' not in st.session_state:
     st.session_state.genre = "Fantasía"  # Valor por defecto
 if 'synopsis' not in st.session_state:
@@ -78,40 +79,34 @@ def generar_elementos():
         "1. **Personajes principales:** Describe al menos tres personajes principales con sus características, incluyendo personalidad, apariencia y motivaciones.\n"
         "2. **Trama:** Esboza la trama principal de la novela, incluyendo el conflicto central y los puntos de giro principales.\n"
         "3. **Ambientación:** Describe el mundo o entorno donde se desarrolla la historia, incluyendo detalles geográficos, culturales y temporales.\n"
-        "4. **Técnica narrativa:** Indica el punto de vista (primera persona, tercera persona, etc.) y el estilo narrativo que se utilizará (descriptivo, dinámico, etc.).\n"
+        "4. **Técnica narrativa:** Indica el punto de vista (primera persona, tercera persona, etc.) y el estilo narrativo que se utilizará (descriptivo, dinámico, etc.).\n\n"
+        "Responde únicamente con un objeto JSON, sin texto adicional, con los campos de texto "
+        "\"personajes\", \"trama\", \"ambientacion\" y \"tecnica_narrativa\".\n"
     )
     with st.spinner("Generando elementos de la novela..."):
-        resultado = call_together_api(prompt)
-    if resultado:
-        # Parsear el resultado asumiendo que está en formato Markdown
-        try:
-            elementos = {}
-            # Utilizamos expresiones regulares para extraer las secciones
-            personajes_match = re.search(r"\*\*Personajes principales:\*\*\s*(.*?)(?=\n\*\*Trama:|\Z)", resultado, re.DOTALL)
-            trama_match = re.search(r"\*\*Trama:\*\*\s*(.*?)(?=\n\*\*Ambientación:|\Z)", resultado, re.DOTALL)
-            ambientacion_match = re.search(r"\*\*Ambientación:\*\*\s*(.*?)(?=\n\*\*Técnica narrativa:|\Z)", resultado, re.DOTALL)
-            tecnica_match = re.search(r"\*\*Técnica narrativa:\*\*\s*(.*)", resultado, re.DOTALL)
-
-            if personajes_match:
-                elementos['personajes'] = personajes_match.group(1).strip()
-            if trama_match:
-                elementos['trama'] = trama_match.group(1).strip()
-            if ambientacion_match:
-                elementos['ambientacion'] = ambientacion_match.group(1).strip()
-            if tecnica_match:
-                elementos['tecnica_narrativa'] = tecnica_match.group(1).strip()
+        # Si la respuesta no cumple el esquema, se repara una sola vez con temperatura 0
+        elementos = pedir_json(
+            lambda texto, formato: call_together_api(texto, formato=formato),
+            prompt, ESQUEMA_ELEMENTOS, "elementos_novela",
+            reparar=lambda texto, formato: call_together_api(texto, temperature=0, formato=formato),
+        )
+    if elementos:
+        st.session_state.elements = {clave: valor.strip() for clave, valor in elementos.items() if valor.strip()}
+        st.success("Elementos generados exitosamente.")
+    else:
+        st.error("No se pudieron extraer los elementos de la respuesta de la API.")
 
-            if elementos:
-                st.session_state.elements = elementos
-                st.success("Elementos generados exitosamente.")
-            else:
-                st.error("No se pudieron extraer los elementos de la respuesta de la API.")
-        except Exception as e:
-            st.error(f"Error al procesar los elementos: {e}")
+# Función para añadir al manuscrito un capítulo con las escenas generadas
+def agregar_capitulo(manuscrito, escenas):
+    numero = len(manuscrito.capitulos) + 1
+    capitulo = manuscrito.agregar_capitulo(f"Capítulo {numero}", numero)
+    for i, texto in enumerate(escenas, 1):
+        manuscrito.agregar_escena(capitulo, texto, f"Escena {i}", i)
 
 # Función para generar un capítulo con tres escenas
 def generar_capitulo(idea=None):
-    if not st.session_state.chapters:
+    manuscrito = st.session_state.manuscrito
+    if not manuscrito.capitulos:
         # Generar el primer capítulo basado en los elementos
         if not st.session_state.elements:
             st.error("Primero debes generar los elementos de la novela.")
@@ -141,18 +136,18 @@ def generar_capitulo(idea=None):
                     st.error(f"Error al generar la escena {i}.")
                     return
         if len(escenas) == num_scenes:
-            st.session_state.chapters.append(escenas)
+            agregar_capitulo(manuscrito, escenas)
             st.success("Capítulo generado exitosamente con tres escenas.")
     else:
         # Generar capítulos subsecuentes basados en el anterior y la idea del usuario
         if not idea:
             st.error("Por favor, proporciona una idea para el siguiente capítulo.")
             return
-        ultimo_capitulo = st.session_state.chapters[-1]
+        ultimo_capitulo = manuscrito.capitulos[-1]
         prompt_base = (
             f"Basándote en el siguiente capítulo y la idea proporcionada, escribe una nueva escena de la novela del género **{st.session_state.genre}**. "
             "La escena debe incluir diálogos entre los personajes utilizando la raya (—) y mantener un estilo narrativo coherente y atractivo.\n\n"
-            f"**Último Capítulo:**\n" + "\n".join(ultimo_capitulo) + "\n\n"
+            f"**Último Capítulo:**\n" + "\n".join(escena.texto for escena in ultimo_capitulo.escenas) + "\n\n"
             f"**Idea para el siguiente capítulo:** {idea}\n\n"
             "Asegúrate de que los diálogos estén correctamente formateados utilizando la raya (—) y que cada diálogo sea claro y relevante para el desarrollo de la trama.\n"
         )
@@ -171,7 +166,7 @@ def generar_capitulo(idea=None):
                     st.error(f"Error al generar la escena {i}.")
                     return
         if len(escenas) == num_scenes:
-            st.session_state.chapters.append(escenas)
+            agregar_capitulo(manuscrito, escenas)
             st.success("Nuevo capítulo generado exitosamente con tres escenas.")
 
 # Función para editar los elementos de la novela
@@ -256,12 +251,13 @@ def mostrar_estado():
     st.sidebar.write("### Elementos:")
     st.sidebar.write(st.session_state.elements)
     st.sidebar.write("### Capítulos Generados:")
-    st.sidebar.write(len(st.session_state.chapters))
+    st.sidebar.write(len(st.session_state.manuscrito.capitulos))
 
 # Interfaz de la aplicación
 st.header("📖 Genera tu Novela")
 
-if not st.session_state.chapters:
+manuscrito = st.session_state.manuscrito
+if not manuscrito.capitulos:
     # Paso 0: Seleccionar el Género
     st.subheader("Paso 0: Seleccionar el Género de la Novela")
     generos = [
@@ -304,19 +300,19 @@ if not st.session_state.chapters:
         st.subheader("Paso 4: Generar el Primer Capítulo")
         if st.button("Generar Primer Capítulo", key="generar_primer_capitulo_btn"):
             generar_capitulo()
-        if st.session_state.chapters:
+        if manuscrito.capitulos:
             st.markdown("### **Capítulo 1:**")
-            for idx, escena in enumerate(st.session_state.chapters[0], 1):
-                st.markdown(f"**Escena {idx}:**")
-                st.write(escena)
+            for escena in manuscrito.capitulos[0].escenas:
+                st.markdown(f"**{escena.titulo}:**")
+                st.write(escena.texto)
 else:
     # Generar capítulos adicionales
     st.subheader("Generar Nuevos Capítulos")
     st.markdown("### **Último Capítulo Generado:**")
-    ultimo_capitulo = st.session_state.chapters[-1]
-    for idx, escena in enumerate(ultimo_capitulo, 1):
-        st.markdown(f"**Escena {idx}:**")
-        st.write(escena)
+    ultimo_capitulo = manuscrito.capitulos[-1]
+    for escena in ultimo_capitulo.escenas:
+        st.markdown(f"**{escena.titulo}:**")
+        st.write(escena.texto)
     st.markdown("---")
     # Usamos un formulario para manejar mejor la entrada del usuario
     with st.form(key='idea_form'):
@@ -327,21 +323,21 @@ else:
             st.error("La idea para el siguiente capítulo no puede estar vacía.")
         else:
             generar_capitulo(idea=idea)
-    if st.session_state.chapters:
-        st.markdown(f"### **Capítulo {len(st.session_state.chapters)}:**")
-        nuevo_capitulo = st.session_state.chapters[-1]
-        for idx, escena in enumerate(nuevo_capitulo, 1):
-            st.markdown(f"**Escena {idx}:**")
-            st.write(escena)
+    if manuscrito.capitulos:
+        nuevo_capitulo = manuscrito.capitulos[-1]
+        st.markdown(f"### **{nuevo_capitulo.titulo}:**")
+        for escena in nuevo_capitulo.escenas:
+            st.markdown(f"**{escena.titulo}:**")
+            st.write(escena.texto)
 
 # Mostrar todos los capítulos generados
-if st.session_state.chapters:
+if manuscrito.capitulos:
     st.sidebar.header("🔍 Navegar por los Capítulos")
-    for idx, cap in enumerate(st.session_state.chapters, 1):
-        with st.sidebar.expander(f"Capítulo {idx}"):
-            for s_idx, escena in enumerate(cap, 1):
-                st.markdown(f"**Escena {s_idx}:**")
-                st.write(escena)
+    for cap in manuscrito.capitulos:
+        with st.sidebar.expander(f"{cap.titulo} ({cap.palabras} palabras)"):
+            for escena in cap.escenas:
+                st.markdown(f"**{escena.titulo}:**")
+                st.write(escena.texto)
 
 # Mostrar el estado de la sesión (opcional, para depuración)
 mostrar_estado()
@@ -0,0 +1,144 @@
+"""
+Caché persistente de respuestas de LLM en SQLite.
+
+Las respuestas se indexan por un hash del modelo, los mensajes y los parámetros
+de muestreo, de modo que repetir el mismo análisis o la misma reescritura no
+vuelve a llamar a la API, incluso después de reiniciar la aplicación.
+
+Configuración mediante variables de entorno:
+    LLM_CACHE_RUTA    Ruta del archivo SQLite (por defecto `.cache_llm/respuestas.sqlite3`).
+    LLM_CACHE_MAX_MB  Tamaño máximo antes de expulsar entradas (por defecto 200).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Claves del payload que no cambian el contenido de la respuesta
+_CLAVES_IGNORADAS = {"stream"}
+
+
+class CacheLLM:
+    """
+    Caché de respuestas direccionada por contenido con expulsión por tamaño (LRU).
+
+    Parámetros:
+        ruta (str): Archivo SQLite donde se guardan las respuestas.
+        tamano_maximo (int): Tamaño máximo en bytes de las respuestas guardadas.
+    """
+
+    def __init__(self, ruta, tamano_maximo=200 * 1024 * 1024):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ruta = ruta
+        self.tamano_maximo = tamano_maximo
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS respuestas ("
+            " clave TEXT PRIMARY KEY,"
+            " respuesta TEXT NOT NULL,"
+            " tamano INTEGER NOT NULL,"
+            " ultimo_acceso REAL NOT NULL)"
+        )
+        self._conexion.commit()
+
+    @staticmethod
+    def clave(payload):
+        """Calcula la clave SHA-256 de un payload de chat (modelo, mensajes y parámetros)."""
+        relevante = {k: v for k, v in payload.items() if k not in _CLAVES_IGNORADAS}
+        canonico = json.dumps(relevante, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+    def obtener(self, clave):
+        """Devuelve la respuesta guardada para `clave` o None si no existe."""
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT respuesta FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            self._conexion.execute(
+                "UPDATE respuestas SET ultimo_acceso = ? WHERE clave = ?", (time.time(), clave)
+            )
+            self._conexion.commit()
+        return json.loads(fila[0])
+
+    def guardar(self, clave, respuesta):
+        """Guarda una respuesta y expulsa las menos usadas si se supera el tamaño máximo."""
+        texto = json.dumps(respuesta, ensure_ascii=False)
+        tamano = len(texto.encode("utf-8"))
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, respuesta, tamano, ultimo_acceso) VALUES (?, ?, ?, ?)",
+                (clave, texto, tamano, time.time()),
+            )
+            self._expulsar()
+            self._conexion.commit()
+
+    def _expulsar(self):
+        total = self._conexion.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()[0]
+        if total <= self.tamano_maximo:
+            return
+        filas = self._conexion.execute(
+            "SELECT clave, tamano FROM respuestas ORDER BY ultimo_acceso ASC"
+        ).fetchall()
+        expulsadas = []
+        for clave, tamano in filas:
+            if total <= self.tamano_maximo:
+                break
+            expulsadas.append((clave,))
+            total -= tamano
+        self._conexion.executemany("DELETE FROM respuestas WHERE clave = ?", expulsadas)
+
+    def estadisticas(self):
+        """
+        Devuelve los contadores de la caché.
+
+        Retorna:
+            dict: aciertos, fallos, número de entradas y bytes ocupados.
+        """
+        with self._lock:
+            entradas, tamano = self._conexion.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM respuestas"
+            ).fetchone()
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "entradas": entradas,
+            "bytes": tamano,
+        }
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache():
+    """Devuelve la caché compartida del proceso, creándola la primera vez."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    max_mb = float(os.environ.get("LLM_CACHE_MAX_MB", 200))
+                except ValueError:
+                    max_mb = 200
+                _cache = CacheLLM(
+                    os.environ.get("LLM_CACHE_RUTA", os.path.join(".cache_llm", "respuestas.sqlite3")),
+                    tamano_maximo=int(max_mb * 1024 * 1024),
+                )
+    return _cache
@@ -1,7 +1,6 @@
 # app.py
 
 import streamlit as st
-import requests
 import time
 from docx import Document
 from docx.shared import Inches, Pt
@@ -10,9 +9,11 @@ import base64
 from io import BytesIO
 import re
 
+from cliente_llm import OPENROUTER_URL, TOGETHER_IMAGES_URL, post_limitado
+
 # Function to generate chapter content using OpenRouter API
 def generate_chapter(topic):
-    api_url = "https://openrouter.ai/api/v1/chat/completions"
+    api_url = OPENROUTER_URL
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}"
@@ -44,7 +45,7 @@ def generate_chapter(topic):
         ]
     }
 
-    response = requests.post(api_url, headers=headers, json=data)
+    response = post_limitado(api_url, headers, data)
     if response.status_code == 200:
         return response.json()['choices'][0]['message']['content']
     else:
@@ -53,7 +54,7 @@ def generate_chapter(topic):
 
 # Function to generate an illustration using Together API
 def generate_image(topic, chapter_number, img_num):
-    api_url = "https://api.together.xyz/v1/images/generations"
+    api_url = TOGETHER_IMAGES_URL
     headers = {
         "Authorization": f"Bearer {st.secrets['TOGETHER_API_KEY']}",
         "Content-Type": "application/json"
@@ -73,7 +74,7 @@ def generate_image(topic, chapter_number, img_num):
         "response_format": "b64_json"
     }
 
-    response = requests.post(api_url, headers=headers, json=data)
+    response = post_limitado(api_url, headers, data)
     if response.status_code == 200:
         image_b64 = response.json()['data'][0]['b64_json']
         image_bytes = base64.b64decode(image_b64)
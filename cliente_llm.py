@@ -0,0 +1,444 @@
+"""
+Cliente HTTP compartido para las llamadas a OpenRouter y Together.
+
+Todas las aplicaciones usan una única sesión de `requests` por proceso, con un
+pool de conexiones dimensionado, keep-alive y timeouts configurables, en lugar
+de crear una sesión nueva (y un nuevo saludo TLS) en cada llamada.
+
+Configuración mediante variables de entorno:
+    LLM_POOL_CONEXIONES   Número de pools por host (por defecto 10).
+    LLM_POOL_TAMANO       Conexiones máximas por pool (por defecto 20).
+    LLM_TIMEOUT_CONEXION  Segundos para establecer la conexión (por defecto 10).
+    LLM_TIMEOUT_LECTURA   Segundos de espera de la respuesta (por defecto 300).
+    LLM_OPENROUTER_BASE   URL base de OpenRouter (por defecto https://openrouter.ai).
+    LLM_TOGETHER_BASE     URL base de Together (por defecto https://api.together.xyz).
+    LLM_COBERTURA         Si vale 1, duplica las llamadas que superan el p95 de latencia.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache_llm import obtener_cache
+from limitador import ESTADOS_LIMITADOS, obtener_limitador, proveedor_de_url
+from plazos import latencias, plazo_actual
+from telemetria import registrar_llamada, uso_de_respuesta
+
+# Las bases se pueden redirigir (p. ej. al servidor_simulado.py) con variables de entorno
+OPENROUTER_BASE = os.environ.get("LLM_OPENROUTER_BASE", "https://openrouter.ai").rstrip("/")
+TOGETHER_BASE = os.environ.get("LLM_TOGETHER_BASE", "https://api.together.xyz").rstrip("/")
+OPENROUTER_URL = OPENROUTER_BASE + "/api/v1/chat/completions"
+TOGETHER_URL = TOGETHER_BASE + "/v1/chat/completions"
+TOGETHER_IMAGES_URL = TOGETHER_BASE + "/v1/images/generations"
+
+# Reintentos cuando el proveedor responde 429/503 (la espera la decide el limitador)
+REINTENTOS_LIMITE = 4
+
+# Segundos mínimos entre dos llamadas a `al_recibir` durante el streaming
+INTERVALO_AL_RECIBIR = 0.1
+
+# Continuaciones máximas cuando una respuesta se corta por `max_tokens`
+MAX_CONTINUACIONES = 3
+MENSAJE_CONTINUACION = (
+    "Continúa el texto exactamente donde se interrumpió, sin repetir nada de lo anterior "
+    "y sin añadir comentarios."
+)
+
+
+def _entero_entorno(nombre, defecto):
+    try:
+        return int(os.environ.get(nombre, defecto))
+    except ValueError:
+        return defecto
+
+
+def _decimal_entorno(nombre, defecto):
+    try:
+        return float(os.environ.get(nombre, defecto))
+    except ValueError:
+        return defecto
+
+
+class ClienteHTTP:
+    """
+    Sesión HTTP reutilizable con pool de conexiones y contadores de reutilización.
+
+    Parámetros:
+        pool_conexiones (int): Número de pools (hosts) que se mantienen abiertos.
+        pool_tamano (int): Conexiones simultáneas máximas por host.
+        timeout_conexion (float): Timeout de conexión en segundos.
+        timeout_lectura (float): Timeout de lectura en segundos.
+    """
+
+    def __init__(self, pool_conexiones=10, pool_tamano=20, timeout_conexion=10, timeout_lectura=300):
+        self.timeout = (timeout_conexion, timeout_lectura)
+        self._lock = threading.Lock()
+        self._peticiones = 0
+        self.sesion = requests.Session()
+        reintentos = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
+        self.adaptador = HTTPAdapter(
+            pool_connections=pool_conexiones,
+            pool_maxsize=pool_tamano,
+            max_retries=reintentos,
+        )
+        self.sesion.mount("https://", self.adaptador)
+        self.sesion.mount("http://", self.adaptador)
+        self.sesion.headers.update({"Connection": "keep-alive"})
+
+    def post(self, url, timeout=None, **kwargs):
+        """
+        Envía una petición POST usando la sesión compartida.
+
+        Si no se indica `timeout`, se usan los timeouts configurados del cliente.
+        """
+        with self._lock:
+            self._peticiones += 1
+        return self.sesion.post(url, timeout=timeout or self.timeout, **kwargs)
+
+    def estadisticas(self):
+        """
+        Devuelve los contadores de uso del pool.
+
+        Retorna:
+            dict: peticiones enviadas, conexiones abiertas y conexiones reutilizadas.
+        """
+        conexiones = 0
+        peticiones_pool = 0
+        pools = self.adaptador.poolmanager.pools
+        for clave in list(pools.keys()):
+            pool = pools.get(clave)
+            if pool is None:
+                continue
+            conexiones += pool.num_connections
+            peticiones_pool += pool.num_requests
+        return {
+            "peticiones": self._peticiones,
+            "conexiones_nuevas": conexiones,
+            "conexiones_reutilizadas": max(0, peticiones_pool - conexiones),
+        }
+
+    def cerrar(self):
+        """Cierra todas las conexiones del pool."""
+        self.sesion.close()
+
+
+def leer_eventos_sse(response):
+    """
+    Genera los eventos JSON de una respuesta en streaming (server-sent events).
+
+    Ignora las líneas de comentario (keep-alive) y termina con el evento `[DONE]`.
+    """
+    # Las respuestas SSE no suelen declarar charset; sin esto se decodifican como latin-1
+    response.encoding = "utf-8"
+    for linea in response.iter_lines(decode_unicode=True):
+        if not linea or linea.startswith(":") or not linea.startswith("data:"):
+            continue
+        datos = linea[len("data:"):].strip()
+        if datos == "[DONE]":
+            break
+        try:
+            yield json.loads(datos)
+        except json.JSONDecodeError:
+            continue
+
+
+def chat_en_streaming(url, headers, payload, al_recibir=None, timeout=None):
+    """
+    Envía una petición de chat con `stream=True` y acumula el texto recibido.
+
+    Parámetros:
+        url (str): Endpoint de chat completions.
+        headers (dict): Cabeceras de la petición (incluida la autorización).
+        payload (dict): Cuerpo de la petición; se fuerza `"stream": True`.
+        al_recibir (callable): Función opcional que recibe el texto acumulado a
+            medida que llegan fragmentos (como mucho cada `INTERVALO_AL_RECIBIR`
+            segundos, y una última vez con el texto completo).
+        timeout: Timeout opcional; por defecto el del cliente compartido.
+
+    Retorna:
+        dict: Respuesta con la misma forma que la no-streaming
+            (`choices[0].message.content`, `finish_reason` y `usage`).
+    """
+    payload = dict(payload, stream=True)
+    texto = ""
+    notificado = 0
+    ultima_notificacion = 0.0
+    finish_reason = None
+    usage = None
+    response = post_limitado(url, headers, payload, stream=True, timeout=timeout)
+    error = None
+    try:
+        response.raise_for_status()
+        for evento in leer_eventos_sse(response):
+            if "error" in evento:
+                raise requests.exceptions.HTTPError(f"Error en streaming: {evento['error']}", response=response)
+            if evento.get("usage"):
+                usage = evento["usage"]
+            for choice in evento.get("choices", []):
+                delta = choice.get("delta") or {}
+                if delta.get("content"):
+                    texto += delta["content"]
+                    # Limitar las actualizaciones: cada una vuelve a pintar todo el texto acumulado
+                    if al_recibir is not None and time.monotonic() - ultima_notificacion >= INTERVALO_AL_RECIBIR:
+                        al_recibir(texto)
+                        notificado = len(texto)
+                        ultima_notificacion = time.monotonic()
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+        if al_recibir is not None and notificado < len(texto):
+            al_recibir(texto)
+    except requests.exceptions.RequestException as e:
+        error = e
+        raise
+    finally:
+        response.close()
+        # En streaming la llamada no termina hasta consumir el último evento
+        _registrar_respuesta(url, payload, response, response.inicio_llamada, response.reintentos,
+                             usage=usage, error=error)
+    return {
+        "choices": [{
+            "message": {"role": "assistant", "content": texto},
+            "finish_reason": finish_reason,
+        }],
+        "usage": usage,
+    }
+
+
+def _cerrar_si_responde(futuro):
+    if not futuro.cancelled() and futuro.exception() is None:
+        futuro.result().close()
+
+
+def post_con_cobertura(url, headers, payload, timeout=None):
+    """
+    Envía la petición y, si tarda más que el p95 de latencia, lanza un duplicado.
+
+    Gana la primera respuesta correcta; la otra se descarta al terminar. Sin
+    muestras suficientes de latencia se comporta como `post_limitado`.
+    """
+    umbral = latencias.percentil((proveedor_de_url(url), payload.get("model")))
+    if umbral is None:
+        return post_limitado(url, headers, payload, timeout=timeout)
+    def lanzar():
+        # Copiar el contexto para que el hilo herede el plazo del trabajo
+        return _ejecutor_cobertura.submit(contextvars.copy_context().run, post_limitado, url, headers, payload,
+                                          timeout=timeout)
+
+    futuros = [lanzar()]
+    hechos, _ = wait(futuros, timeout=umbral)
+    if not hechos:
+        futuros.append(lanzar())
+    pendientes = set(futuros)
+    ultimo_error = None
+    ultima_respuesta = None
+    while pendientes:
+        hechos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            try:
+                response = futuro.result()
+            except requests.exceptions.RequestException as e:
+                ultimo_error = e
+                continue
+            if response.ok:
+                for otro in pendientes:
+                    otro.add_done_callback(_cerrar_si_responde)
+                return response
+            ultima_respuesta = response
+    if ultima_respuesta is not None:
+        return ultima_respuesta
+    raise ultimo_error
+
+
+def _solicitar(url, headers, payload, al_recibir, timeout, cobertura=False):
+    if al_recibir is not None:
+        return chat_en_streaming(url, headers, payload, al_recibir=al_recibir, timeout=timeout)
+    if cobertura:
+        response = post_con_cobertura(url, headers, payload, timeout=timeout)
+    else:
+        response = post_limitado(url, headers, payload, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def _continuar_truncada(url, headers, payload, respuesta, al_recibir, timeout, cobertura=False):
+    """
+    Pide continuaciones mientras la respuesta termine por `finish_reason == "length"`.
+
+    Cada continuación reenvía la conversación con el texto parcial como mensaje
+    del asistente y concatena lo nuevo, en lugar de repetir la petición entera.
+    """
+    choice = respuesta["choices"][0]
+    texto = choice["message"]["content"] or ""
+    usage = dict(respuesta.get("usage") or {})
+    continuaciones = 0
+    while choice.get("finish_reason") == "length" and continuaciones < MAX_CONTINUACIONES:
+        mensajes = list(payload["messages"]) + [
+            {"role": "assistant", "content": texto},
+            {"role": "user", "content": MENSAJE_CONTINUACION},
+        ]
+        al_recibir_continuacion = None
+        if al_recibir is not None:
+            al_recibir_continuacion = lambda parcial, previo=texto: al_recibir(previo + parcial)
+        continuacion = dict(payload, messages=mensajes)
+        # La continuación prolonga un JSON ya empezado: con `response_format` el modelo abriría uno nuevo
+        continuacion.pop("response_format", None)
+        extra = _solicitar(url, headers, continuacion, al_recibir_continuacion, timeout, cobertura=cobertura)
+        if not extra.get("choices"):
+            break
+        choice = extra["choices"][0]
+        texto += choice["message"]["content"] or ""
+        for campo, valor in (extra.get("usage") or {}).items():
+            if isinstance(valor, (int, float)):
+                usage[campo] = usage.get(campo, 0) + valor
+        continuaciones += 1
+    if continuaciones:
+        respuesta["choices"][0]["message"]["content"] = texto
+        respuesta["choices"][0]["finish_reason"] = choice.get("finish_reason")
+        respuesta["usage"] = usage
+        respuesta["continuaciones"] = continuaciones
+    return respuesta
+
+
+def chat_completion(url, headers, payload, al_recibir=None, usar_cache=False, timeout=None,
+                    continuar_si_truncado=False, cobertura=None):
+    """
+    Punto de entrada común para las peticiones de chat completions.
+
+    Parámetros:
+        url (str): Endpoint de chat completions.
+        headers (dict): Cabeceras de la petición (incluida la autorización).
+        payload (dict): Cuerpo de la petición.
+        al_recibir (callable): Si se indica, la respuesta se pide en streaming.
+        usar_cache (bool): Consulta y alimenta la caché persistente de respuestas.
+        timeout: Timeout opcional; por defecto el del cliente compartido.
+        continuar_si_truncado (bool): Si la respuesta se corta por `max_tokens`,
+            pide continuaciones y las concatena al texto parcial.
+        cobertura (bool): Lanza un duplicado si la llamada supera el p95 de
+            latencia; por defecto según `LLM_COBERTURA`.
+
+    Retorna:
+        dict: El JSON de la respuesta de la API.
+    """
+    cache = obtener_cache() if usar_cache else None
+    if cache is not None:
+        clave = cache.clave(payload)
+        respuesta = cache.obtener(clave)
+        if respuesta is not None:
+            registrar_llamada(proveedor=proveedor_de_url(url), modelo=payload.get("model"), cache=True)
+            if al_recibir is not None:
+                al_recibir(respuesta["choices"][0]["message"]["content"])
+            return respuesta
+
+    if cobertura is None:
+        cobertura = os.environ.get("LLM_COBERTURA") == "1"
+    respuesta = _solicitar(url, headers, payload, al_recibir, timeout, cobertura=cobertura)
+    if continuar_si_truncado and respuesta.get("choices"):
+        respuesta = _continuar_truncada(url, headers, payload, respuesta, al_recibir, timeout, cobertura=cobertura)
+
+    if cache is not None and respuesta.get("choices"):
+        cache.guardar(clave, respuesta)
+    return respuesta
+
+
+def _reintentos_urllib3(response):
+    """Reintentos hechos por el adaptador (502/503/504) antes de esta respuesta."""
+    reintentos = getattr(response.raw, "retries", None)
+    return len(reintentos.history) if reintentos is not None else 0
+
+
+def _registrar_respuesta(url, payload, response, inicio, reintentos, usage=None, error=None):
+    registrar_llamada(
+        proveedor=proveedor_de_url(url),
+        modelo=payload.get("model"),
+        duracion=round(time.monotonic() - inicio, 3),
+        ttfb=round(response.elapsed.total_seconds(), 3) if response is not None else None,
+        estado=response.status_code if response is not None else None,
+        reintentos=reintentos,
+        streaming=bool(payload.get("stream")),
+        error=type(error).__name__ if error is not None else None,
+        usage=usage,
+        payload=payload,
+    )
+
+
+def post_limitado(url, headers, payload, **kwargs):
+    """
+    Envía un POST a través del limitador de tasa del proveedor y modelo.
+
+    Las respuestas 429/503 frenan el limitador y se reintentan tras la espera
+    indicada por `Retry-After`; el resto de respuestas se devuelven tal cual.
+    Si hay un plazo de trabajo activo, el timeout se limita al tiempo restante.
+    Cada llamada queda en la telemetría; en streaming, el registro lo hace
+    quien consume la respuesta, con `response.inicio_llamada` y `response.reintentos`.
+    """
+    clave = (proveedor_de_url(url), payload.get("model"))
+    limitador = obtener_limitador(*clave)
+    timeout = kwargs.pop("timeout", None)
+    streaming = kwargs.get("stream", False)
+    inicio_llamada = time.monotonic()
+    reintentos = 0
+    for intento in range(REINTENTOS_LIMITE + 1):
+        limitador.adquirir()
+        plazo = plazo_actual()
+        inicio = time.monotonic()
+        try:
+            timeout_llamada = plazo.timeout(timeout or obtener_cliente().timeout) if plazo else timeout
+            response = obtener_cliente().post(url, headers=headers, json=payload, timeout=timeout_llamada, **kwargs)
+        except requests.exceptions.RequestException as e:
+            _registrar_respuesta(url, payload, None, inicio_llamada, reintentos, error=e)
+            raise
+        reintentos += _reintentos_urllib3(response)
+        if response.ok and not streaming:
+            latencias.registrar(clave, time.monotonic() - inicio)
+        limitador.registrar_respuesta(response.status_code, response.headers)
+        if response.status_code in ESTADOS_LIMITADOS and intento < REINTENTOS_LIMITE:
+            response.close()
+            reintentos += 1
+            continue
+        if streaming:
+            response.inicio_llamada = inicio_llamada
+            response.reintentos = reintentos
+        else:
+            _registrar_respuesta(url, payload, response, inicio_llamada, reintentos,
+                                 usage=uso_de_respuesta(response) if response.ok else None)
+        return response
+
+
+_cliente = None
+_cliente_lock = threading.Lock()
+_ejecutor_cobertura = ThreadPoolExecutor(max_workers=8, thread_name_prefix="cobertura")
+
+
+def obtener_cliente():
+    """Devuelve el cliente HTTP del proceso, creándolo la primera vez."""
+    global _cliente
+    if _cliente is None:
+        with _cliente_lock:
+            if _cliente is None:
+                _cliente = ClienteHTTP(
+                    pool_conexiones=_entero_entorno("LLM_POOL_CONEXIONES", 10),
+                    pool_tamano=_entero_entorno("LLM_POOL_TAMANO", 20),
+                    timeout_conexion=_decimal_entorno("LLM_TIMEOUT_CONEXION", 10),
+                    timeout_lectura=_decimal_entorno("LLM_TIMEOUT_LECTURA", 300),
+                )
+    return _cliente
+
+
+def cerrar_cliente():
+    """Cierra el cliente compartido; se registra automáticamente al salir del proceso."""
+    global _cliente
+    with _cliente_lock:
+        if _cliente is not None:
+            _cliente.cerrar()
+            _cliente = None
+
+
+atexit.register(cerrar_cliente)
@@ -0,0 +1,87 @@
+"""
+Contexto de capítulos anteriores que recibe cada capítulo nuevo de un libro (libros.py).
+
+El contexto se compone de piezas: los digestos vigentes del libro y los
+resúmenes de los capítulos que aún no cubre ningún digesto. Los resúmenes que
+salen de la ventana de capítulos recientes se funden en digestos por niveles,
+y si el contexto sigue superando su presupuesto se funden todas las piezas
+antiguas, de modo que no crece con la longitud del libro. La fusión en sí (la
+llamada al modelo) la aporta quien compacta.
+"""
+
+from tokens import contar_tokens
+
+# Resúmenes de los últimos capítulos que se mantienen completos en el contexto de cada capítulo
+RESUMENES_RECIENTES = 4
+# Capítulos (o digestos de un mismo nivel) que se funden en un digesto del nivel siguiente
+ELEMENTOS_POR_DIGESTO = 4
+# Tokens máximos del contexto de capítulos anteriores que recibe cada capítulo
+PRESUPUESTO_CONTEXTO = 2000
+
+
+def piezas_contexto(almacen, id):
+    """
+    Devuelve las piezas del contexto de capítulos anteriores en orden: los digestos
+    vigentes y los resúmenes de los capítulos que aún no cubre ningún digesto
+    (estos como piezas de nivel 0).
+    """
+    digestos = almacen.digestos(id)
+    cubiertos = max((d['hasta'] for d in digestos), default=0)
+    capitulos = [
+        {'nivel': 0, 'desde': numero, 'hasta': numero, 'resumen': resumen}
+        for numero, resumen in almacen.resumenes(id, desde=cubiertos)
+    ]
+    return digestos + capitulos
+
+
+def contexto_libro(piezas):
+    """Texto con lo que ha cubierto el libro hasta ahora, a partir de sus piezas de contexto."""
+    return ' '.join(
+        f"(Capítulo {p['desde']}) {p['resumen']}" if p['desde'] == p['hasta']
+        else f"(Capítulos {p['desde']}-{p['hasta']}) {p['resumen']}"
+        for p in piezas
+    )
+
+
+def compactacion_pendiente(piezas):
+    """
+    Decide qué piezas del contexto se funden en un digesto.
+
+    Los capítulos que salen de la ventana de `RESUMENES_RECIENTES` se funden de
+    `ELEMENTOS_POR_DIGESTO` en `ELEMENTOS_POR_DIGESTO` en un digesto de nivel 1,
+    y los digestos de un mismo nivel, en uno del nivel siguiente. Si aun así el
+    contexto supera `PRESUPUESTO_CONTEXTO`, se funden todas las piezas antiguas.
+
+    Retorna:
+        tuple: (nivel del digesto, piezas que resume), o None si no hace falta fundir nada.
+    """
+    antiguas = piezas[:-RESUMENES_RECIENTES] if len(piezas) > RESUMENES_RECIENTES else []
+    for nivel in sorted({p['nivel'] for p in antiguas}):
+        del_nivel = [p for p in antiguas if p['nivel'] == nivel]
+        if len(del_nivel) >= ELEMENTOS_POR_DIGESTO:
+            return nivel + 1, del_nivel[:ELEMENTOS_POR_DIGESTO]
+    if len(antiguas) >= 2 and contar_tokens(contexto_libro(piezas)) > PRESUPUESTO_CONTEXTO:
+        return max(p['nivel'] for p in antiguas) + 1, antiguas
+    return None
+
+
+def compactar(almacen, id, fundir):
+    """
+    Funde los resúmenes antiguos del libro `id` en digestos hasta que el contexto queda dentro del presupuesto.
+
+    Parámetros:
+        almacen (AlmacenLibros): Almacén donde se leen las piezas y se guardan los digestos.
+        id (str): Identificador del libro.
+        fundir (callable): Recibe las piezas que se funden y devuelve el texto del digesto,
+            o None si no se pudo generar (los resúmenes se quedan completos hasta el siguiente intento).
+    """
+    while True:
+        pendiente = compactacion_pendiente(piezas_contexto(almacen, id))
+        if pendiente is None:
+            return
+        nivel, piezas = pendiente
+        digesto = fundir(piezas)
+        if not digesto:
+            # Los resúmenes se quedan completos: la siguiente compactación lo vuelve a intentar
+            return
+        almacen.guardar_digesto(id, nivel, piezas[0]['desde'], piezas[-1]['hasta'], digesto)
@@ -1,8 +1,8 @@
 import streamlit as st
-import requests
 from docx import Document
 import os
-import time
+
+from cliente_llm import OPENROUTER_URL, post_limitado
 
 st.set_page_config(page_title="Generador de Capítulos", layout="wide")
 
@@ -41,11 +41,8 @@ if st.button("Generar Capítulos"):
                     "Authorization": f"Bearer {api_key}"
                 }
                 
-                response = requests.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
+                # El limitador de tasa sustituye la pausa fija entre capítulos
+                response = post_limitado(OPENROUTER_URL, headers, payload)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -57,7 +54,6 @@ if st.button("Generar Capítulos"):
                     documento.add_paragraph("Error al generar el contenido.")
                 
                 progreso.progress(idx / total)
-                time.sleep(1)
             
             documento.save("Capitulos.docx")
             
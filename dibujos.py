@@ -4,6 +4,9 @@ from io import BytesIO
 from PIL import Image
 import base64
 
+from cliente_llm import TOGETHER_IMAGES_URL, post_limitado
+from enrutador import chat_tarea, claves_api
+
 # Configuración de la página
 st.set_page_config(page_title="Generador de Ilustraciones de Escenas", layout="centered")
 
@@ -21,14 +24,9 @@ y generará **dos** imágenes con las dimensiones especificadas.
 def transform_description_and_style_to_prompt(description, style):
     """
     Transforma la descripción de la escena y el estilo artístico en un prompt optimizado para el modelo FLUX 
-    utilizando la API de OpenRouter, incluyendo un prompt negativo.
+    incluyendo un prompt negativo. Es una tarea auxiliar: usa el modelo rápido de la tarea
+    "prompt_imagen" (ver `enrutador.NIVELES_TAREAS`).
     """
-    openrouter_api_key = st.secrets["OPENROUTER_API_KEY"]
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openrouter_api_key}"
-    }
-    
     # Prompt negativo definido
     negative_prompt = "(no text, no hard edges, no vibrant colors, no harsh lighting, no digital art, no watermarks, no low resolution, no pixelation, no bad art, no beginner, no amateur)"
     
@@ -44,7 +42,6 @@ def transform_description_and_style_to_prompt(description, style):
     )
     
     data = {
-        "model": "openai/gpt-4o-mini",  # Verificar el nombre correcto del modelo
         "messages": [
             {
                 "role": "user",
@@ -54,9 +51,7 @@ def transform_description_and_style_to_prompt(description, style):
     }
     
     try:
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=data)
-        response.raise_for_status()
-        response_json = response.json()
+        response_json = chat_tarea("prompt_imagen", data, claves_api(st.secrets))
         
         # Validar la estructura de la respuesta
         if "choices" in response_json and len(response_json["choices"]) > 0:
@@ -90,7 +85,7 @@ def generate_images(prompt, width, height, num_images=2):
         "response_format": "b64_json"
     }
     try:
-        response = requests.post("https://api.together.xyz/v1/images/generations", headers=headers, json=data)
+        response = post_limitado(TOGETHER_IMAGES_URL, headers, data)
         response.raise_for_status()
         response_data = response.json()
         
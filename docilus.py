@@ -3,13 +3,14 @@ from docx import Document
 from docx.shared import Inches, Pt
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 import requests
-import json
 import base64
 from PIL import Image
 from io import BytesIO
 from typing import List, Optional
 from datetime import datetime
 
+from cliente_llm import TOGETHER_IMAGES_URL, post_limitado
+
 # Función para extraer texto de un documento Word basado en "CHAPTER" (case-sensitive)
 def extract_chapters(docx_file) -> List[str]:
     doc = Document(docx_file)
@@ -45,7 +46,7 @@ def generate_prompt(chapter: str) -> str:
 
 # Función para generar una imagen usando la API de Together
 def generate_image(prompt: str, api_key: str) -> Optional[Image.Image]:
-    url = "https://api.together.xyz/v1/images/generations"
+    url = TOGETHER_IMAGES_URL
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -69,7 +70,7 @@ def generate_image(prompt: str, api_key: str) -> Optional[Image.Image]:
     }
     
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = post_limitado(url, headers, payload)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         st.error(f"Error al generar la imagen: {e}")
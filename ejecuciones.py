@@ -0,0 +1,168 @@
+"""
+Almacén persistente de ejecuciones de generación (puntos de control) en SQLite.
+
+Cada ejecución (por ejemplo, una novela aprobada) guarda sus parámetros, el
+plan y cada escena en cuanto se termina. Si la página se recarga o la
+generación se interrumpe, la ejecución se reanuda desde la primera escena que
+falta en lugar de empezar de nuevo.
+
+Configuración mediante variables de entorno:
+    LLM_EJECUCIONES_RUTA  Ruta del archivo SQLite (por defecto `.cache_llm/ejecuciones.sqlite3`).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+EN_CURSO = "en_curso"
+INTERRUMPIDA = "interrumpida"
+COMPLETADA = "completada"
+
+
+def id_ejecucion(*elementos):
+    """Calcula un identificador estable a partir de los elementos que definen la ejecución."""
+    canonico = json.dumps(elementos, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()[:16]
+
+
+class AlmacenEjecuciones:
+    """
+    Ejecuciones y escenas terminadas, seguras entre hilos.
+
+    Parámetros:
+        ruta (str): Archivo SQLite donde se guardan las ejecuciones.
+    """
+
+    def __init__(self, ruta):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS ejecuciones ("
+            " id TEXT PRIMARY KEY,"
+            " tipo TEXT NOT NULL,"
+            " estado TEXT NOT NULL,"
+            " datos TEXT NOT NULL,"
+            " creada REAL NOT NULL,"
+            " actualizada REAL NOT NULL)"
+        )
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS escenas ("
+            " ejecucion TEXT NOT NULL,"
+            " capitulo INTEGER NOT NULL,"
+            " escena INTEGER NOT NULL,"
+            " texto TEXT NOT NULL,"
+            " actualizada REAL NOT NULL,"
+            " PRIMARY KEY (ejecucion, capitulo, escena))"
+        )
+        self._conexion.commit()
+
+    def crear(self, id, tipo, datos):
+        """Crea la ejecución si no existe y devuelve la guardada (nueva o anterior)."""
+        ahora = time.time()
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR IGNORE INTO ejecuciones (id, tipo, estado, datos, creada, actualizada)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (id, tipo, EN_CURSO, json.dumps(datos, ensure_ascii=False), ahora, ahora),
+            )
+            self._conexion.commit()
+        return self.obtener(id)
+
+    def obtener(self, id):
+        """
+        Devuelve la ejecución `id` o None si no existe.
+
+        Retorna:
+            dict: id, tipo, estado y datos de la ejecución.
+        """
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT id, tipo, estado, datos FROM ejecuciones WHERE id = ?", (id,)
+            ).fetchone()
+        if fila is None:
+            return None
+        return {"id": fila[0], "tipo": fila[1], "estado": fila[2], "datos": json.loads(fila[3])}
+
+    def actualizar_datos(self, id, datos):
+        with self._lock:
+            self._conexion.execute(
+                "UPDATE ejecuciones SET datos = ?, actualizada = ? WHERE id = ?",
+                (json.dumps(datos, ensure_ascii=False), time.time(), id),
+            )
+            self._conexion.commit()
+
+    def marcar_estado(self, id, estado):
+        with self._lock:
+            self._conexion.execute(
+                "UPDATE ejecuciones SET estado = ?, actualizada = ? WHERE id = ?", (estado, time.time(), id)
+            )
+            self._conexion.commit()
+
+    def guardar_escena(self, id, capitulo, escena, texto):
+        """Guarda (o reemplaza) el texto de una escena terminada."""
+        ahora = time.time()
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO escenas (ejecucion, capitulo, escena, texto, actualizada)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (id, capitulo, escena, texto, ahora),
+            )
+            self._conexion.execute("UPDATE ejecuciones SET actualizada = ? WHERE id = ?", (ahora, id))
+            self._conexion.commit()
+
+    def escenas(self, id):
+        """Devuelve las escenas terminadas de la ejecución como {(capítulo, escena): texto}."""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT capitulo, escena, texto FROM escenas WHERE ejecucion = ?", (id,)
+            ).fetchall()
+        return {(capitulo, escena): texto for capitulo, escena, texto in filas}
+
+    def inactivas(self, tipo, antiguedad):
+        """
+        Devuelve las ejecuciones de `tipo` que no se han actualizado en los últimos `antiguedad` segundos.
+
+        Retorna:
+            list: Diccionarios con id, tipo, estado y datos de cada ejecución.
+        """
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT id, tipo, estado, datos FROM ejecuciones WHERE tipo = ? AND actualizada < ?",
+                (tipo, time.time() - antiguedad),
+            ).fetchall()
+        return [{"id": fila[0], "tipo": fila[1], "estado": fila[2], "datos": json.loads(fila[3])} for fila in filas]
+
+    def eliminar(self, id):
+        """Borra la ejecución y sus escenas (por ejemplo, un trabajo adelantado que se descarta)."""
+        with self._lock:
+            self._conexion.execute("DELETE FROM escenas WHERE ejecucion = ?", (id,))
+            self._conexion.execute("DELETE FROM ejecuciones WHERE id = ?", (id,))
+            self._conexion.commit()
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def obtener_almacen():
+    """Devuelve el almacén de ejecuciones del proceso, creándolo la primera vez."""
+    global _almacen
+    if _almacen is None:
+        with _almacen_lock:
+            if _almacen is None:
+                _almacen = AlmacenEjecuciones(
+                    os.environ.get("LLM_EJECUCIONES_RUTA", os.path.join(".cache_llm", "ejecuciones.sqlite3"))
+                )
+    return _almacen
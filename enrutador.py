@@ -0,0 +1,281 @@
+"""
+Enrutado entre OpenRouter y Together según latencia y tasa de error.
+
+Cada modelo lógico tiene una lista de modelos equivalentes por proveedor. El
+enrutador mantiene, para cada par (proveedor, modelo), una latencia media
+móvil, una tasa de error reciente y un cortocircuito que se abre tras varios
+fallos seguidos. Las peticiones van al candidato más sano y, ante caídas,
+timeouts o errores 5xx sostenidos, pasan automáticamente al siguiente.
+
+Las llamadas auxiliares (resúmenes, momentos clave, prompts de imagen...) no
+necesitan el modelo de la prosa: `chat_tarea` elige el modelo lógico según el
+nivel de latencia/coste de cada tarea y etiqueta la telemetría con la tarea.
+
+Configuración mediante variables de entorno:
+    LLM_NIVELES_TAREAS   Niveles por tarea que sustituyen a los de `NIVELES_TAREAS`,
+                         como `resumen=equilibrado,prompt_imagen=rapido`.
+    LLM_MODELOS_NIVELES  Modelos lógicos por nivel que sustituyen a los de `MODELOS_NIVELES`,
+                         como `rapido=gpt-4o-mini`.
+"""
+
+import os
+import threading
+import time
+
+import requests
+
+from cliente_llm import OPENROUTER_URL, TOGETHER_URL, chat_completion
+from plazos import PlazoExcedido
+from salida_json import adaptar_formato
+from telemetria import tarea_telemetria
+from tokens import PresupuestoExcedido, ajustar_max_tokens
+
+URLS_CHAT = {
+    "openrouter": OPENROUTER_URL,
+    "together": TOGETHER_URL,
+}
+
+# Modelo lógico -> candidatos (proveedor, identificador del modelo en ese proveedor), por preferencia
+MODELOS_EQUIVALENTES = {
+    "gpt-4o-mini": [
+        ("openrouter", "openai/gpt-4o-mini"),
+        ("together", "meta-llama/Llama-3.3-70B-Instruct-Turbo"),
+    ],
+    "qwen-2.5-72b": [
+        ("together", "Qwen/Qwen2.5-72B-Instruct-Turbo"),
+        ("openrouter", "qwen/qwen-2.5-72b-instruct"),
+    ],
+    "qwen-2.5-7b": [
+        ("together", "Qwen/Qwen2.5-7B-Instruct-Turbo"),
+        ("openrouter", "qwen/qwen-2.5-7b-instruct"),
+    ],
+}
+
+# Nivel de latencia/coste -> modelo lógico
+MODELOS_NIVELES = {
+    "rapido": "qwen-2.5-7b",
+    "equilibrado": "gpt-4o-mini",
+}
+
+# Tarea -> nivel de latencia/coste; las tareas desconocidas usan NIVEL_POR_DEFECTO
+NIVELES_TAREAS = {
+    "prosa": "equilibrado",
+    "estructura": "equilibrado",
+    "plan": "equilibrado",
+    "resumen": "rapido",
+    "memoria": "equilibrado",
+    "momentos_clave": "rapido",
+    "prompt_imagen": "rapido",
+}
+NIVEL_POR_DEFECTO = "equilibrado"
+
+# Nombre del secreto/variable de entorno con la clave de cada proveedor
+NOMBRES_CLAVES = {
+    "openrouter": "OPENROUTER_API_KEY",
+    "together": "TOGETHER_API_KEY",
+}
+
+# Fallos consecutivos que abren el cortocircuito y segundos que permanece abierto
+FALLOS_PARA_ABRIR = 3
+ENFRIAMIENTO = 60.0
+# Peso de cada nueva muestra en las medias móviles
+ALFA = 0.2
+
+
+class SaludCandidato:
+    """Latencia media móvil, tasa de error y cortocircuito de un (proveedor, modelo)."""
+
+    def __init__(self):
+        self.latencia = None
+        self.tasa_error = 0.0
+        self.fallos_seguidos = 0
+        self.abierto_hasta = 0.0
+        self.ultimo_fallo = None
+
+    def disponible(self, ahora):
+        return ahora >= self.abierto_hasta
+
+    def clave_orden(self, ahora):
+        """
+        Abiertos al final; sin muestras, primero si nunca han fallado o ya pasó el
+        enfriamiento (para volver a probarlos) y si no, detrás del resto.
+        """
+        if self.latencia is None:
+            fallo_reciente = self.ultimo_fallo is not None and ahora - self.ultimo_fallo < ENFRIAMIENTO
+            return (not self.disponible(ahora), fallo_reciente, 0.0)
+        return (not self.disponible(ahora), False, self.latencia * (1 + 4 * self.tasa_error))
+
+
+class Enrutador:
+    """Elige el candidato más sano para cada modelo lógico y registra los resultados."""
+
+    def __init__(self, equivalencias=None):
+        self.equivalencias = equivalencias or MODELOS_EQUIVALENTES
+        self._salud = {}
+        self._lock = threading.Lock()
+
+    def _salud_de(self, candidato):
+        return self._salud.setdefault(candidato, SaludCandidato())
+
+    def candidatos(self, modelo, proveedores_disponibles):
+        """
+        Devuelve los candidatos de `modelo` ordenados del más sano al menos sano.
+
+        Los que tienen el cortocircuito abierto van al final, para usarse solo
+        si todos los demás fallan; sin muestras se respeta el orden de preferencia.
+        """
+        lista = [c for c in self.equivalencias.get(modelo, []) if c[0] in proveedores_disponibles]
+        ahora = time.monotonic()
+        with self._lock:
+            return sorted(lista, key=lambda c: self._salud_de(c).clave_orden(ahora))
+
+    def registrar_exito(self, candidato, segundos):
+        with self._lock:
+            salud = self._salud_de(candidato)
+            salud.latencia = segundos if salud.latencia is None else (1 - ALFA) * salud.latencia + ALFA * segundos
+            salud.tasa_error = (1 - ALFA) * salud.tasa_error
+            salud.fallos_seguidos = 0
+            salud.abierto_hasta = 0.0
+
+    def registrar_fallo(self, candidato):
+        with self._lock:
+            salud = self._salud_de(candidato)
+            salud.tasa_error = (1 - ALFA) * salud.tasa_error + ALFA
+            salud.fallos_seguidos += 1
+            salud.ultimo_fallo = time.monotonic()
+            if salud.fallos_seguidos >= FALLOS_PARA_ABRIR:
+                salud.abierto_hasta = time.monotonic() + ENFRIAMIENTO
+
+    def estado(self):
+        """Resumen de la salud de cada candidato, para mostrar en la interfaz."""
+        ahora = time.monotonic()
+        with self._lock:
+            return {
+                f"{proveedor}:{modelo}": {
+                    "latencia": salud.latencia,
+                    "tasa_error": round(salud.tasa_error, 3),
+                    "disponible": salud.disponible(ahora),
+                }
+                for (proveedor, modelo), salud in self._salud.items()
+            }
+
+
+enrutador = Enrutador()
+
+
+def claves_api(secretos=None):
+    """Reúne las claves de cada proveedor desde `secretos` (p. ej. `st.secrets`) o el entorno."""
+    secretos = secretos if secretos is not None else {}
+    return {
+        proveedor: secretos.get(nombre) or os.environ.get(nombre)
+        for proveedor, nombre in NOMBRES_CLAVES.items()
+    }
+
+
+def _leer_asignaciones(variable):
+    """Lee asignaciones `clave=valor` separadas por comas de una variable de entorno."""
+    asignaciones = {}
+    for asignacion in os.environ.get(variable, "").split(","):
+        clave, _, valor = asignacion.partition("=")
+        if clave.strip() and valor.strip():
+            asignaciones[clave.strip()] = valor.strip()
+    return asignaciones
+
+
+def modelo_tarea(tarea):
+    """
+    Devuelve el modelo lógico para `tarea` según su nivel de latencia/coste.
+
+    Los niveles y modelos se pueden sustituir con `LLM_NIVELES_TAREAS` y `LLM_MODELOS_NIVELES`.
+    """
+    nivel = _leer_asignaciones("LLM_NIVELES_TAREAS").get(tarea) or NIVELES_TAREAS.get(tarea, NIVEL_POR_DEFECTO)
+    modelos = dict(MODELOS_NIVELES, **_leer_asignaciones("LLM_MODELOS_NIVELES"))
+    if nivel not in modelos:
+        raise ValueError(f"Nivel desconocido '{nivel}' para la tarea '{tarea}'.")
+    return modelos[nivel]
+
+
+def modelo_enviado(tarea, claves):
+    """
+    Devuelve el identificador, en su proveedor, del modelo al que irá primero
+    una petición de `tarea`, para calcular el presupuesto de tokens del prompt.
+    """
+    modelo = modelo_tarea(tarea)
+    candidatos = enrutador.candidatos(modelo, {p for p, clave in claves.items() if clave})
+    candidatos = candidatos or MODELOS_EQUIVALENTES.get(modelo) or [(None, modelo)]
+    return candidatos[0][1]
+
+
+def _es_fallo_de_proveedor(error):
+    """Indica si el error justifica probar con otro proveedor."""
+    if isinstance(error, PlazoExcedido):
+        return False
+    if isinstance(error, requests.exceptions.HTTPError):
+        estado = error.response.status_code if error.response is not None else None
+        return estado is None or estado == 429 or estado >= 500
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def chat_enrutado(modelo, payload, claves, **opciones):
+    """
+    Envía una petición de chat al proveedor más sano para el modelo lógico.
+
+    Parámetros:
+        modelo (str): Modelo lógico (clave de `MODELOS_EQUIVALENTES`).
+        payload (dict): Cuerpo de la petición sin el campo `model`; un `response_format`
+            de `salida_json.formato_json` se adapta al formato de cada proveedor.
+        claves (dict): Claves de API por proveedor; los proveedores sin clave se omiten.
+        **opciones: Argumentos adicionales para `chat_completion`.
+
+    Retorna:
+        dict: La respuesta de la API, con `proveedor` y `model` del candidato usado.
+
+    Lanza:
+        requests.exceptions.RequestException: Si todos los candidatos fallan.
+        tokens.PresupuestoExcedido: Si el prompt no cabe en el contexto de ningún candidato.
+    """
+    candidatos = enrutador.candidatos(modelo, {p for p, clave in claves.items() if clave})
+    if not candidatos:
+        raise ValueError(f"No hay proveedores configurados para el modelo '{modelo}'.")
+    ultimo_error = None
+    for candidato in candidatos:
+        proveedor, modelo_proveedor = candidato
+        headers = {
+            "Authorization": f"Bearer {claves[proveedor]}",
+            "Content-Type": "application/json",
+        }
+        cuerpo = dict(payload, model=modelo_proveedor)
+        if payload.get("max_tokens") and payload.get("messages"):
+            # Cada candidato tiene su propio contexto: la salida se ajusta al modelo que se envía
+            try:
+                cuerpo["max_tokens"] = ajustar_max_tokens(payload["messages"], payload["max_tokens"], modelo_proveedor)
+            except PresupuestoExcedido as e:
+                ultimo_error = e
+                continue
+        if payload.get("response_format"):
+            cuerpo["response_format"] = adaptar_formato(payload["response_format"], proveedor)
+        inicio = time.monotonic()
+        try:
+            respuesta = chat_completion(URLS_CHAT[proveedor], headers, cuerpo, **opciones)
+        except requests.exceptions.RequestException as e:
+            if not _es_fallo_de_proveedor(e):
+                raise
+            enrutador.registrar_fallo(candidato)
+            ultimo_error = e
+            continue
+        enrutador.registrar_exito(candidato, time.monotonic() - inicio)
+        respuesta["proveedor"] = proveedor
+        respuesta.setdefault("model", modelo_proveedor)
+        return respuesta
+    raise ultimo_error
+
+
+def chat_tarea(tarea, payload, claves, **opciones):
+    """
+    Envía una petición de chat con el modelo que corresponde a `tarea` (ver `modelo_tarea`).
+
+    Igual que `chat_enrutado`, pero los registros de telemetría de la llamada
+    llevan la tarea, para comparar latencia y coste por tarea.
+    """
+    with tarea_telemetria(tarea):
+        return chat_enrutado(modelo_tarea(tarea), payload, claves, **opciones)
@@ -1,11 +1,20 @@
 import streamlit as st
 import requests
-from docx import Document
 from io import BytesIO
 
+from artefactos import documento_incremental
+from cliente_llm import OPENROUTER_URL, post_limitado
+from plazos import plazo_trabajo
+from trabajos import COMPLETADO, avisar, mostrar_trabajo, obtener_gestor, sondear
+
+# Tiempo máximo para generar la novela completa (40 escenas)
+PLAZO_NOVELA = 60 * 60
+# Tipo del documento Word que se escribe escena a escena durante la generación (artefactos.py)
+DOCUMENTO_NOVELA = "escenas_docx"
+
 # Configuración de la API Key
 OPENROUTER_API_KEY = st.secrets["OPENROUTER_API_KEY"]
-API_URL = "https://openrouter.ai/api/v1/chat/completions"
+API_URL = OPENROUTER_URL
 
 # Función para generar el contenido de cada escena
 def generar_escena(tema, capitulo, escena):
@@ -30,38 +39,43 @@ Escribe una escena para una novela de suspenso político sobre el tema '{tema}'.
         "messages": [{"role": "user", "content": prompt}]
     }
 
-    response = requests.post(API_URL, headers=headers, json=data)
+    try:
+        response = post_limitado(API_URL, headers, data)
+    except requests.exceptions.RequestException as e:
+        avisar(f"Error al generar la escena: {e}")
+        return None
     if response.status_code == 200:
         return response.json()["choices"][0]["message"]["content"]
     else:
-        st.error("Error al generar la escena. Por favor, intenta de nuevo.")
+        avisar("Error al generar la escena. Por favor, intenta de nuevo.")
         return None
 
-# Función para generar toda la novela con barra de progreso
-def generar_novela(tema):
-    document = Document()
+# Función para generar toda la novela; se ejecuta como trabajo en segundo plano (trabajos.py)
+# Cada escena se añade al documento Word en cuanto se genera, así que se puede descargar lo escrito hasta el momento
+def generar_novela(trabajo, tema):
+    documento = documento_incremental(DOCUMENTO_NOVELA, trabajo.id)
     progreso_total = 10 * 4  # 10 capítulos, 4 escenas por capítulo
     progreso_actual = 0
 
-    # Agregar barra de progreso en Streamlit
-    barra_progreso = st.progress(0)
-    for capitulo in range(1, 11):
-        document.add_paragraph(f"Capítulo {capitulo}", style="Heading 1")
-        for escena in range(1, 5):
-            escena_texto = generar_escena(tema, capitulo, escena)
-            if escena_texto:
-                document.add_paragraph(escena_texto)
-                progreso_actual += 1
-                barra_progreso.progress(progreso_actual / progreso_total)
-            else:
-                st.error(f"No se pudo generar la Escena {escena} del Capítulo {capitulo}.")
-                break
+    # Informar del progreso a la interfaz a través del trabajo
+    trabajo.progreso(0, progreso_total)
+    with plazo_trabajo(PLAZO_NOVELA):
+        for capitulo in range(1, 11):
+            documento.agregar(lambda document: document.add_paragraph(f"Capítulo {capitulo}", style="Heading 1"))
+            for escena in range(1, 5):
+                trabajo.comprobar_cancelacion()
+                escena_texto = generar_escena(tema, capitulo, escena)
+                if escena_texto:
+                    documento.agregar(lambda document: document.add_paragraph(escena_texto))
+                    progreso_actual += 1
+                    trabajo.progreso(progreso_actual, texto=f"Capítulo {capitulo}, Escena {escena} generada.")
+                else:
+                    avisar(f"No se pudo generar la Escena {escena} del Capítulo {capitulo}.")
+                    break
 
-    # Guardar el documento en un archivo Word
-    buffer = BytesIO()
-    document.save(buffer)
-    buffer.seek(0)
-    return buffer
+    # El documento ya está guardado; se libera la copia en memoria y se devuelve el archivo Word
+    documento.cerrar()
+    return BytesIO(documento.contenido())
 
 # Interfaz de la aplicación
 st.title("Generador de Novelas de Suspenso Político en Streamlit")
@@ -73,14 +87,33 @@ tema = st.text_input("Tema de la novela", help="Introduce el tema principal para
 # Botón para iniciar la generación de la novela
 if st.button("Generar Novela"):
     if tema:
+        # La novela se genera en segundo plano; la página solo consulta su progreso
+        trabajo = obtener_gestor().enviar("novela", generar_novela, tema)
+        st.session_state.trabajo = trabajo.id
+        st.query_params["trabajo"] = trabajo.id
+    else:
+        st.warning("Por favor, introduce un tema para la novela.")
+
+# Progreso y resultado de la generación (también tras recargar la página)
+trabajo = obtener_gestor().obtener(st.session_state.get("trabajo") or st.query_params.get("trabajo"))
+if trabajo is not None:
+    if trabajo.activo():
         st.info("Generando novela... puede tardar unos minutos.")
-        buffer = generar_novela(tema)
+    mostrar_trabajo(trabajo)
+    parcial = documento_incremental(DOCUMENTO_NOVELA, trabajo.id).contenido() if trabajo.activo() else None
+    if parcial:
+        st.download_button(
+            label="Descargar lo generado hasta ahora",
+            data=parcial,
+            file_name="novela_parcial.docx",
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        )
+    sondear(trabajo)
+    if trabajo.estado == COMPLETADO:
         st.success("¡Novela generada exitosamente!")
         st.download_button(
             label="Descargar Novela en Word",
-            data=buffer,
+            data=trabajo.resultado.getvalue(),
             file_name="novela_generada.docx",
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
-    else:
-        st.warning("Por favor, introduce un tema para la novela.")
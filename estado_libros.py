@@ -0,0 +1,211 @@
+"""
+Estado persistente de los libros en generación (libros.py) en SQLite.
+
+Cada libro tiene su propio identificador (guardado en la sesión y en la URL),
+así que varias sesiones pueden generar libros a la vez sin pisarse. Los
+metadatos del libro (idea, tipo, idioma, título) van en una fila y cada
+capítulo en otra, que se añade en una sola transacción al terminarlo: no se
+reescribe el libro entero después de cada capítulo. Para continuar un libro
+basta leer los metadatos y los resúmenes, sin el texto de los capítulos.
+
+Los resúmenes de los capítulos antiguos se funden en digestos (resúmenes de
+varios capítulos o de varios digestos, por niveles) para que el contexto de
+cada capítulo nuevo no crezca con la longitud del libro.
+
+Configuración mediante variables de entorno:
+    LLM_LIBROS_RUTA  Ruta del archivo SQLite (por defecto `.cache_llm/libros.sqlite3`).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Campos de metadatos que se pueden actualizar
+CAMPOS_LIBRO = ("titulo_obra", "proceso_generado", "prompt", "tipo_libro", "idioma")
+
+
+def id_libro():
+    """Genera un identificador nuevo para un libro."""
+    return uuid.uuid4().hex[:16]
+
+
+class AlmacenLibros:
+    """
+    Libros y capítulos terminados, seguros entre hilos.
+
+    Parámetros:
+        ruta (str): Archivo SQLite donde se guardan los libros.
+    """
+
+    def __init__(self, ruta):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS libros ("
+            " id TEXT PRIMARY KEY,"
+            " titulo_obra TEXT NOT NULL,"
+            " proceso_generado INTEGER NOT NULL,"
+            " prompt TEXT NOT NULL,"
+            " tipo_libro TEXT NOT NULL,"
+            " idioma TEXT NOT NULL,"
+            " creado REAL NOT NULL,"
+            " actualizado REAL NOT NULL)"
+        )
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS capitulos ("
+            " libro TEXT NOT NULL,"
+            " numero INTEGER NOT NULL,"
+            " titulo TEXT NOT NULL,"
+            " contenido TEXT NOT NULL,"
+            " resumen TEXT,"
+            " creado REAL NOT NULL,"
+            " PRIMARY KEY (libro, numero))"
+        )
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS digestos ("
+            " libro TEXT NOT NULL,"
+            " nivel INTEGER NOT NULL,"
+            " desde INTEGER NOT NULL,"
+            " hasta INTEGER NOT NULL,"
+            " resumen TEXT NOT NULL,"
+            " creado REAL NOT NULL,"
+            " PRIMARY KEY (libro, nivel, desde))"
+        )
+        self._conexion.commit()
+
+    def crear(self, id, prompt, tipo_libro, idioma, titulo_obra="Libro"):
+        """Crea el libro `id` (sin capítulos)."""
+        ahora = time.time()
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR IGNORE INTO libros"
+                " (id, titulo_obra, proceso_generado, prompt, tipo_libro, idioma, creado, actualizado)"
+                " VALUES (?, ?, 0, ?, ?, ?, ?, ?)",
+                (id, titulo_obra, prompt, tipo_libro, idioma, ahora, ahora),
+            )
+            self._conexion.commit()
+
+    def obtener(self, id):
+        """
+        Devuelve los metadatos del libro `id` o None si no existe.
+
+        Retorna:
+            dict: Metadatos del libro y número de capítulos terminados (`capitulos`).
+        """
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT titulo_obra, proceso_generado, prompt, tipo_libro, idioma,"
+                " (SELECT COUNT(*) FROM capitulos WHERE libro = libros.id)"
+                " FROM libros WHERE id = ?", (id,)
+            ).fetchone()
+        if fila is None:
+            return None
+        libro = dict(zip(CAMPOS_LIBRO, fila[:5]), id=id, capitulos=fila[5])
+        libro["proceso_generado"] = bool(libro["proceso_generado"])
+        return libro
+
+    def actualizar(self, id, **campos):
+        """Actualiza los metadatos indicados (ver `CAMPOS_LIBRO`)."""
+        desconocidos = set(campos) - set(CAMPOS_LIBRO)
+        if desconocidos:
+            raise ValueError(f"Campos desconocidos: {', '.join(sorted(desconocidos))}")
+        asignaciones = ", ".join(f"{campo} = ?" for campo in campos)
+        with self._lock:
+            self._conexion.execute(
+                f"UPDATE libros SET {asignaciones}, actualizado = ? WHERE id = ?",
+                (*campos.values(), time.time(), id),
+            )
+            self._conexion.commit()
+
+    def agregar_capitulo(self, id, numero, titulo, contenido, resumen=None):
+        """Añade (o reemplaza) un capítulo terminado con su resumen, en una sola transacción."""
+        ahora = time.time()
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO capitulos (libro, numero, titulo, contenido, resumen, creado)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (id, numero, titulo, contenido, resumen, ahora),
+            )
+            self._conexion.execute("UPDATE libros SET actualizado = ? WHERE id = ?", (ahora, id))
+            self._conexion.commit()
+
+    def resumenes(self, id, desde=0):
+        """Devuelve los resúmenes de los capítulos posteriores a `desde` como (número, resumen), sin su texto."""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT numero, resumen FROM capitulos"
+                " WHERE libro = ? AND numero > ? AND resumen IS NOT NULL ORDER BY numero", (id, desde)
+            ).fetchall()
+        return [(numero, resumen) for numero, resumen in filas]
+
+    def guardar_digesto(self, id, nivel, desde, hasta, resumen):
+        """Guarda el digesto de nivel `nivel` que resume los capítulos `desde`-`hasta`."""
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO digestos (libro, nivel, desde, hasta, resumen, creado)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (id, nivel, desde, hasta, resumen, time.time()),
+            )
+            self._conexion.commit()
+
+    def digestos(self, id):
+        """
+        Devuelve los digestos vigentes del libro en orden de capítulos.
+
+        Un digesto deja de estar vigente cuando otro de nivel superior cubre sus capítulos.
+
+        Retorna:
+            list: Diccionarios con nivel, desde, hasta y resumen.
+        """
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT nivel, desde, hasta, resumen FROM digestos WHERE libro = ? ORDER BY nivel DESC, desde", (id,)
+            ).fetchall()
+        vigentes = []
+        for nivel, desde, hasta, resumen in filas:
+            if not any(d["desde"] <= desde and hasta <= d["hasta"] for d in vigentes):
+                vigentes.append({"nivel": nivel, "desde": desde, "hasta": hasta, "resumen": resumen})
+        return sorted(vigentes, key=lambda d: d["desde"])
+
+    def capitulos(self, id, desde=0):
+        """Devuelve los capítulos posteriores al número `desde`, en orden, como (título, contenido)."""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT titulo, contenido FROM capitulos WHERE libro = ? AND numero > ? ORDER BY numero", (id, desde)
+            ).fetchall()
+        return [(titulo, contenido) for titulo, contenido in filas]
+
+    def eliminar(self, id):
+        """Borra el libro, sus capítulos y sus digestos."""
+        with self._lock:
+            self._conexion.execute("DELETE FROM capitulos WHERE libro = ?", (id,))
+            self._conexion.execute("DELETE FROM digestos WHERE libro = ?", (id,))
+            self._conexion.execute("DELETE FROM libros WHERE id = ?", (id,))
+            self._conexion.commit()
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def obtener_almacen_libros():
+    """Devuelve el almacén de libros del proceso, creándolo la primera vez."""
+    global _almacen
+    if _almacen is None:
+        with _almacen_lock:
+            if _almacen is None:
+                _almacen = AlmacenLibros(
+                    os.environ.get("LLM_LIBROS_RUTA", os.path.join(".cache_llm", "libros.sqlite3"))
+                )
+    return _almacen
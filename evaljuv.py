@@ -2,6 +2,8 @@ import streamlit as st
 from docx import Document
 import requests
 
+from cliente_llm import OPENROUTER_URL, post_limitado
+
 # Configuración básica
 st.set_page_config(page_title="Análisis de Novelas", layout="wide")
 st.title("Análisis Crítico de tu Novela")
@@ -12,7 +14,7 @@ def read_docx(file):
 
 def analyze_novel(text):
     try:
-        url = "https://openrouter.ai/api/v1/chat/completions"
+        url = OPENROUTER_URL
         headers = {
             "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}",
             "Content-Type": "application/json"
@@ -34,7 +36,7 @@ def analyze_novel(text):
             "max_tokens": 4000
         }
         
-        response = requests.post(url, headers=headers, json=data, timeout=120)
+        response = post_limitado(url, headers, data, timeout=120)
         response.raise_for_status()
         return response.json()["choices"][0]["message"]["content"]
     
@@ -5,12 +5,19 @@ import time
 from docx import Document
 from io import BytesIO
 import re
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from docx.shared import Inches, Pt
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from datetime import datetime
 
+from artefactos import artefacto
+from cliente_llm import OPENROUTER_URL, chat_completion, obtener_cache
+from salida_json import ENTERO, TEXTO, lista, objeto, pedir_json
+
+# Esquemas de las respuestas JSON: análisis de una escena y análisis global de la novela
+ESQUEMA_ANALISIS_ESCENA = objeto(escena=TEXTO, issues=TEXTO, suggestions=TEXTO)
+ESQUEMA_ANALISIS_GLOBAL = objeto(calificacion=ENTERO, errores=TEXTO, recomendaciones=TEXTO,
+                                 mejoras_por_escena=lista(ESQUEMA_ANALISIS_ESCENA))
+
 # Configuración de la página
 st.set_page_config(
     page_title="Analizador de Novelas de Suspenso Político",
@@ -38,7 +45,7 @@ if 'novela' not in st.session_state:
 if 'informe' not in st.session_state:
     st.session_state.informe = ""
 
-def call_openrouter_api(prompt, max_tokens=3000, temperature=0.5, top_p=0.9, top_k=50, repetition_penalty=1.2):
+def call_openrouter_api(prompt, max_tokens=3000, temperature=0.5, top_p=0.9, top_k=50, repetition_penalty=1.2, formato=None):
     """
     Llama a la API de OpenRouter para obtener una respuesta basada en el prompt proporcionado.
     
@@ -49,11 +56,12 @@ def call_openrouter_api(prompt, max_tokens=3000, temperature=0.5, top_p=0.9, top
         top_p (float): Parámetro top_p para la generación.
         top_k (int): Parámetro top_k para la generación.
         repetition_penalty (float): Penalización por repetición.
+        formato (dict): `response_format` para pedir una respuesta JSON conforme a un esquema.
     
     Retorna:
         str or None: La respuesta de la API o None si ocurre un error.
     """
-    api_url = "https://openrouter.ai/api/v1/chat/completions"
+    api_url = OPENROUTER_URL
     headers = {
         "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}",
         "Content-Type": "application/json"
@@ -69,15 +77,12 @@ def call_openrouter_api(prompt, max_tokens=3000, temperature=0.5, top_p=0.9, top
         "stop": ["[\"<|eot_id|>\"]"],
         "stream": False
     }
-    
-    session = requests.Session()
-    retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
-    session.mount('https://', HTTPAdapter(max_retries=retries))
+    if formato:
+        payload["response_format"] = formato
     
     try:
-        response = session.post(api_url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        response_json = response.json()
+        # Caché persistente: repetir el mismo análisis no vuelve a llamar a la API
+        response_json = chat_completion(api_url, headers, payload, usar_cache=True)
         if 'choices' in response_json and len(response_json['choices']) > 0:
             return response_json['choices'][0]['message']['content']
         else:
@@ -114,6 +119,22 @@ def leer_archivo(file):
         st.error(f"Error al leer el archivo: {e}")
         return None
 
+def pedir_json_api(prompt, esquema, nombre):
+    """
+    Pide a la API una respuesta JSON conforme a `esquema` y la devuelve validada.
+
+    Si la respuesta no cumple el esquema, se repara una sola vez (con temperatura 0)
+    en lugar de repetir el análisis; el resultado queda en la telemetría.
+
+    Retorna:
+        dict or None: La respuesta validada o None si no se pudo obtener.
+    """
+    return pedir_json(
+        lambda texto, formato: call_openrouter_api(texto, formato=formato),
+        prompt, esquema, nombre,
+        reparar=lambda texto, formato: call_openrouter_api(texto, temperature=0, formato=formato),
+    )
+
 def dividir_en_escenas(texto):
     """
     Divide el texto de la novela en escenas basadas en encabezados o cambios de línea dobles.
@@ -137,7 +158,7 @@ def analizar_novela(texto):
         texto (str): El texto completo de la novela.
     
     Retorna:
-        str or None: El análisis obtenido de la API o None si falla.
+        dict or None: El análisis global validado o None si falla.
     """
     escenas = dividir_en_escenas(texto)
     mejoras_por_escena = []
@@ -151,18 +172,13 @@ def analizar_novela(texto):
         
         ### Informe de Análisis:
         """
-        analisis = call_openrouter_api(prompt)
+        analisis = pedir_json_api(prompt, ESQUEMA_ANALISIS_ESCENA, "analisis_escena")
         if analisis:
-            try:
-                analisis_json = json.loads(analisis)
-                mejoras_por_escena.append({
-                    "escena": analisis_json.get("escena", f"Escena {idx}"),
-                    "issues": analisis_json.get("issues", "No se identificaron problemas específicos."),
-                    "suggestions": analisis_json.get("suggestions", "No se proporcionaron sugerencias específicas.")
-                })
-            except json.JSONDecodeError:
-                st.error(f"Error al decodificar la respuesta JSON para la Escena {idx}.")
-                continue
+            mejoras_por_escena.append({
+                "escena": analisis["escena"] or f"Escena {idx}",
+                "issues": analisis["issues"] or "No se identificaron problemas específicos.",
+                "suggestions": analisis["suggestions"] or "No se proporcionaron sugerencias específicas."
+            })
         else:
             st.error(f"No se pudo obtener análisis para la Escena {idx}.")
 
@@ -175,7 +191,7 @@ def analizar_novela(texto):
     
     ### Informe de Análisis Global:
     """
-    analisis_global = call_openrouter_api(prompt_global)
+    analisis_global = pedir_json_api(prompt_global, ESQUEMA_ANALISIS_GLOBAL, "analisis_global")
     return analisis_global
 
 def generar_informe(analisis):
@@ -183,7 +199,7 @@ def generar_informe(analisis):
     Genera un informe formateado a partir del análisis JSON obtenido de la API, incluyendo mejoras específicas por escena.
     
     Parámetros:
-        analisis (str): La respuesta JSON de la API.
+        analisis (dict): El análisis global, ya validado contra su esquema.
     
     Retorna:
         str: El informe formateado o None si falla.
@@ -191,41 +207,27 @@ def generar_informe(analisis):
     if not analisis:
         st.error("No hay análisis para generar el informe.")
         return None
-    try:
-        # Intentar cargar la respuesta como JSON
-        analisis_json = json.loads(analisis)
-        # Validar que las claves existen
-        required_keys = {"calificacion", "errores", "recomendaciones", "mejoras_por_escena"}
-        if not required_keys.issubset(analisis_json.keys()):
-            st.error("La respuesta JSON de la API está incompleta.")
-            return None
-        calificacion = analisis_json.get('calificacion', 'No disponible')
-        errores = analisis_json.get('errores', 'No se identificaron errores.')
-        recomendaciones = analisis_json.get('recomendaciones', 'No se proporcionaron recomendaciones.')
-        mejoras_por_escena = analisis_json.get('mejoras_por_escena', [])
-        
-        informe = f"# Informe de Análisis de la Novela\n\n"
-        informe += f"**Calificación General:** {calificacion} / 10\n\n"
-        informe += f"**Errores Identificados:**\n{errores}\n\n"
-        informe += f"**Recomendaciones para Mejoras:**\n{recomendaciones}\n\n"
-        informe += f"## Mejoras Específicas por Escena\n\n"
-        
-        for mejora in mejoras_por_escena:
-            escena = mejora.get('escena', 'No especificada')
-            issues = mejora.get('issues', 'No se identificaron problemas específicos.')
-            suggestions = mejora.get('suggestions', 'No se proporcionaron sugerencias específicas.')
-            
-            informe += f"### Escena: {escena}\n\n"
-            informe += f"**Problemas Identificados:** {issues}\n\n"
-            informe += f"**Sugerencias de Mejora:** {suggestions}\n\n"
+    calificacion = analisis['calificacion']
+    errores = analisis['errores'] or 'No se identificaron errores.'
+    recomendaciones = analisis['recomendaciones'] or 'No se proporcionaron recomendaciones.'
+    mejoras_por_escena = analisis['mejoras_por_escena']
+    
+    informe = f"# Informe de Análisis de la Novela\n\n"
+    informe += f"**Calificación General:** {calificacion} / 10\n\n"
+    informe += f"**Errores Identificados:**\n{errores}\n\n"
+    informe += f"**Recomendaciones para Mejoras:**\n{recomendaciones}\n\n"
+    informe += f"## Mejoras Específicas por Escena\n\n"
+    
+    for mejora in mejoras_por_escena:
+        escena = mejora['escena'] or 'No especificada'
+        issues = mejora['issues'] or 'No se identificaron problemas específicos.'
+        suggestions = mejora['suggestions'] or 'No se proporcionaron sugerencias específicas.'
         
-        return informe
-    except json.JSONDecodeError:
-        # Si la respuesta no es JSON, mostrar el contenido completo
-        informe = f"# Informe de Análisis de la Novela\n\n"
-        informe += f"**Calificación General:** No disponible\n\n"
-        informe += f"**Errores y Recomendaciones:**\n{analisis}\n\n"
-        return informe
+        informe += f"### Escena: {escena}\n\n"
+        informe += f"**Problemas Identificados:** {issues}\n\n"
+        informe += f"**Sugerencias de Mejora:** {suggestions}\n\n"
+    
+    return informe
 
 def exportar_informe_word(informe):
     """
@@ -348,6 +350,11 @@ def mostrar_analisis():
             st.session_state.etapa = "completado"
             progress_bar.progress(100)
             status_text.text("Análisis completado exitosamente.")
+            estadisticas_cache = obtener_cache().estadisticas()
+            st.caption(
+                f"Caché de respuestas: {estadisticas_cache['aciertos']} aciertos, "
+                f"{estadisticas_cache['fallos']} llamadas a la API."
+            )
 
         except Exception as e:
             st.error(f"Ocurrió un error durante el análisis: {e}")
@@ -365,8 +372,8 @@ def mostrar_completado():
     st.subheader("Informe Detallado:")
     st.markdown(informe)  # Usar markdown para una mejor visualización
 
-    # Exportar a Word
-    doc_buffer = exportar_informe_word(informe)
+    # Exportar a Word; el documento solo se reconstruye si cambia el informe
+    doc_buffer = artefacto("informe_docx", lambda: exportar_informe_word(informe), informe)
     st.download_button(
         label="Descargar Informe en Word",
         data=doc_buffer,
@@ -1,11 +1,17 @@
 import streamlit as st
 import requests
-import json
 import base64
-from typing import List
+from typing import List, Optional
 from io import BytesIO
 from PIL import Image
 
+from cliente_llm import TOGETHER_IMAGES_URL, post_limitado
+from enrutador import chat_tarea, claves_api
+from salida_json import TEXTO, lista, objeto, pedir_json
+
+# Esquema de los momentos clave que se piden en JSON
+ESQUEMA_MOMENTOS = objeto(momentos=lista(TEXTO))
+
 # Set page configuration
 st.set_page_config(
     page_title="Fábulas Ilustradas",
@@ -28,60 +34,50 @@ fable_text = st.text_area(
     placeholder="Escribe o pega la fábula clásica que deseas ilustrar..."
 )
 
-# Function to extract key moments using Together's Chat Completions API
+# Function to extract key moments with a chat model (JSON mode with a schema)
+# It is an auxiliary task: it runs on the fast model of the "momentos_clave" task (see enrutador.NIVELES_TAREAS)
+# If the answer does not match the schema, it is repaired once at temperature 0
 def get_key_moments(fable: str, api_key: str) -> List[str]:
-    url = "https://api.together.xyz/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    messages = [
-        {
-            "role": "system",
-            "content": "Extrae los momentos clave de la siguiente fábula. Devuelve una lista enumerada de momentos importantes."
-        },
-        {
-            "role": "user",
-            "content": fable
+    claves = dict(claves_api(st.secrets), together=api_key)
+
+    def call(messages: List[dict], formato: dict, temperature: float) -> Optional[str]:
+        payload = {
+            "messages": messages,
+            "max_tokens": 1500,
+            "temperature": temperature,
+            "top_p": 0.7,
+            "top_k": 50,
+            "repetition_penalty": 1,
+            "stop": ["<|eot_id|>"],
+            "stream": False,
+            "response_format": formato,
         }
-    ]
-    
-    payload = {
-        "model": "Qwen/Qwen2.5-7B-Instruct-Turbo",
-        "messages": messages,
-        "max_tokens": 1500,
-        "temperature": 0.7,
-        "top_p": 0.7,
-        "top_k": 50,
-        "repetition_penalty": 1,
-        "stop": ["<|eot_id|>"],
-        "stream": False
+
+        try:
+            data = chat_tarea("momentos_clave", payload, claves)
+        except requests.exceptions.RequestException as e:
+            st.error(f"Error al extraer momentos clave: {e}")
+            return None
+
+        return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+    system = {
+        "role": "system",
+        "content": "Extrae los momentos clave de la siguiente fábula. Responde únicamente con un objeto JSON "
+                   "cuyo campo \"momentos\" sea la lista de momentos importantes, en orden."
     }
-    
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    
-    if response.status_code != 200:
-        st.error(f"Error al extraer momentos clave: {response.text}")
+    data = pedir_json(
+        lambda text, formato: call([system, {"role": "user", "content": text}], formato, 0.7),
+        fable, ESQUEMA_MOMENTOS, "momentos_clave",
+        reparar=lambda text, formato: call([{"role": "user", "content": text}], formato, 0),
+    )
+    if not data:
         return []
-    
-    data = response.json()
-    key_moments_text = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-    
-    # Procesar el texto para obtener una lista de momentos
-    key_moments = []
-    for line in key_moments_text.split('\n'):
-        line = line.strip()
-        if line and (line[0].isdigit() and line[1] == '.'):
-            # Eliminar el número y el punto
-            moment = line.split('.', 1)[1].strip()
-            key_moments.append(moment)
-    
-    return key_moments
+    return [moment.strip() for moment in data["momentos"] if moment.strip()]
 
 # Function to generate an image using Together's Image Generation API
 def generate_image(prompt: str, api_key: str) -> Image.Image:
-    url = "https://api.together.xyz/v1/images/generations"
+    url = TOGETHER_IMAGES_URL
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -100,7 +96,7 @@ def generate_image(prompt: str, api_key: str) -> Image.Image:
         "response_format": "b64_json"
     }
     
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+    response = post_limitado(url, headers, payload)
     
     if response.status_code != 200:
         st.error(f"Error al generar la imagen: {response.text}")
@@ -154,3 +150,5 @@ st.markdown("""
 
 ```toml
 TOGETHER_API_KEY = "tu_clave_api_aquí"
+```
+""")
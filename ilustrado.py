@@ -1,9 +1,10 @@
 import streamlit as st
-import requests
 import base64
 import json
 import re
 
+from cliente_llm import TOGETHER_IMAGES_URL, TOGETHER_URL, post_limitado
+
 # Get the API key from Streamlit secrets
 TOGETHER_API_KEY = st.secrets["TOGETHER_API_KEY"]
 
@@ -52,11 +53,7 @@ if st.button("Generate Illustration"):
                 "stream": False
             }
 
-            response = requests.post(
-                "https://api.together.xyz/v1/chat/completions",
-                headers=headers,
-                json=data
-            )
+            response = post_limitado(TOGETHER_URL, headers, data)
 
             if response.status_code == 200:
                 response_data = response.json()
@@ -108,11 +105,7 @@ if st.button("Generate Illustration"):
                     "response_format": "b64_json"
                 }
 
-                image_response = requests.post(
-                    "https://api.together.xyz/v1/images/generations",
-                    headers=headers,
-                    json=image_data
-                )
+                image_response = post_limitado(TOGETHER_IMAGES_URL, headers, image_data)
 
                 if image_response.status_code == 200:
                     image_response_data = image_response.json()
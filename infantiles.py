@@ -1,6 +1,5 @@
 import streamlit as st
 import requests
-import json
 from docx import Document
 from docx.shared import Inches
 from io import BytesIO
@@ -10,6 +9,10 @@ import base64
 import nltk
 from nltk.tokenize import sent_tokenize
 import concurrent.futures
+import contextvars
+
+from cliente_llm import OPENROUTER_URL, TOGETHER_IMAGES_URL, post_limitado
+from trabajos import COMPLETADO, avisar, mostrar_trabajo, obtener_gestor, sondear
 
 # Configuración de la página
 st.set_page_config(
@@ -95,19 +98,18 @@ selected_age_group = st.sidebar.selectbox(
     age_groups
 )
 
-# Botón para generar cuentos
-if st.sidebar.button("Generar Cuentos"):
-    with st.spinner("Generando cuentos e ilustraciones..."):
-        # Función para generar y corregir un solo cuento usando OpenRouter
-        def generate_corrected_story(theme, age_group, character_name):
-            api_url = "https://openrouter.ai/api/v1/chat/completions"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}"
-            }
-
-            # Definir las 20 directrices
-            guidelines = """
+# Función para generar los cuentos y sus ilustraciones; se ejecuta como trabajo en segundo plano (trabajos.py)
+def generar_cuentos(trabajo, num_stories, selected_age_group):
+    # Función para generar y corregir un solo cuento usando OpenRouter
+    def generate_corrected_story(theme, age_group, character_name):
+        api_url = OPENROUTER_URL
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}"
+        }
+
+        # Definir las 20 directrices
+        guidelines = """
 1. **Desarrollo de Personajes:**
    - Profundiza en los conflictos internos de los personajes. Muestra sus miedos, dudas y pequeñas victorias para hacerlos más humanos y relacionables. A medida que cada personaje enfrenta un desafío, incluye momentos donde reflexionen sobre sus inseguridades o limitaciones para enriquecer su crecimiento.
 
@@ -167,10 +169,10 @@ if st.sidebar.button("Generar Cuentos"):
 
 20. **Transmitir Valores Positivos sin Ser Moralista:**
     - En lugar de hacer la moral explícita, permite que los valores positivos emerjan naturalmente de las decisiones y acciones de los personajes. Esto evita que las historias se sientan moralizantes y da al mensaje una resonancia poderosa y sutil.
-            """
+        """
 
-            # Añadir las directrices al prompt
-            prompt = f"""
+        # Añadir las directrices al prompt
+        prompt = f"""
 {guidelines}
 
 Crea una historia que cumpla con las siguientes características:
@@ -179,125 +181,146 @@ Crea una historia que cumpla con las siguientes características:
 - Grupo de edad: {age_group}
 - Nombre del personaje principal: {character_name}
 - Texto continuo sin subdivisiones ni subtítulos.
-            """
-
-            data = {
-                "model": "gpt-4",  # Asegúrate de que este modelo esté disponible en OpenRouter
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1000  # Ajusta según sea necesario
-            }
-
-            try:
-                response = requests.post(api_url, headers=headers, data=json.dumps(data))
-                response.raise_for_status()
-                result = response.json()
-
-                # Verificar estructura de la respuesta
-                if 'choices' in result and len(result['choices']) > 0:
-                    story = result['choices'][0]['message']['content'].strip()
-                else:
-                    st.error("Respuesta inesperada de la API de OpenRouter.")
-                    return "Lo siento, ocurrió un error al generar el cuento."
-
-                return story
-            except requests.exceptions.HTTPError as http_err:
-                st.error(f"Ocurrió un error HTTP: {http_err}")
-                if 'response' in locals():
-                    st.write(response.text)  # Mostrar la respuesta completa para depuración
-            except Exception as err:
-                st.error(f"Ocurrió un error: {err}")
-            return "Lo siento, ocurrió un error al generar el cuento."
-
-        # Función para generar una ilustración usando Together.xyz
-        def generate_image(prompt_description):
-            together_api_key = st.secrets.get('TOGETHER_API_KEY')
-            if not together_api_key:
-                st.error("La clave API de Together.xyz no está configurada en los secretos de Streamlit.")
-                return None
-
-            api_url = "https://api.together.xyz/v1/images/generations"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {together_api_key}"
-            }
-
-            data = {
-                "model": "black-forest-labs/FLUX.1.1-pro",
-                "prompt": prompt_description,
-                "width": 512,
-                "height": 512,
-                "steps": 1,
-                "n": 1,
-                "response_format": "b64_json"
-            }
-
-            try:
-                response = requests.post(api_url, headers=headers, data=json.dumps(data))
-                response.raise_for_status()
-                result = response.json()
-                b64_image = result['data'][0]['b64_json']
-                image_bytes = base64.b64decode(b64_image)
-                image = Image.open(BytesIO(image_bytes))
-                return image
-            except requests.exceptions.HTTPError as http_err:
-                st.error(f"Ocurrió un error HTTP al generar la imagen: {http_err}")
-                if 'response' in locals():
-                    st.write(response.text)  # Mostrar la respuesta completa para depuración
-            except Exception as err:
-                st.error(f"Ocurrió un error al generar la imagen: {err}")
+        """
+
+        data = {
+            "model": "gpt-4",  # Asegúrate de que este modelo esté disponible en OpenRouter
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.7,
+            "max_tokens": 1000  # Ajusta según sea necesario
+        }
+
+        try:
+            response = post_limitado(api_url, headers, data)
+            response.raise_for_status()
+            result = response.json()
+
+            # Verificar estructura de la respuesta
+            if 'choices' in result and len(result['choices']) > 0:
+                story = result['choices'][0]['message']['content'].strip()
+            else:
+                avisar("Respuesta inesperada de la API de OpenRouter.")
+                return "Lo siento, ocurrió un error al generar el cuento."
+
+            return story
+        except requests.exceptions.HTTPError as http_err:
+            avisar(f"Ocurrió un error HTTP: {http_err}")
+            if 'response' in locals():
+                avisar(response.text, "info")  # Mostrar la respuesta completa para depuración
+        except Exception as err:
+            avisar(f"Ocurrió un error: {err}")
+        return "Lo siento, ocurrió un error al generar el cuento."
+
+    # Función para generar una ilustración usando Together.xyz
+    def generate_image(prompt_description):
+        together_api_key = st.secrets.get('TOGETHER_API_KEY')
+        if not together_api_key:
+            avisar("La clave API de Together.xyz no está configurada en los secretos de Streamlit.")
             return None
 
-        # Seleccionar temas para el número de cuentos
-        selected_themes = random.sample(themes, num_stories) if num_stories <= len(themes) else random.choices(themes, k=num_stories)
-
-        # Generar todos los cuentos y sus ilustraciones
-        stories = []
-        used_names = []
-        progress_bar = st.progress(0)
-
-        # Uso de ThreadPoolExecutor para paralelizar la generación de cuentos e imágenes
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_story = {}
-            for i in range(num_stories):
-                theme = selected_themes[i]
-                # Obtener un nombre de personaje único
-                character_name = get_unique_name(used_names)
-                used_names.append(character_name)
-                # Iniciar la generación del cuento
-                future = executor.submit(generate_corrected_story, theme, selected_age_group, character_name)
-                future_to_story[future] = (theme, character_name, i)
-
-            for future in concurrent.futures.as_completed(future_to_story):
-                theme, character_name, i = future_to_story[future]
-                story = future.result()
-                if story.startswith("Lo siento"):
-                    images = [None, None]
+        api_url = TOGETHER_IMAGES_URL
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {together_api_key}"
+        }
+
+        data = {
+            "model": "black-forest-labs/FLUX.1.1-pro",
+            "prompt": prompt_description,
+            "width": 512,
+            "height": 512,
+            "steps": 1,
+            "n": 1,
+            "response_format": "b64_json"
+        }
+
+        try:
+            response = post_limitado(api_url, headers, data)
+            response.raise_for_status()
+            result = response.json()
+            b64_image = result['data'][0]['b64_json']
+            image_bytes = base64.b64decode(b64_image)
+            image = Image.open(BytesIO(image_bytes))
+            return image
+        except requests.exceptions.HTTPError as http_err:
+            avisar(f"Ocurrió un error HTTP al generar la imagen: {http_err}")
+            if 'response' in locals():
+                avisar(response.text, "info")  # Mostrar la respuesta completa para depuración
+        except Exception as err:
+            avisar(f"Ocurrió un error al generar la imagen: {err}")
+        return None
+
+    # Seleccionar temas para el número de cuentos
+    selected_themes = random.sample(themes, num_stories) if num_stories <= len(themes) else random.choices(themes, k=num_stories)
+
+    # Generar todos los cuentos y sus ilustraciones
+    stories = []
+    used_names = []
+    trabajo.progreso(0, num_stories)
+
+    # Uso de ThreadPoolExecutor para paralelizar la generación de cuentos e imágenes
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        future_to_story = {}
+        for i in range(num_stories):
+            theme = selected_themes[i]
+            # Obtener un nombre de personaje único
+            character_name = get_unique_name(used_names)
+            used_names.append(character_name)
+            # Iniciar la generación del cuento
+            # Copiar el contexto para que los mensajes del hilo lleguen al trabajo
+            future = executor.submit(contextvars.copy_context().run, generate_corrected_story,
+                                     theme, selected_age_group, character_name)
+            future_to_story[future] = (theme, character_name, i)
+
+        for future in concurrent.futures.as_completed(future_to_story):
+            theme, character_name, i = future_to_story[future]
+            story = future.result()
+            if story.startswith("Lo siento"):
+                images = [None, None]
+            else:
+                # Extraer momentos clave de la historia
+                key_moments = extract_key_moments(story)
+                if len(key_moments) < 2:
+                    # Si hay menos de 2 momentos clave, usar descripciones generales
+                    image_prompt1 = f"Ilustración colorida y atractiva para un cuento infantil sobre {theme}."
+                    image_prompt2 = f"Ilustración que represente un momento significativo en la historia de {character_name} en el tema de {theme}."
                 else:
-                    # Extraer momentos clave de la historia
-                    key_moments = extract_key_moments(story)
-                    if len(key_moments) < 2:
-                        # Si hay menos de 2 momentos clave, usar descripciones generales
-                        image_prompt1 = f"Ilustración colorida y atractiva para un cuento infantil sobre {theme}."
-                        image_prompt2 = f"Ilustración que represente un momento significativo en la historia de {character_name} en el tema de {theme}."
-                    else:
-                        image_prompt1 = f"Ilustración colorida y atractiva de un momento clave: {key_moments[0]}"
-                        image_prompt2 = f"Ilustración que represente otro momento significativo: {key_moments[1]}"
-                    # Generar las imágenes
-                    image1 = generate_image(image_prompt1)
-                    image2 = generate_image(image_prompt2)
-                    images = [image1, image2]
-                stories.append({
-                    "title": f"Capítulo {i+1}: {theme.title()}",
-                    "content": story,
-                    "images": images  # Almacenar una lista de imágenes
-                })
-                progress_bar.progress((i + 1) / num_stories)
+                    image_prompt1 = f"Ilustración colorida y atractiva de un momento clave: {key_moments[0]}"
+                    image_prompt2 = f"Ilustración que represente otro momento significativo: {key_moments[1]}"
+                # Generar las imágenes
+                image1 = generate_image(image_prompt1)
+                image2 = generate_image(image_prompt2)
+                images = [image1, image2]
+            stories.append({
+                "title": f"Capítulo {i+1}: {theme.title()}",
+                "content": story,
+                "images": images  # Almacenar una lista de imágenes
+            })
+            trabajo.progreso(len(stories), texto=f"{len(stories)} de {num_stories} cuentos generados.")
+
+    return stories
+
+# Botón para generar cuentos
+if st.sidebar.button("Generar Cuentos"):
+    # Los cuentos se generan en segundo plano; la página solo consulta el progreso
+    trabajo = obtener_gestor().enviar("cuentos", generar_cuentos, num_stories, selected_age_group)
+    st.session_state.trabajo = trabajo.id
+    st.query_params["trabajo"] = trabajo.id
+
+# Progreso y resultado de la generación (también tras recargar la página)
+trabajo = obtener_gestor().obtener(st.session_state.get("trabajo") or st.query_params.get("trabajo"))
+if trabajo is not None:
+    if trabajo.activo():
+        st.info("Generando cuentos e ilustraciones...")
+    mostrar_trabajo(trabajo)
+    sondear(trabajo)
+    if trabajo.estado == COMPLETADO:
+        stories = trabajo.resultado
 
         # Crear un documento de Word
         doc = Document()
@@ -3,13 +3,17 @@ import requests
 from docx import Document
 from io import BytesIO
 import backoff
-import re
 from difflib import SequenceMatcher
 import pandas as pd
 
+from cliente_llm import OPENROUTER_URL, post_limitado
+from salida_json import TEXTO, objeto, pedir_json
+
 # Definir la cantidad máxima de capítulos
 MAX_CAPITULOS = 24
 MAX_INTENTOS = 3  # Número máximo de intentos para generar un capítulo único
+# Esquema del capítulo generado: título, resumen, tema y cuento
+ESQUEMA_CAPITULO = objeto(title=TEXTO, summary=TEXTO, theme=TEXTO, story=TEXTO)
 
 # Configuración de la página
 st.set_page_config(
@@ -60,59 +64,51 @@ Write an adventure story intended for boys and girls aged between 9 and 12 years
 - **Narrative Style**: Third person or first person.
 
 # Output Format
-The output should include:
-1. **CHAPTER {n}: {Title}**
-2. **Summary:** A brief summary of the chapter.
-3. **Story Content:** The full story, between 500-700 words.
+Respond only with a JSON object, without any additional text, with these fields:
+- "title": The story's title, without the "CHAPTER {n}:" prefix.
+- "summary": A brief summary of the chapter.
+- "theme": The main theme of the story, in a few words.
+- "story": The full story, between 500-700 words.
 
 Each time a speaking character changes, use a line break for clarity.
 
-# Chapter Title Format
-Begin the story with "CHAPTER {n}: {Title}", where {n} is the chapter number and {Title} is the story's title.
-
 # Unique Theme Instruction
 Each chapter must have a unique theme that has not been used in previous chapters. Refer to the list of used themes below and choose a new, distinct theme for this story. Avoid using similar phrases or titles such as "The Quest for...", "The Mystery of...", or "The Adventure of...".
 """
 
-# Función para extraer el título usando expresiones regulares
-def extraer_titulo(respuesta, capitulo_num):
-    # Buscamos "CHAPTER {n}: Título"
-    patron = rf'CHAPTER\s*{capitulo_num}:\s*(.*)'
-    match = re.search(patron, respuesta, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    return None  # Retornar None si no se encuentra el título
-
-# Función para extraer el resumen del cuento
-def extraer_resumen(respuesta):
-    # Buscar la línea que comienza con "Summary:"
-    patron = r'Summary:\s*(.*)'
-    match = re.search(patron, respuesta, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    return None  # Retornar None si no se encuentra el resumen
-
-# Función para extraer el tema principal del cuento
-def extraer_tema(respuesta):
-    # Buscar la línea que comienza con "Summary:" y extraer la última oración como tema
-    patron = r'Summary:\s*(.*)'
-    match = re.search(patron, respuesta, re.IGNORECASE)
-    if match:
-        resumen = match.group(1).strip()
-        # Dividir en oraciones y tomar la última
-        oraciones = re.split(r'[.!?]', resumen)
-        if len(oraciones) >= 1:
-            return oraciones[-1].strip()
-    return None  # Retornar None si no se encuentra el tema
-
-# Función con reintentos para generar un capítulo
+# Función con reintentos para llamar a la API y obtener el texto de la respuesta
+# `formato` es el `response_format` de una respuesta JSON
 @backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=3)
-def generar_capitulo(capitulo_num, titulo, resumen):
-    url = "https://openrouter.ai/api/v1/chat/completions"
+def llamar_api(mensaje, formato=None, temperature=None):
+    url = OPENROUTER_URL
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}"
     }
+    data = {
+        "model": "openai/gpt-4o-mini",  # Mantener el modelo especificado
+        "messages": [
+            {
+                "role": "user",
+                "content": mensaje
+            }
+        ]
+    }
+    if formato:
+        data["response_format"] = formato
+    if temperature is not None:
+        data["temperature"] = temperature
+
+    response = post_limitado(url, headers, data)
+    response.raise_for_status()
+    respuesta = response.json()
+    if 'choices' in respuesta and len(respuesta['choices']) > 0:
+        return respuesta['choices'][0]['message']['content']
+    return None
+
+# Función para generar un capítulo: título, resumen, contenido y tema
+# Si la respuesta no cumple el esquema, se repara una sola vez con temperatura 0
+def generar_capitulo(capitulo_num, titulo, resumen):
 
     # Construir el prompt incluyendo la lista de temas utilizados
     temas_utilizados = st.session_state.temas_utilizados
@@ -132,38 +128,16 @@ def generar_capitulo(capitulo_num, titulo, resumen):
         f"{prompt}\n\n"
         f"CHAPTER {capitulo_num}: {titulo}\n"
         f"Summary: {resumen}\n"
-        f"Story Content:"
     )
 
-    data = {
-        "model": "openai/gpt-4o-mini",  # Mantener el modelo especificado
-        "messages": [
-            {
-                "role": "user",
-                "content": mensaje
-            }
-        ]
-    }
-
-    response = requests.post(url, headers=headers, json=data)
-    response.raise_for_status()
-    respuesta = response.json()
-    if 'choices' in respuesta and len(respuesta['choices']) > 0:
-        contenido_completo = respuesta['choices'][0]['message']['content']
-        titulo_generado = extraer_titulo(contenido_completo, capitulo_num)
-        resumen_generado = extraer_resumen(contenido_completo)
-        tema_generado = extraer_tema(contenido_completo)
-        # Extraer el contenido sin el título y el resumen
-        contenido = contenido_completo
-        if titulo_generado:
-            contenido = contenido.replace(f"CHAPTER {capitulo_num}: {titulo_generado}", "", 1)
-        if resumen_generado:
-            contenido = contenido.replace(f"Summary: {resumen_generado}", "", 1)
-        contenido = contenido.strip()
-        return titulo_generado, resumen_generado, contenido, tema_generado
-    else:
+    capitulo = pedir_json(llamar_api, mensaje, ESQUEMA_CAPITULO, "capitulo_juvenil",
+                          reparar=lambda texto, formato: llamar_api(texto, formato, temperature=0))
+    if capitulo is None:
         st.error(f"Unexpected API response when generating Chapter {capitulo_num}.")
         return None, None, None, None
+    titulo_generado = capitulo['title'].strip() or titulo
+    resumen_generado = capitulo['summary'].strip() or resumen
+    return titulo_generado, resumen_generado, capitulo['story'].strip(), capitulo['theme'].strip()
 
 # Función para crear el documento Word con tabla de contenidos y capítulos
 def crear_documento(capitulos_list, titulo):
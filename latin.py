@@ -1,6 +1,5 @@
 import streamlit as st
 import requests
-import json
 from docx import Document
 from docx.shared import Inches
 from io import BytesIO
@@ -8,6 +7,12 @@ import random
 from PIL import Image
 import base64
 
+from cliente_llm import OPENROUTER_URL, TOGETHER_IMAGES_URL, post_limitado
+from tokens import PresupuestoExcedido, ajustar_max_tokens, presupuesto_salida
+
+# Longitud aproximada de cada cuento en palabras latinas
+PALABRAS_CUENTO = 600
+
 # Función para convertir números a numerales romanos
 def int_to_roman(input):
     if not isinstance(input, type(1)):
@@ -176,7 +181,7 @@ if st.sidebar.button("Generar Cuentos"):
     with st.spinner("Generando cuentos e ilustraciones..."):
         # Función para generar y corregir un solo cuento usando OpenRouter
         def generate_corrected_story(theme, age_group, character_name):
-            api_url = "https://openrouter.ai/api/v1/chat/completions"
+            api_url = OPENROUTER_URL
             headers = {
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}"
@@ -258,20 +263,27 @@ if st.sidebar.button("Generar Cuentos"):
     - Escribe la historia en **latín simplificado**, utilizando una gramática y vocabulario adecuados para niños que están aprendiendo el idioma.
     """
 
+            messages = [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+            try:
+                # El latín consume más tokens por palabra; el prompt y la salida deben caber en los 8k de gpt-4
+                max_tokens = ajustar_max_tokens(messages, presupuesto_salida(PALABRAS_CUENTO, "la"), "gpt-4")
+            except PresupuestoExcedido as e:
+                st.error(f"El prompt es demasiado largo para el modelo: {e}")
+                return "Lo siento, ocurrió un error al generar el cuento."
             data = {
                 "model": "gpt-4",  # Asegúrate de que este modelo esté disponible en OpenRouter
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                "messages": messages,
                 "temperature": 0.7,
-                "max_tokens": 1500  # Aumentar tokens para asegurar suficiente contenido en latín
+                "max_tokens": max_tokens
             }
 
             try:
-                response = requests.post(api_url, headers=headers, data=json.dumps(data))
+                response = post_limitado(api_url, headers, data)
                 response.raise_for_status()
                 result = response.json()
 
@@ -298,7 +310,7 @@ if st.sidebar.button("Generar Cuentos"):
                 st.error("La clave API de Together.xyz no está configurada en los secretos de Streamlit.")
                 return None
 
-            api_url = "https://api.together.xyz/v1/images/generations"
+            api_url = TOGETHER_IMAGES_URL
             headers = {
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {together_api_key}"
@@ -315,7 +327,7 @@ if st.sidebar.button("Generar Cuentos"):
             }
 
             try:
-                response = requests.post(api_url, headers=headers, data=json.dumps(data))
+                response = post_limitado(api_url, headers, data)
                 response.raise_for_status()
                 result = response.json()
                 b64_image = result['data'][0]['b64_json']
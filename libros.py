@@ -1,12 +1,22 @@
 import streamlit as st
+import concurrent.futures
+import contextvars
 import requests
 import time
 from docx import Document
 from io import BytesIO
-import pickle
-import os
 import re  # Importar regex
 
+from artefactos import artefacto, documento_incremental
+from cliente_llm import obtener_cliente
+from contexto_libros import compactar, contexto_libro, piezas_contexto
+from enrutador import chat_tarea, claves_api, modelo_enviado
+from estado_libros import id_libro, obtener_almacen_libros
+from plazos import plazo_trabajo
+from telemetria import formatear_resumen, trabajo_telemetria
+from tokens import PresupuestoExcedido, ajustar_max_tokens, presupuesto_salida, recortar_bloque
+from trabajos import COMPLETADO, avisar, mostrar_trabajo, obtener_gestor, sondear
+
 # Configuración de la página
 st.set_page_config(
     page_title="📚 Generador de Libros",
@@ -17,8 +27,16 @@ st.set_page_config(
 st.title("📚 Generador de Libros")
 st.write("Esta aplicación genera un libro basado en la idea que ingreses, dividido en capítulos con títulos, evitando la repetición de contenido.")
 
-# Ruta del archivo donde se guardará el estado
-ESTADO_ARCHIVO = 'estado_generacion.pkl'
+# Tipo del documento Word que se escribe capítulo a capítulo durante la generación (artefactos.py)
+DOCUMENTO_PARCIAL = "libro_docx_parcial"
+
+# Tiempo máximo por capítulo (generación y resumen) dentro del plazo de cada ejecución
+PLAZO_POR_CAPITULO = 10 * 60
+
+# Palabras máximas de cada digesto
+PALABRAS_DIGESTO = 250
+# Palabras del resumen que acompaña a cada capítulo
+PALABRAS_RESUMEN = 200
 
 # Definir características para diferentes géneros o tipos de libro
 CARACTERISTICAS_LIBRO = {
@@ -93,51 +111,54 @@ CARACTERISTICAS_LIBRO = {
     # Puedes agregar más tipos según sea necesario
 }
 
-def guardar_estado():
-    """Guarda el estado de la sesión en un archivo local."""
-    with open(ESTADO_ARCHIVO, 'wb') as f:
-        pickle.dump({
-            'capitulos': st.session_state.capitulos,
-            'resumenes': st.session_state.resumenes,
-            'titulo_obra': st.session_state.titulo_obra,
-            'proceso_generado': st.session_state.proceso_generado,
-            'prompt': st.session_state.prompt,
-            'tipo_libro': st.session_state.tipo_libro,
-            'idioma': st.session_state.idioma  # Guardar el idioma seleccionado
-        }, f)
+def libro_actual():
+    """Identificador del libro de esta sesión (o el indicado en la URL tras recargar la página)."""
+    return st.session_state.get('libro') or st.query_params.get("libro")
 
 def cargar_estado():
-    """Carga el estado de la sesión desde un archivo local."""
-    if os.path.exists(ESTADO_ARCHIVO):
-        with open(ESTADO_ARCHIVO, 'rb') as f:
-            estado = pickle.load(f)
-            st.session_state.capitulos = estado.get('capitulos', [])
-            st.session_state.resumenes = estado.get('resumenes', [])
-            st.session_state.titulo_obra = estado.get('titulo_obra', "Libro")
-            st.session_state.proceso_generado = estado.get('proceso_generado', False)
-            st.session_state.prompt = estado.get('prompt', "")
-            st.session_state.tipo_libro = estado.get('tipo_libro', list(CARACTERISTICAS_LIBRO.keys())[0])
-            st.session_state.idioma = estado.get('idioma', "Español")  # Cargar el idioma seleccionado
-        return True
-    return False
+    """
+    Carga en la sesión el libro guardado de esta sesión.
+
+    Los metadatos se leen en cada ejecución del script, pero de los capítulos solo
+    se leen los que la sesión aún no tiene (los que el trabajo ha añadido desde
+    la última vez).
+    """
+    id = libro_actual()
+    libro = obtener_almacen_libros().obtener(id) if id else None
+    if libro is None:
+        return False
+    if st.session_state.get('libro') != id:
+        st.session_state.capitulos = []
+    st.session_state.libro = id
+    st.session_state.titulo_obra = libro['titulo_obra']
+    st.session_state.proceso_generado = libro['proceso_generado']
+    st.session_state.prompt = libro['prompt']
+    st.session_state.tipo_libro = libro['tipo_libro']
+    st.session_state.idioma = libro['idioma']
+    if libro['capitulos'] > len(st.session_state.capitulos):
+        st.session_state.capitulos = st.session_state.capitulos + obtener_almacen_libros().capitulos(
+            id, desde=len(st.session_state.capitulos)
+        )
+    return True
 
 def limpiar_estado():
-    """Limpia el estado de la sesión y elimina el archivo de estado si existe."""
+    """Limpia el estado de la sesión y elimina el libro guardado de la sesión si existe."""
+    id = libro_actual()
+    if id:
+        obtener_almacen_libros().eliminar(id)
+        documento_incremental(DOCUMENTO_PARCIAL, id).eliminar()
+    st.session_state.libro = None
+    st.query_params.pop("libro", None)
     st.session_state.capitulos = []
-    st.session_state.resumenes = []
     st.session_state.titulo_obra = "Libro"
     st.session_state.proceso_generado = False
     st.session_state.prompt = ""
     st.session_state.tipo_libro = list(CARACTERISTICAS_LIBRO.keys())[0]
     st.session_state.idioma = "Español"  # Valor por defecto
-    if os.path.exists(ESTADO_ARCHIVO):
-        os.remove(ESTADO_ARCHIVO)
 
 # Inicializar estado de la sesión
 if 'capitulos' not in st.session_state:
     st.session_state.capitulos = []
-if 'resumenes' not in st.session_state:
-    st.session_state.resumenes = []
 if 'titulo_obra' not in st.session_state:
     st.session_state.titulo_obra = "Libro"
 if 'proceso_generado' not in st.session_state:
@@ -149,7 +170,7 @@ if 'tipo_libro' not in st.session_state:
 if 'idioma' not in st.session_state:
     st.session_state.idioma = "Español"  # Valor por defecto
 
-# Intentar cargar el estado guardado al iniciar la aplicación
+# Intentar cargar el libro guardado de esta sesión al iniciar la aplicación
 estado_cargado = cargar_estado()
 
 def eliminar_secciones(contenido):
@@ -164,13 +185,29 @@ def eliminar_secciones(contenido):
     contenido_sin_secciones = "\n".join([linea for linea in contenido_sin_secciones.split("\n") if linea.strip() != ""])
     return contenido_sin_secciones
 
-def generar_capitulo(prompt, capitulo_num, resumen_previas, tipo_libro, idioma, intentos=3):
+def separar_resumen(contenido):
+    """
+    Separa el resumen que el modelo escribe al final del capítulo (tras `**Resumen:**`).
+
+    Retorna:
+        tuple: (contenido sin el resumen, resumen en una línea o None si no lo hay).
+    """
+    *cuerpo, resumen = re.split(r"\*\*Resumen:\*\*", contenido, flags=re.IGNORECASE)
+    resumen = ' '.join(resumen.split())
+    if not cuerpo or not resumen:
+        return contenido, None
+    # Quitar los guiones que separan el contenido del resumen
+    return "**Resumen:**".join(cuerpo).rstrip().rstrip('-').rstrip(), resumen
+
+def generar_capitulo(prompt, capitulo_num, resumen_previas, tipo_libro, idioma, intentos=3, al_recibir=None):
+    """
+    Escribe un capítulo y su resumen en una sola respuesta.
+
+    Retorna:
+        tuple: (título, contenido, resumen); el resumen es None si el modelo no lo
+        incluyó, y todo es None si no se pudo generar el capítulo.
+    """
     for intento in range(intentos):
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}"
-        }
         instrucciones = (
             "Asegúrate de que el contenido generado cumpla con las características del tipo de libro seleccionado. "
             "Desarrolla los conceptos clave y explora sus aplicaciones. "
@@ -189,29 +226,45 @@ def generar_capitulo(prompt, capitulo_num, resumen_previas, tipo_libro, idioma,
         # Prompt mejorado para evitar secciones
         mensaje = (
             f"{caracteristicas}\n\n"
-            f"Escribe el capítulo {capitulo_num} de un libro de tipo '{tipo_libro}' en **{idioma}** sobre el siguiente tema: {prompt}. "
+            f"Escribe el capítulo {capitulo_num} de un libro de tipo '{tipo_libro}' en **{idioma}** sobre el siguiente tema: {prompt}.{resumen_texto} "
             f"El capítulo debe seguir el formato exacto a continuación y ser **aproximadamente 3000 palabras**.\n\n"
             f"**Título:** [Título del Capítulo]\n\n"
             f"---\n\n"
             f"[Contenido del Capítulo] (Debe ser un texto continuo sin secciones, subcapítulos ni subdivisiones)\n\n"
+            f"---\n\n"
+            f"**Resumen:** [Resumen del capítulo en unas {PALABRAS_RESUMEN} palabras con los puntos clave, "
+            f"los conceptos desarrollados y los ejemplos principales, sin detalles redundantes]\n\n"
             f"{instrucciones}\n\n"
             f"**Por favor, asegúrate de seguir este formato exactamente sin añadir texto adicional ni secciones.**"
         )
+        salida = presupuesto_salida(3000 + PALABRAS_RESUMEN, idioma)
+        # El presupuesto se calcula para el modelo al que el enrutador enviará la petición
+        claves = claves_api(st.secrets)
+        modelo = modelo_enviado("prosa", claves)
+        # Recortar el resumen de los capítulos previos si el prompt no deja sitio para el capítulo
+        mensaje = recortar_bloque(mensaje, resumen_texto, salida, modelo)
+        messages = [
+            {
+                "role": "user",
+                "content": mensaje
+            }
+        ]
+        try:
+            # Presupuesto para ~3000 palabras y el resumen en el idioma del libro, limitado al contexto del modelo
+            max_tokens = ajustar_max_tokens(messages, salida, modelo)
+        except PresupuestoExcedido as e:
+            avisar(f"El prompt del capítulo {capitulo_num} es demasiado largo: {e}")
+            return None, None, None
         data = {
-            "model": "openai/gpt-4o-mini",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": mensaje
-                }
-            ],
+            "messages": messages,
             "temperature": 0.2,  # Reducir la temperatura para mayor coherencia
-            "max_tokens": 4000     # Aumentar el límite de tokens para capítulos más largos
+            "max_tokens": max_tokens
         }
         try:
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            respuesta = response.json()
+            # Si el capítulo se corta por max_tokens se pide una continuación en lugar de repetirlo;
+            # si OpenRouter falla, el enrutador pasa a un modelo equivalente en Together
+            respuesta = chat_tarea("prosa", data, claves,
+                                   al_recibir=al_recibir, continuar_si_truncado=True)
             if 'choices' in respuesta and len(respuesta['choices']) > 0:
                 contenido_completo = respuesta['choices'][0]['message']['content']
                 
@@ -226,32 +279,34 @@ def generar_capitulo(prompt, capitulo_num, resumen_previas, tipo_libro, idioma,
                     else:
                         # Intentar extraer contenido después de los guiones
                         contenido = contenido_completo.split('\n\n---\n\n', 1)[-1].strip()
+                    contenido, resumen = separar_resumen(contenido)
                     
                     # Limpiar el contenido para eliminar secciones
                     contenido = eliminar_secciones(contenido)
+                    if resumen:
+                        resumen = eliminar_secciones(resumen)
                     
-                    return titulo_capitulo, contenido
+                    return titulo_capitulo, contenido, resumen
                 else:
-                    st.warning(f"No se pudo extraer el título del Capítulo {capitulo_num} en el intento {intento + 1}.")
-                    # Mostrar la respuesta completa para depuración
-                    st.text_area(f"Respuesta de la API para el Capítulo {capitulo_num} en el intento {intento + 1}:", contenido_completo, height=300)
+                    avisar(f"No se pudo extraer el título del Capítulo {capitulo_num} en el intento {intento + 1}.", "warning")
+                    # Mostrar el comienzo de la respuesta para depuración
+                    avisar(f"Respuesta de la API para el Capítulo {capitulo_num} en el intento {intento + 1}: {contenido_completo[:500]}", "info")
             else:
-                st.error(f"Respuesta inesperada de la API al generar el capítulo {capitulo_num} en el intento {intento + 1}.")
+                avisar(f"Respuesta inesperada de la API al generar el capítulo {capitulo_num} en el intento {intento + 1}.")
+        except PresupuestoExcedido as e:
+            avisar(f"El prompt del capítulo {capitulo_num} es demasiado largo para los modelos disponibles: {e}")
+            return None, None, None
         except requests.exceptions.RequestException as e:
-            st.error(f"Error al generar el capítulo {capitulo_num} en el intento {intento + 1}: {e}")
+            avisar(f"Error al generar el capítulo {capitulo_num} en el intento {intento + 1}: {e}")
         
         # Esperar antes de reintentar
         time.sleep(2)
     
-    st.error(f"No se pudo generar el Capítulo {capitulo_num} después de {intentos} intentos.")
-    return None, None
+    avisar(f"No se pudo generar el Capítulo {capitulo_num} después de {intentos} intentos.")
+    return None, None, None
 
 def resumir_capitulo(capitulo, tipo_libro, idioma):
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}"
-    }
+    """Resume un capítulo con una llamada aparte; solo se usa si el capítulo llegó sin resumen."""
     caracteristicas = CARACTERISTICAS_LIBRO.get(tipo_libro, "")
     prompt_resumen = (
         f"{caracteristicas}\n\n"
@@ -261,7 +316,6 @@ def resumir_capitulo(capitulo, tipo_libro, idioma):
         f"Capítulo:\n{capitulo}\n\nResumen:"
     )
     data = {
-        "model": "openai/gpt-4o-mini",
         "messages": [
             {
                 "role": "user",
@@ -272,9 +326,7 @@ def resumir_capitulo(capitulo, tipo_libro, idioma):
         "max_tokens": 1500     # Ajustar el límite de tokens según la necesidad
     }
     try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        respuesta = response.json()
+        respuesta = chat_tarea("resumen", data, claves_api(st.secrets))
         if 'choices' in respuesta and len(respuesta['choices']) > 0:
             resumen = respuesta['choices'][0]['message']['content']
             resumen = ' '.join(resumen.split())
@@ -282,21 +334,141 @@ def resumir_capitulo(capitulo, tipo_libro, idioma):
             resumen = eliminar_secciones(resumen)
             return resumen
         else:
-            st.error("Respuesta inesperada de la API al resumir el capítulo.")
+            avisar("Respuesta inesperada de la API al resumir el capítulo.")
             return None
     except requests.exceptions.RequestException as e:
-        st.error(f"Error al resumir el capítulo: {e}")
+        avisar(f"Error al resumir el capítulo: {e}")
         return None
 
-def crear_documento(capitulo_list, titulo, tipo_libro, idioma):
-    doc = Document()
+def fundir_resumenes(piezas, tipo_libro, idioma):
+    """Resume en un solo digesto los resúmenes de varios capítulos (o digestos) consecutivos."""
+    prompt_digesto = (
+        f"Condensa en **{idioma}** los siguientes resúmenes de capítulos consecutivos de un libro de tipo '{tipo_libro}' "
+        f"en un único resumen de como máximo {PALABRAS_DIGESTO} palabras. "
+        "Conserva, aunque sea en pocas palabras, todos los conceptos, ideas, ejemplos y temas ya tratados, "
+        "porque el resumen sirve para no repetirlos en los capítulos siguientes; elimina solo los detalles redundantes.\n\n"
+        f"Resúmenes:\n{contexto_libro(piezas)}\n\nResumen:"
+    )
+    data = {
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt_digesto
+            }
+        ],
+        "temperature": 0.2,
+        "max_tokens": presupuesto_salida(PALABRAS_DIGESTO, idioma)
+    }
+    try:
+        respuesta = chat_tarea("resumen", data, claves_api(st.secrets))
+        if 'choices' in respuesta and len(respuesta['choices']) > 0:
+            return eliminar_secciones(' '.join(respuesta['choices'][0]['message']['content'].split()))
+        avisar("Respuesta inesperada de la API al fundir los resúmenes.")
+        return None
+    except requests.exceptions.RequestException as e:
+        avisar(f"Error al fundir los resúmenes: {e}")
+        return None
+
+def compactar_resumenes(id, tipo_libro, idioma):
+    """Funde los resúmenes antiguos del libro `id` en digestos hasta que el contexto queda dentro del presupuesto."""
+    compactar(obtener_almacen_libros(), id, lambda piezas: fundir_resumenes(piezas, tipo_libro, idioma))
+
+def generar_libro(trabajo, id, num_capitulos, streaming=False):
+    """
+    Genera `num_capitulos` capítulos nuevos del libro `id` como trabajo en segundo plano (trabajos.py).
+
+    Para continuar el libro solo se leen sus metadatos y el contexto de los
+    capítulos anteriores (digestos y resúmenes recientes). Cada capítulo se añade
+    al almacén de libros en cuanto se termina, de modo que la sesión lo recupera
+    al recargarse aunque el trabajo siga en curso. Los resúmenes antiguos se
+    funden en digestos en segundo plano mientras se escribe el capítulo siguiente.
+
+    Cada capítulo se añade también al documento Word parcial del libro, que se
+    puede descargar durante la generación; al terminar, ese documento se publica
+    como la exportación final para no reconstruirlo.
+    """
+    almacen = obtener_almacen_libros()
+    libro = almacen.obtener(id)
+    documento = documento_incremental(DOCUMENTO_PARCIAL, id)
+
+    def iniciar(doc):
+        iniciar_documento(doc, libro['titulo_obra'], libro['tipo_libro'], libro['idioma'])
+
+    # Si el documento parcial se perdió (o es de una versión anterior), se completa con los capítulos guardados
+    exportados = documento.partes()
+    if exportados > libro['capitulos']:
+        documento.eliminar()
+        exportados = 0
+    for numero, (titulo_capitulo, capitulo) in enumerate(almacen.capitulos(id, desde=exportados), exportados + 1):
+        documento.agregar(lambda doc: escribir_capitulo(doc, numero, titulo_capitulo, capitulo), iniciar)
+    inicio = libro['capitulos'] + 1
+    fin = min(inicio + num_capitulos - 1, 24)
+    cap_generadas_en_ejecucion = 0
+    compactacion = None
+    trabajo.progreso(0, num_capitulos)
+
+    with plazo_trabajo(PLAZO_POR_CAPITULO * num_capitulos), trabajo_telemetria("libro") as telemetria, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) as compactador:
+        for i in range(inicio, fin + 1):
+            trabajo.comprobar_cancelacion()
+            trabajo.progreso(texto=f"Generando Capítulo {i}...")
+            # Si el digesto aún no está listo, el capítulo usa los resúmenes completos
+            resumen_previas = contexto_libro(piezas_contexto(almacen, id))
+            titulo_capitulo, capitulo, resumen = generar_capitulo(
+                libro['prompt'],
+                i,
+                resumen_previas,
+                libro['tipo_libro'],
+                libro['idioma'],  # Pasar el idioma seleccionado
+                al_recibir=trabajo.actualizar_vista_previa if streaming else None
+            )
+            trabajo.actualizar_vista_previa(None)
+            if capitulo:
+                if not resumen:
+                    # El modelo no incluyó el resumen: se pide aparte (reenviando el capítulo)
+                    resumen = resumir_capitulo(capitulo, libro['tipo_libro'], libro['idioma'])  # Pasar el idioma seleccionado
+                if not resumen:
+                    avisar(f"No se pudo generar un resumen para el Capítulo {i}.", "warning")
+                almacen.agregar_capitulo(id, i, titulo_capitulo, capitulo, resumen)
+                documento.agregar(lambda doc: escribir_capitulo(doc, i, titulo_capitulo, capitulo), iniciar)
+                cap_generadas_en_ejecucion += 1
+                if compactacion is None or compactacion.done():
+                    compactacion = compactador.submit(
+                        contextvars.copy_context().run, compactar_resumenes, id, libro['tipo_libro'], libro['idioma']
+                    )
+            else:
+                avisar("La generación del libro se ha detenido debido a un error.")
+                break
+            trabajo.progreso(cap_generadas_en_ejecucion)
+
+    if cap_generadas_en_ejecucion == num_capitulos:
+        # El documento parcial ya es el libro completo: se sirve como exportación final sin reconstruirlo
+        documento.publicar("libro_docx", almacen.capitulos(id), libro['titulo_obra'], libro['tipo_libro'], libro['idioma'])
+    documento.cerrar()
+
+    return {
+        'generados': cap_generadas_en_ejecucion,
+        'solicitados': num_capitulos,
+        'telemetria': telemetria.resumen(),
+    }
+
+def iniciar_documento(doc, titulo, tipo_libro, idioma):
+    """Escribe el título y los metadatos al principio del documento Word del libro."""
     doc.add_heading(titulo, 0)
     doc.add_paragraph(f"Tipo de Libro: {tipo_libro}")
     doc.add_paragraph(f"Idioma: {idioma}")  # Agregar el idioma como metadato
     doc.add_paragraph()
+
+def escribir_capitulo(doc, numero, titulo_capitulo, capitulo):
+    """Añade un capítulo al documento Word del libro."""
+    doc.add_heading(f"Capítulo {numero}: {titulo_capitulo}", level=1)
+    doc.add_paragraph(capitulo)
+
+def crear_documento(capitulo_list, titulo, tipo_libro, idioma):
+    doc = Document()
+    iniciar_documento(doc, titulo, tipo_libro, idioma)
     for idx, (titulo_capitulo, capitulo) in enumerate(capitulo_list, 1):
-        doc.add_heading(f"Capítulo {idx}: {titulo_capitulo}", level=1)
-        doc.add_paragraph(capitulo)
+        escribir_capitulo(doc, idx, titulo_capitulo, capitulo)
     buffer = BytesIO()
     doc.save(buffer)
     buffer.seek(0)
@@ -305,6 +477,33 @@ def crear_documento(capitulo_list, titulo, tipo_libro, idioma):
 # Interfaz de usuario para seleccionar opciones
 st.sidebar.title("Opciones")
 
+modo_streaming = st.sidebar.checkbox(
+    "Mostrar el texto mientras se genera",
+    value=False,
+    help="Recibe cada capítulo en streaming y lo muestra a medida que llega."
+)
+
+def mostrar_descarga_parcial():
+    """Ofrece el documento Word con los capítulos terminados hasta el momento, si los hay."""
+    parcial = documento_incremental(DOCUMENTO_PARCIAL, st.session_state.libro).contenido() if st.session_state.get('libro') else None
+    if parcial:
+        st.download_button(
+            label="Descargar los capítulos generados hasta ahora",
+            data=parcial,
+            file_name="libro_parcial.docx",
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        )
+
+def olvidar_trabajo():
+    """Deja de mostrar el último trabajo de generación al cambiar de opción."""
+    st.session_state.trabajo_libro = None
+    st.query_params.pop("trabajo", None)
+
+# Trabajo de generación de esta sesión (o el indicado en la URL tras recargar la página)
+trabajo_libro = obtener_gestor().obtener(st.session_state.get('trabajo_libro') or st.query_params.get("trabajo"))
+if trabajo_libro is not None:
+    st.session_state.trabajo_libro = trabajo_libro.id
+
 # Determinar las opciones disponibles en la barra lateral
 opciones_disponibles = []
 if estado_cargado and len(st.session_state.capitulos) < 24:
@@ -312,12 +511,18 @@ if estado_cargado and len(st.session_state.capitulos) < 24:
 else:
     opciones_disponibles = ["Iniciar Nueva Generación"]
 
-# Radio buttons sin necesidad de botón de envío
-opcion = st.sidebar.radio("¿Qué deseas hacer?", opciones_disponibles)
+# Mientras hay una generación en curso no se ofrece reiniciar el estado ni lanzar otra
+if trabajo_libro is not None and trabajo_libro.activo():
+    st.sidebar.info("Hay una generación en curso.")
+    opcion = None
+else:
+    # Radio buttons sin necesidad de botón de envío
+    opcion = st.sidebar.radio("¿Qué deseas hacer?", opciones_disponibles, on_change=olvidar_trabajo)
 
+# Elegir "Iniciar Nueva Generación" solo muestra el formulario: el libro actual (y el resultado de un
+# trabajo terminado) se conserva hasta que se envía el formulario de un libro nuevo
 mostrar_formulario = False
 if opcion == "Iniciar Nueva Generación":
-    limpiar_estado()
     mostrar_formulario = True
 elif opcion == "Continuar Generando":
     if len(st.session_state.capitulos) >= 24:
@@ -328,15 +533,15 @@ elif opcion == "Continuar Generando":
 if mostrar_formulario:
     with st.form(key='form_libro'):
         if opcion == "Iniciar Nueva Generación":
-            st.session_state.tipo_libro = st.selectbox(
+            tipo_libro = st.selectbox(
                 "Selecciona el tipo de libro que deseas generar:",
                 options=list(CARACTERISTICAS_LIBRO.keys())
             )
-            st.session_state.idioma = st.selectbox(
+            idioma = st.selectbox(
                 "Selecciona el idioma del libro:",
                 options=["Español", "Inglés"]
             )
-            st.session_state.prompt = st.text_area(
+            prompt = st.text_area(
                 "Ingresa la idea o tema para el libro:",
                 height=200,
                 value=""
@@ -361,7 +566,7 @@ if mostrar_formulario:
                 disabled=True
             )
         
-        cap_generadas = len(st.session_state.capitulos)
+        cap_generadas = len(st.session_state.capitulos) if opcion == "Continuar Generando" else 0
         cap_restantes = 24 - cap_generadas
         num_capitulos = st.slider(
             "Número de capítulos a generar:",
@@ -373,70 +578,81 @@ if mostrar_formulario:
     
     if submit_button:
         if opcion == "Iniciar Nueva Generación":
-            if not st.session_state.prompt.strip():
+            if not prompt.strip():
                 st.error("Por favor, ingresa una idea o tema válida para el libro.")
                 st.stop()
         else:
             pass
         
         st.success("Iniciando la generación del libro...")
+        if opcion == "Iniciar Nueva Generación":
+            # Solo ahora se descarta el libro anterior
+            limpiar_estado()
+            st.session_state.tipo_libro = tipo_libro
+            st.session_state.idioma = idioma
+            st.session_state.prompt = prompt
+            # Cada libro nuevo tiene su propio identificador: otras sesiones no lo sobrescriben
+            st.session_state.libro = id_libro()
+            obtener_almacen_libros().crear(
+                st.session_state.libro,
+                st.session_state.prompt,
+                st.session_state.tipo_libro,
+                st.session_state.idioma,
+                st.session_state.titulo_obra
+            )
+        st.query_params["libro"] = st.session_state.libro
         st.session_state.proceso_generado = True
-        progreso = st.progress(0)
-        
-        inicio = len(st.session_state.capitulos) + 1
-        fin = inicio + num_capitulos - 1
-        if fin > 24:
-            fin = 24
-        cap_generadas_en_ejecucion = 0
-        
-        for i in range(inicio, fin + 1):
-            st.write(f"Generando **Capítulo {i}**...")
-            if st.session_state.resumenes:
-                resumen_previas = ' '.join(st.session_state.resumenes)
-            else:
-                resumen_previas = ''
-            titulo_capitulo, capitulo = generar_capitulo(
-                st.session_state.prompt, 
-                i, 
-                resumen_previas,
+        obtener_almacen_libros().actualizar(st.session_state.libro, proceso_generado=True)
+        # La generación se ejecuta en segundo plano y continúa aunque la página se recargue o se cierre
+        trabajo_libro = obtener_gestor().enviar(
+            "libro", generar_libro, st.session_state.libro, num_capitulos, modo_streaming
+        )
+        st.session_state.trabajo_libro = trabajo_libro.id
+        st.query_params["trabajo"] = trabajo_libro.id
+
+# Progreso y resultado de la generación en segundo plano
+if trabajo_libro is not None:
+    mostrar_trabajo(trabajo_libro)
+    if trabajo_libro.activo():
+        mostrar_descarga_parcial()
+    sondear(trabajo_libro)
+    estadisticas_http = obtener_cliente().estadisticas()
+    st.caption(
+        f"Conexiones HTTP: {estadisticas_http['conexiones_nuevas']} nuevas, "
+        f"{estadisticas_http['conexiones_reutilizadas']} reutilizadas "
+        f"en {estadisticas_http['peticiones']} peticiones."
+    )
+    resultado = trabajo_libro.resultado
+    if resultado:
+        st.caption(f"Telemetría de la generación: {formatear_resumen(resultado['telemetria'])}")
+
+    if trabajo_libro.estado == COMPLETADO and resultado['generados'] == resultado['solicitados']:
+        st.success(f"Se han generado {resultado['generados']} capítulos exitosamente.")
+        # Recoger los capítulos que el trabajo añadió después de cargar el estado en esta ejecución del script
+        cargar_estado()
+        titulo_obra = st.text_input("Título del libro:", value=st.session_state.titulo_obra)
+        if titulo_obra != st.session_state.titulo_obra and st.session_state.get('libro'):
+            obtener_almacen_libros().actualizar(st.session_state.libro, titulo_obra=titulo_obra)
+        st.session_state.titulo_obra = titulo_obra
+        if st.session_state.titulo_obra:
+            # El documento se guarda por contenido y solo se reconstruye si cambian los capítulos o los ajustes
+            opciones_documento = (
+                st.session_state.capitulos,
+                st.session_state.titulo_obra,
                 st.session_state.tipo_libro,
                 st.session_state.idioma  # Pasar el idioma seleccionado
             )
-            if capitulo:
-                st.session_state.capitulos.append((titulo_capitulo, capitulo))
-                resumen = resumir_capitulo(capitulo, st.session_state.tipo_libro, st.session_state.idioma)  # Pasar el idioma seleccionado
-                if resumen:
-                    st.session_state.resumenes.append(resumen)
-                else:
-                    st.warning(f"No se pudo generar un resumen para el Capítulo {i}.")
-                guardar_estado()
-                cap_generadas_en_ejecucion += 1
-            else:
-                st.error("La generación del libro se ha detenido debido a un error.")
-                break
-            progreso.progress(cap_generadas_en_ejecucion / num_capitulos)
-            time.sleep(2)
-        
-        progreso.empty()
-        
-        if cap_generadas_en_ejecucion == num_capitulos:
-            st.success(f"Se han generado {cap_generadas_en_ejecucion} capítulos exitosamente.")
-            st.session_state.titulo_obra = st.text_input("Título del libro:", value=st.session_state.titulo_obra)
-            if st.session_state.titulo_obra:
-                documento = crear_documento(
-                    st.session_state.capitulos, 
-                    st.session_state.titulo_obra, 
-                    st.session_state.tipo_libro,
-                    st.session_state.idioma  # Pasar el idioma seleccionado
-                )
-                st.download_button(
-                    label="Descargar Libro en Word",
-                    data=documento,
-                    file_name="libro.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                )
-        else:
-            st.info(f"Generación interrumpida. Has generado {cap_generadas_en_ejecucion} de {num_capitulos} capítulos.")
+            documento = artefacto("libro_docx", lambda: crear_documento(*opciones_documento), *opciones_documento)
+            st.download_button(
+                label="Descargar Libro en Word",
+                data=documento,
+                file_name="libro.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+            )
+    else:
+        generados = resultado['generados'] if resultado else 0
+        st.info(f"Generación interrumpida. Has generado {generados} de {trabajo_libro.total or generados} capítulos.")
+        mostrar_descarga_parcial()
 
 # Mostrar el libro generado
 if st.session_state.capitulos and st.session_state.proceso_generado:
@@ -0,0 +1,170 @@
+"""
+Limitador de tasa adaptativo (token bucket) por proveedor y modelo.
+
+Sustituye las pausas fijas entre llamadas (`time.sleep`) por un cubo de
+tokens que se frena cuando el proveedor responde 429/503 (respetando
+`Retry-After` y las cabeceras de límite de tasa) y vuelve a acelerar
+mientras las respuestas son correctas.
+
+Configuración mediante variables de entorno:
+    LLM_TASA_<PROVEEDOR>  Peticiones por segundo máximas (p. ej. LLM_TASA_OPENROUTER=5).
+"""
+
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# Peticiones por segundo máximas por defecto para cada proveedor
+TASAS_POR_DEFECTO = {
+    "openrouter": 5.0,
+    "together": 3.0,
+}
+TASA_MINIMA = 0.05
+ESTADOS_LIMITADOS = (429, 503)
+
+
+# Rutas de la API de cada proveedor, para distinguirlos cuando comparten host (p. ej. el servidor simulado)
+RUTAS_PROVEEDORES = (
+    ("/api/v1/", "openrouter"),
+    ("/v1/", "together"),
+)
+
+
+def proveedor_de_url(url):
+    """
+    Deduce el nombre del proveedor a partir de la URL.
+
+    Se usa el host de los proveedores reales; si no, la base configurada
+    (`LLM_OPENROUTER_BASE`, `LLM_TOGETHER_BASE`) cuando solo coincide una, y si
+    ambas apuntan al mismo servidor, la ruta de la API.
+    """
+    partes = urlparse(url)
+    host = partes.hostname or ""
+    if "openrouter" in host:
+        return "openrouter"
+    if "together" in host:
+        return "together"
+    bases = {
+        "openrouter": os.environ.get("LLM_OPENROUTER_BASE", "").rstrip("/"),
+        "together": os.environ.get("LLM_TOGETHER_BASE", "").rstrip("/"),
+    }
+    coincidentes = [proveedor for proveedor, base in bases.items() if base and url.startswith(base + "/")]
+    if len(coincidentes) == 1:
+        return coincidentes[0]
+    for ruta, proveedor in RUTAS_PROVEEDORES:
+        if partes.path.startswith(ruta):
+            return proveedor
+    return host or "desconocido"
+
+
+def _segundos_hasta(valor):
+    """Interpreta `Retry-After` o un reset de límite como segundos de espera."""
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    try:
+        if valor.endswith("ms"):
+            return max(0.0, float(valor[:-2]) / 1000)
+        if valor.endswith("s"):
+            return max(0.0, float(valor[:-1]))
+        segundos = float(valor)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    # Algunos proveedores envían el reset como marca de tiempo absoluta (s o ms)
+    if segundos > 1e12:
+        return max(0.0, segundos / 1000 - time.time())
+    if segundos > 1e9:
+        return max(0.0, segundos - time.time())
+    return max(0.0, segundos)
+
+
+class LimitadorAdaptativo:
+    """
+    Cubo de tokens con ajuste AIMD de la tasa según las respuestas del proveedor.
+
+    Parámetros:
+        tasa_maxima (float): Peticiones por segundo cuando el proveedor está sano.
+        capacidad (int): Ráfaga máxima de peticiones sin espera.
+    """
+
+    def __init__(self, tasa_maxima, capacidad=None):
+        self.tasa_maxima = tasa_maxima
+        self.tasa = tasa_maxima
+        self.capacidad = capacidad or max(1, int(tasa_maxima))
+        self.tokens = float(self.capacidad)
+        self.pausa_hasta = 0.0
+        self.limitadas = 0
+        self._ultima_recarga = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _recargar(self, ahora):
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self._ultima_recarga) * self.tasa)
+        self._ultima_recarga = ahora
+
+    def adquirir(self):
+        """Bloquea hasta que haya un token disponible y lo consume."""
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._recargar(ahora)
+                espera = self.pausa_hasta - ahora
+                if espera <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    espera = (1 - self.tokens) / self.tasa
+            time.sleep(espera)
+
+    def registrar_respuesta(self, estado, cabeceras=None):
+        """
+        Ajusta la tasa según el código de estado y las cabeceras de la respuesta.
+
+        Ante 429/503 reduce la tasa a la mitad y pausa según `Retry-After`;
+        ante una respuesta correcta la aumenta gradualmente hasta la máxima.
+        """
+        cabeceras = cabeceras or {}
+        with self._lock:
+            ahora = time.monotonic()
+            if estado in ESTADOS_LIMITADOS:
+                self.limitadas += 1
+                self.tasa = max(TASA_MINIMA, self.tasa / 2)
+                self.tokens = 0.0
+                espera = _segundos_hasta(cabeceras.get("Retry-After"))
+                if espera is None:
+                    espera = 1.0 / self.tasa
+                self.pausa_hasta = max(self.pausa_hasta, ahora + espera)
+                return
+            if estado is not None and estado < 400:
+                self.tasa = min(self.tasa_maxima, self.tasa + self.tasa_maxima * 0.1)
+            restantes = cabeceras.get("x-ratelimit-remaining-requests", cabeceras.get("x-ratelimit-remaining"))
+            if restantes is not None and str(restantes).strip() in ("0", "0.0"):
+                reinicio = cabeceras.get("x-ratelimit-reset-requests", cabeceras.get("x-ratelimit-reset"))
+                espera = _segundos_hasta(reinicio)
+                if espera:
+                    self.pausa_hasta = max(self.pausa_hasta, ahora + espera)
+
+    def estadisticas(self):
+        with self._lock:
+            return {"tasa": self.tasa, "tasa_maxima": self.tasa_maxima, "limitadas": self.limitadas}
+
+
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+
+
+def obtener_limitador(proveedor, modelo=None):
+    """Devuelve el limitador compartido para el par (proveedor, modelo)."""
+    clave = (proveedor, modelo)
+    with _limitadores_lock:
+        if clave not in _limitadores:
+            try:
+                tasa = float(os.environ.get(f"LLM_TASA_{proveedor.upper()}", TASAS_POR_DEFECTO.get(proveedor, 2.0)))
+            except ValueError:
+                tasa = TASAS_POR_DEFECTO.get(proveedor, 2.0)
+            _limitadores[clave] = LimitadorAdaptativo(tasa)
+        return _limitadores[clave]
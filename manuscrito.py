@@ -0,0 +1,207 @@
+"""
+Modelo en memoria de un manuscrito: capítulos y escenas con recuento de palabras.
+
+La generación añade escenas al manuscrito a medida que se escriben (también
+fuera de orden: cada escena ocupa su lugar por número) y los exportadores
+recorren capítulos y escenas directamente, sin volver a partir un texto
+concatenado por sus encabezados. El recuento de palabras se mantiene de forma
+incremental: cada escena cuenta sus palabras una sola vez y los totales del
+capítulo y del manuscrito se ajustan al añadir o reemplazar escenas.
+
+`Manuscrito.desde_texto` convierte en manuscrito un texto con encabezados
+"Capítulo N" / "Escena N" (por ejemplo, una novela subida por el usuario).
+"""
+
+import bisect
+import re
+
+# Encabezados reconocidos al inicio de una línea, con o sin marcas de Markdown
+PATRON_CAPITULO = re.compile(r"^[ \t]*(?:#+[ \t]*)?((?:Cap[ií]tulo|Chapter)[ \t]+(\d+)\b[^\n]*)", re.IGNORECASE | re.MULTILINE)
+PATRON_ESCENA = re.compile(r"^[ \t]*(?:#+[ \t]*)?((?:Escena|Scene)[ \t]+(\d+)\b[^\n]*)", re.IGNORECASE | re.MULTILINE)
+
+
+class Escena:
+    """
+    Escena de un capítulo.
+
+    Parámetros:
+        numero (int): Número de la escena dentro del capítulo (None si no lo tiene).
+        texto (str): Texto de la escena.
+        titulo (str): Encabezado de la escena ("Escena 3"); None para no mostrar ninguno.
+    """
+
+    __slots__ = ("numero", "titulo", "texto", "palabras")
+
+    def __init__(self, numero, texto, titulo=None):
+        self.numero = numero
+        self.titulo = titulo
+        self.texto = texto
+        self.palabras = len(texto.split())
+
+
+class Capitulo:
+    """
+    Capítulo del manuscrito, con sus escenas ordenadas por número.
+
+    Parámetros:
+        numero (int): Número del capítulo (None si no lo tiene).
+        titulo (str): Encabezado del capítulo ("Capítulo 3"); None para no mostrar ninguno.
+    """
+
+    __slots__ = ("numero", "titulo", "escenas", "palabras")
+
+    def __init__(self, numero=None, titulo=None):
+        self.numero = numero
+        self.titulo = titulo
+        self.escenas = []
+        self.palabras = 0
+
+    def escena(self, numero):
+        """Devuelve la escena `numero` o None si no existe."""
+        for escena in self.escenas:
+            if escena.numero == numero:
+                return escena
+        return None
+
+    def texto(self, marcas=False):
+        """Texto del capítulo con su encabezado (con `marcas`, en formato Markdown)."""
+        return _unir(self._partes(marcas))
+
+    def _partes(self, marcas):
+        if self.titulo:
+            yield f"## {self.titulo}" if marcas else self.titulo
+        for escena in self.escenas:
+            if escena.titulo:
+                yield f"### {escena.titulo}" if marcas else escena.titulo
+            yield escena.texto
+
+
+class Manuscrito:
+    """
+    Manuscrito completo: título y capítulos.
+
+    Parámetros:
+        titulo (str): Título de la obra.
+    """
+
+    __slots__ = ("titulo", "capitulos", "palabras")
+
+    def __init__(self, titulo=""):
+        self.titulo = titulo
+        self.capitulos = []
+        self.palabras = 0
+
+    def __len__(self):
+        return sum(len(capitulo.escenas) for capitulo in self.capitulos)
+
+    def agregar_capitulo(self, titulo=None, numero=None):
+        """Añade un capítulo al final y lo devuelve."""
+        capitulo = Capitulo(numero, titulo)
+        self.capitulos.append(capitulo)
+        return capitulo
+
+    def agregar_escena(self, capitulo, texto, titulo=None, numero=None):
+        """Añade una escena al final de `capitulo` (un `Capitulo` del manuscrito) y la devuelve."""
+        escena = Escena(numero, texto, titulo)
+        capitulo.escenas.append(escena)
+        capitulo.palabras += escena.palabras
+        self.palabras += escena.palabras
+        return escena
+
+    def capitulo(self, numero):
+        """Devuelve el capítulo `numero` o None si no existe."""
+        for capitulo in self.capitulos:
+            if capitulo.numero == numero:
+                return capitulo
+        return None
+
+    def escena(self, capitulo, escena):
+        """Devuelve la escena `escena` del capítulo `capitulo` o None si no existe."""
+        encontrado = self.capitulo(capitulo)
+        return encontrado.escena(escena) if encontrado else None
+
+    def poner_escena(self, capitulo, escena, texto):
+        """
+        Coloca el texto de la escena `escena` del capítulo `capitulo` en su lugar.
+
+        Crea el capítulo si hace falta y reemplaza la escena si ya existía, de
+        modo que las escenas pueden llegar en cualquier orden.
+
+        Retorna:
+            Escena: La escena colocada.
+        """
+        encontrado = self.capitulo(capitulo)
+        if encontrado is None:
+            encontrado = Capitulo(capitulo, f"Capítulo {capitulo}")
+            posicion = bisect.bisect([c.numero for c in self.capitulos], capitulo)
+            self.capitulos.insert(posicion, encontrado)
+        numeros = [e.numero for e in encontrado.escenas]
+        posicion = bisect.bisect_left(numeros, escena)
+        if posicion < len(numeros) and numeros[posicion] == escena:
+            return self.reemplazar(encontrado, encontrado.escenas[posicion], texto)
+        nueva = Escena(escena, texto, f"Escena {escena}")
+        encontrado.escenas.insert(posicion, nueva)
+        encontrado.palabras += nueva.palabras
+        self.palabras += nueva.palabras
+        return nueva
+
+    def reemplazar(self, capitulo, escena, texto):
+        """Reemplaza el texto de `escena` (del `Capitulo` `capitulo`) ajustando los recuentos, y la devuelve."""
+        palabras = len(texto.split())
+        capitulo.palabras += palabras - escena.palabras
+        self.palabras += palabras - escena.palabras
+        escena.texto = texto
+        escena.palabras = palabras
+        return escena
+
+    def escenas(self):
+        """Recorre las escenas en orden como pares (capítulo, escena)."""
+        for capitulo in self.capitulos:
+            for escena in capitulo.escenas:
+                yield capitulo, escena
+
+    def texto(self, marcas=True):
+        """
+        Texto completo del manuscrito, con los encabezados en Markdown si `marcas`
+        ("**Título**", "## Capítulo N", "### Escena N") o como líneas simples si no.
+        """
+        def partes():
+            if self.titulo:
+                yield f"**{self.titulo}**" if marcas else self.titulo
+            for capitulo in self.capitulos:
+                yield from capitulo._partes(marcas)
+        return _unir(partes())
+
+    @classmethod
+    def desde_texto(cls, texto, titulo=""):
+        """
+        Construye un manuscrito a partir de un texto con encabezados de capítulo y escena.
+
+        Los encabezados se reconocen al inicio de una línea ("Capítulo 3: El
+        regreso", "## Escena 2"...) y la línea completa forma el título. El
+        texto anterior al primer encabezado se descarta. Las escenas sin
+        capítulo van a un capítulo sin encabezado, y el texto de un capítulo
+        anterior a su primera escena se guarda como una escena sin encabezado.
+        """
+        manuscrito = cls(titulo)
+        marcas = sorted(
+            [(m.start(), m.end(), m.group(1), int(m.group(2)), True) for m in PATRON_CAPITULO.finditer(texto)]
+            + [(m.start(), m.end(), m.group(1), int(m.group(2)), False) for m in PATRON_ESCENA.finditer(texto)]
+        )
+        capitulo = None
+        for i, (_, fin, encabezado, numero, es_capitulo) in enumerate(marcas):
+            siguiente = marcas[i + 1][0] if i + 1 < len(marcas) else len(texto)
+            contenido = texto[fin:siguiente].strip()
+            if es_capitulo:
+                capitulo = manuscrito.agregar_capitulo(encabezado.strip(), numero)
+                if contenido:
+                    manuscrito.agregar_escena(capitulo, contenido)
+                continue
+            if capitulo is None:
+                capitulo = manuscrito.agregar_capitulo()
+            manuscrito.agregar_escena(capitulo, contenido, encabezado.strip(), numero)
+        return manuscrito
+
+
+def _unir(partes):
+    return "\n\n".join(parte for parte in partes if parte)
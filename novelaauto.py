@@ -1,13 +1,17 @@
 import streamlit as st
-import requests
-import json
 from io import BytesIO
 from docx import Document
-import re
+
+from cliente_llm import OPENROUTER_URL, post_limitado
+from salida_json import TEXTO, lista, objeto, pedir_json
+
+# Esquema del plan de la novela: capítulos con sus escenas (título y descripción)
+ESQUEMA_PLAN = objeto(capitulos=lista(objeto(escenas=lista(objeto(titulo=TEXTO, descripcion=TEXTO)))))
 
 # Función para llamar a la API de OpenRouter
-def openrouter_api(messages):
-    url = "https://openrouter.ai/api/v1/chat/completions"
+# `formato` es el `response_format` de una respuesta JSON
+def openrouter_api(messages, formato=None, temperature=None):
+    url = OPENROUTER_URL
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}"
@@ -16,24 +20,43 @@ def openrouter_api(messages):
         "model": "openai/gpt-4o-mini",
         "messages": messages
     }
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    if formato:
+        data["response_format"] = formato
+    if temperature is not None:
+        data["temperature"] = temperature
+    response = post_limitado(url, headers, data)
     return response.json()
 
-# Función para parsear el plan de la novela
-def parse_plan(plan_text):
-    plan = []
-    chapters = re.split(r'Capítulo \d+:', plan_text)
-    for chapter_text in chapters[1:]:
-        chapter = []
-        sections = re.split(r'Escena \d+:', chapter_text)
-        for section_text in sections[1:]:
-            lines = section_text.strip().split('\n', 1)
-            if len(lines) >= 2:
-                title = lines[0].strip()
-                description = lines[1].strip()
-                chapter.append({'titulo': title, 'descripcion': description})
-        plan.append(chapter)
-    return plan
+# Función para obtener el texto de una respuesta de la API (None si no lo trae)
+def contenido_respuesta(respuesta):
+    try:
+        return respuesta['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        return None
+
+# Función para pedir el plan de la novela en JSON
+# Si la respuesta no cumple el esquema, se repara una sola vez con temperatura 0
+def generar_plan(prompt):
+    def llamar(texto, formato, temperature=None):
+        return contenido_respuesta(openrouter_api([{"role": "user", "content": texto}], formato, temperature))
+    return pedir_json(llamar, prompt, ESQUEMA_PLAN, "plan_novela",
+                      reparar=lambda texto, formato: llamar(texto, formato, temperature=0))
+
+# Función para parsear el plan de la novela: lista de capítulos con sus escenas
+def parse_plan(plan):
+    return [
+        [{'titulo': escena['titulo'].strip(), 'descripcion': escena['descripcion'].strip()} for escena in capitulo['escenas']]
+        for capitulo in plan['capitulos']
+    ]
+
+# Función para mostrar el plan como texto, indicando 'Capítulo X:' y 'Escena Y:'
+def formatear_plan(plan):
+    lineas = []
+    for capitulo_num, capitulo in enumerate(plan, start=1):
+        lineas.append(f"**Capítulo {capitulo_num}:**")
+        for escena_num, escena in enumerate(capitulo, start=1):
+            lineas.append(f"- Escena {escena_num}: {escena['titulo']} — {escena['descripcion']}")
+    return "\n".join(lineas)
 
 # Título de la aplicación
 st.title("Generador de Novelas Juveniles de Aventuras")
@@ -47,15 +70,15 @@ if tema:
 
     if not st.session_state.plan_generado:
         st.write("Generando el plan de la novela...")
-        messages = [
-            {"role": "user", "content": f"Planea una novela juvenil de aventuras sobre el tema: '{tema}'. Debe tener 10 capítulos y 3 escenas por capítulo. Para cada escena, proporciona un título y una breve descripción de lo que sucede. Organiza la trama y las subtramas de manera coherente a lo largo de las 30 escenas. Formatea el plan claramente indicando 'Capítulo X:' y 'Escena Y:'."}
-        ]
-        respuesta = openrouter_api(messages)
-        plan_texto = respuesta['choices'][0]['message']['content']
-        st.session_state.plan_texto = plan_texto
+        prompt = f"Planea una novela juvenil de aventuras sobre el tema: '{tema}'. Debe tener 10 capítulos y 3 escenas por capítulo. Para cada escena, proporciona un título y una breve descripción de lo que sucede. Organiza la trama y las subtramas de manera coherente a lo largo de las 30 escenas. Responde únicamente con un objeto JSON, sin texto adicional, con este formato: {{\"capitulos\": [{{\"escenas\": [{{\"titulo\": \"...\", \"descripcion\": \"...\"}}]}}]}}."
+        plan = generar_plan(prompt)
+        if not plan:
+            st.error("No se pudo obtener un plan válido. Recarga la página para intentarlo de nuevo.")
+            st.stop()
 
         # Procesar el plan para almacenarlo en una estructura de datos
-        st.session_state.plan = parse_plan(plan_texto)
+        st.session_state.plan = parse_plan(plan)
+        st.session_state.plan_texto = formatear_plan(st.session_state.plan)
 
         st.session_state.plan_generado = True
 
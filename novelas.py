@@ -6,12 +6,48 @@ from docx import Document
 from docx.shared import Inches, Pt
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from io import BytesIO
-import re
-import random
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import concurrent.futures
+import contextvars
 import matplotlib.pyplot as plt
 
+from artefactos import artefacto, documento_incremental
+from cliente_llm import obtener_cliente
+from ejecuciones import COMPLETADA, EN_CURSO, INTERRUMPIDA, id_ejecucion, obtener_almacen
+from enrutador import chat_tarea, claves_api, modelo_enviado
+from manuscrito import Manuscrito
+from plazos import plazo_trabajo
+from presupuesto_palabras import PALABRAS_NOVELA, actualizar_sesgo, redistribuir_palabras, repartir_palabras
+from salida_json import ENTERO, TEXTO, lista, objeto, pedir_json
+from telemetria import formatear_resumen, trabajo_telemetria
+from tokens import PresupuestoExcedido, ajustar_max_tokens, contar_tokens, presupuesto_salida, recortar_bloque, registrar_salida
+from trabajos import COMPLETADO, EN_CURSO as TRABAJO_EN_CURSO, PENDIENTE, TrabajoCancelado, avisar, mostrar_trabajo, obtener_gestor, sondear
+
+# Tiempo máximo de una ejecución completa; cada llamada recibe el tiempo restante como timeout
+PLAZO_NOVELA = 2 * 60 * 60
+# Tiempo máximo para regenerar una sola escena
+PLAZO_ESCENA = 10 * 60
+# Intentos de cada escena antes de darla por fallida (las demás escenas siguen generándose)
+INTENTOS_POR_ESCENA = 3
+# Límites de la memoria de continuidad que sustituye a la estructura completa en cada escena
+PALABRAS_PREMISA = 150
+PALABRAS_SINOPSIS = 300
+MAX_HECHOS_MEMORIA = 30
+# Palabras de las escenas vecinas que recibe una escena regenerada
+PALABRAS_VECINAS = 150
+# Capítulos que se adelantan en segundo plano mientras se revisa la estructura
+CAPITULOS_ESPECULATIVOS = 1
+# Segundos sin actualizarse tras los que se borra una ejecución adelantada que nunca se aprobó
+RETENCION_ESPECULACION = 24 * 60 * 60
+# Tipo del documento de Word que se escribe capítulo a capítulo durante la generación (artefactos.py)
+DOCUMENTO_PARCIAL = "novela_docx_parcial"
+
+# Esquemas de las respuestas JSON (estructura, plan de escenas y memoria de continuidad)
+ESQUEMA_ESTRUCTURA = objeto(titulo=TEXTO, trama=TEXTO, subtramas=TEXTO, personajes=TEXTO, ambientacion=TEXTO, tecnica=TEXTO)
+ESQUEMA_PLAN = objeto(escenas=lista(objeto(capitulo=ENTERO, escena=ENTERO, objetivo=TEXTO, personajes=TEXTO, giro=TEXTO, estado_final=TEXTO)))
+ESQUEMA_HECHOS = lista(objeto(nombre=TEXTO, tipo=TEXTO, dato=TEXTO))
+ESQUEMA_MEMORIA_INICIAL = objeto(premisa=TEXTO, estilo=TEXTO, hechos=ESQUEMA_HECHOS)
+ESQUEMA_MEMORIA = objeto(sinopsis=TEXTO, hechos=ESQUEMA_HECHOS)
+
 # Importaciones adicionales para la tabla de contenidos
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
@@ -64,11 +100,38 @@ porcentaje_trama_principal = st.sidebar.slider(
 porcentaje_subtramas = 100 - porcentaje_trama_principal
 st.sidebar.write(f"Porcentaje de palabras para subtramas: {porcentaje_subtramas}%")
 
+# Escenas que se escriben a la vez a partir del plan de escenas
+escenas_en_paralelo = st.sidebar.slider(
+    "Escenas generadas en paralelo",
+    min_value=1,
+    max_value=8,
+    value=4,
+    help="Número de escenas que se escriben simultáneamente. Con 1 se generan una tras otra."
+)
+
+# Adelantar el plan de escenas y el primer capítulo mientras se revisa la estructura
+modo_especulativo = st.sidebar.checkbox(
+    "Adelantar el primer capítulo durante la revisión",
+    value=False,
+    help="Mientras revisas la estructura se planifican las escenas y se escribe el primer capítulo en segundo plano. "
+         "Si apruebas, se aprovecha; si rechazas, se cancela y se descarta. Su coste se muestra aparte."
+)
+
+# Mostrar el texto de cada escena a medida que se genera
+modo_streaming = st.sidebar.checkbox(
+    "Mostrar el texto mientras se genera",
+    value=False,
+    help="Recibe la respuesta en streaming y muestra cada escena a medida que llega (solo sin paralelismo)."
+)
+
 # Inicializar el estado de la aplicación
 def inicializar_estado():
     default_values = {
         'etapa': 'inicio',
         'estructura': None,
+        'ejecucion': None,
+        'especulacion': None,
+        'especulaciones_descartadas': [],
         'novela_completa': None,
         'titulo': '',
         'trama': '',
@@ -84,15 +147,21 @@ def inicializar_estado():
 inicializar_estado()
 
 # Función para llamar a la API de OpenRouter con reintentos y parámetros ajustables
-def call_openrouter_api(prompt, max_tokens=1800, temperature=0.7, top_p=0.9, top_k=50, repetition_penalty=1.2):
-    api_url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}",
-        "Content-Type": "application/json"
-    }
+# Si se indica `al_recibir`, la respuesta se pide en streaming y la función recibe el texto acumulado
+# Si OpenRouter se degrada, el enrutador pasa a un modelo equivalente en Together
+# `formato` es el `response_format` de una respuesta JSON (ver `pedir_json_api`)
+# `tarea` elige el modelo según su nivel de latencia/coste (ver `enrutador.NIVELES_TAREAS`)
+def call_openrouter_api(prompt, max_tokens=1800, temperature=0.7, top_p=0.9, top_k=50, repetition_penalty=1.2, al_recibir=None, formato=None, tarea="prosa"):
+    messages = [{"role": "user", "content": prompt}]
+    claves = claves_api(st.secrets)
+    # Rechazar o ajustar la petición si no cabe en el contexto del modelo al que se envía
+    try:
+        max_tokens = ajustar_max_tokens(messages, max_tokens, modelo_enviado(tarea, claves))
+    except PresupuestoExcedido as e:
+        avisar(f"El prompt es demasiado largo para el modelo: {e}")
+        return None
     payload = {
-        "model": "openai/gpt-4o-mini",
-        "messages": [{"role": "user", "content": prompt}],
+        "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
         "top_p": top_p,
@@ -101,26 +170,37 @@ def call_openrouter_api(prompt, max_tokens=1800, temperature=0.7, top_p=0.9, top
         "stop": ["[\"<|eot_id|>\"]"],
         "stream": False
     }
-    
-    session = requests.Session()
-    retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
-    session.mount('https://', HTTPAdapter(max_retries=retries))
+    if formato:
+        payload["response_format"] = formato
     
     try:
-        response = session.post(api_url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        response_json = response.json()
+        response_json = chat_tarea(tarea, payload, claves,
+                                   al_recibir=al_recibir, continuar_si_truncado=True)
         if 'choices' in response_json and len(response_json['choices']) > 0:
             return response_json['choices'][0]['message']['content']
         else:
-            st.error("La respuesta de la API no contiene 'choices'.")
-            st.write("Respuesta completa de la API:", response_json)
+            avisar(f"La respuesta de la API no contiene 'choices': {response_json}")
             return None
+    except PresupuestoExcedido as e:
+        avisar(f"El prompt es demasiado largo para los modelos disponibles: {e}")
+        return None
     except requests.exceptions.RequestException as e:
-        st.error(f"Error en la llamada a la API: {e}")
+        avisar(f"Error en la llamada a la API: {e}")
         return None
 
+# Función para pedir una respuesta JSON conforme a `esquema`
+# Si la respuesta no lo cumple, se repara una sola vez con temperatura 0 en lugar de repetir el prompt
+def pedir_json_api(prompt, esquema, nombre, max_tokens=1800, temperature=0.7, tarea="prosa"):
+    return pedir_json(
+        lambda texto, formato: call_openrouter_api(texto, max_tokens=max_tokens, temperature=temperature,
+                                                   formato=formato, tarea=tarea),
+        prompt, esquema, nombre,
+        reparar=lambda texto, formato: call_openrouter_api(texto, max_tokens=max_tokens, temperature=0,
+                                                           formato=formato, tarea=tarea),
+    )
+
 # Función para generar la estructura inicial de la novela con subtramas y técnicas avanzadas
+# Retorna un diccionario con los elementos de la estructura (ver ESQUEMA_ESTRUCTURA) o None
 def generar_estructura(theme):
     prompt = f"""
 Basado en el tema proporcionado, genera una estructura detallada para una novela de suspenso político de alta calidad. Asegúrate de que la novela obtenga una calificación de 10 sobre 10 en los siguientes aspectos:
@@ -136,70 +216,205 @@ Basado en el tema proporcionado, genera una estructura detallada para una novela
     - **Show, Don't Tell**: Enfócate en mostrar acciones y emociones en lugar de simplemente describirlas.
 
 ### Estructura Requerida:
-1. **Título**
-2. **Trama Principal**
-3. **Subtramas** (incluyendo nombres, descripciones detalladas, motivaciones y cómo afectan a los personajes y la trama principal)
-4. **Personajes** (incluyendo nombres, descripciones físicas y psicológicas, motivaciones, y arcos de desarrollo)
-5. **Ambientación** (detallada y relevante para la trama)
-6. **Técnicas Literarias a Utilizar** (como metáforas, simbolismo, foreshadowing, etc.)
+Responde únicamente con un objeto JSON, sin texto adicional, con estos campos (todos de texto):
+- "titulo": Título de la novela.
+- "trama": Trama Principal.
+- "subtramas": Subtramas (incluyendo nombres, descripciones detalladas, motivaciones y cómo afectan a los personajes y la trama principal).
+- "personajes": Personajes (incluyendo nombres, descripciones físicas y psicológicas, motivaciones, y arcos de desarrollo).
+- "ambientacion": Ambientación (detallada y relevante para la trama).
+- "tecnica": Técnicas Literarias a Utilizar (como metáforas, simbolismo, foreshadowing, etc.).
 
 ### Tema:
 {theme}
 
 Asegúrate de que toda la información generada sea coherente y adecuada para un thriller político de alta calidad.
 """
-    estructura = call_openrouter_api(prompt)
-    return estructura
+    return pedir_json_api(prompt, ESQUEMA_ESTRUCTURA, "estructura_novela", tarea="estructura")
 
-# Función para extraer los elementos de la estructura usando expresiones regulares
+# Función para extraer los elementos de la estructura ya validada
 def extraer_elementos(estructura):
     # Mostrar la estructura completa para depuración
     st.write("### Estructura generada por la API:")
     st.write(estructura)
 
-    # Patrón mejorado para extraer los elementos, incluyendo subtramas
-    patrones = {
-        'titulo': r"(?:Título|Titulo):\s*(.*)",
-        'trama': r"Trama Principal:\s*((?:.|\n)*?)\n(?:Subtramas|Subtrama)",
-        'subtramas': r"Subtramas?:\s*((?:.|\n)*?)\n(?:Personajes|Ambientación|Ambientacion|Técnicas literarias|$)",
-        'personajes': r"Personajes:\s*((?:.|\n)*?)\n(?:Ambientación|Ambientacion|Técnicas literarias|$)",
-        'ambientacion': r"Ambientación:\s*((?:.|\n)*?)\n(?:Técnicas literarias|$)",
-        'tecnica': r"Técnicas literarias(?: a utilizar)?:\s*((?:.|\n)*)"
-    }
-
-    titulo = re.search(patrones['titulo'], estructura, re.IGNORECASE)
-    trama = re.search(patrones['trama'], estructura, re.IGNORECASE)
-    subtramas = re.search(patrones['subtramas'], estructura, re.IGNORECASE)
-    personajes = re.search(patrones['personajes'], estructura, re.IGNORECASE)
-    ambientacion = re.search(patrones['ambientacion'], estructura, re.IGNORECASE)
-    tecnica = re.search(patrones['tecnica'], estructura, re.IGNORECASE)
-
-    # Extraer el contenido, manejando posibles espacios y formatos
-    titulo = titulo.group(1).strip() if titulo else "Sin título"
-    trama = trama.group(1).strip() if trama else "Sin trama principal"
-    subtramas = subtramas.group(1).strip() if subtramas else "Sin subtramas"
-    personajes = personajes.group(1).strip() if personajes else "Sin personajes"
-    ambientacion = ambientacion.group(1).strip() if ambientacion else "Sin ambientación"
-    tecnica = tecnica.group(1).strip() if tecnica else "Sin técnicas literarias"
+    # Extraer el contenido, con un valor por defecto para los campos vacíos
+    titulo = estructura['titulo'].strip() or "Sin título"
+    trama = estructura['trama'].strip() or "Sin trama principal"
+    subtramas = estructura['subtramas'].strip() or "Sin subtramas"
+    personajes = estructura['personajes'].strip() or "Sin personajes"
+    ambientacion = estructura['ambientacion'].strip() or "Sin ambientación"
+    tecnica = estructura['tecnica'].strip() or "Sin técnicas literarias"
 
     return titulo, trama, subtramas, personajes, ambientacion, tecnica
 
-# Función para generar cada escena con subtramas y técnicas avanzadas de escritura
-def generar_escena(capitulo, escena, trama, subtramas, personajes, ambientacion, tecnica, palabras_trama, palabras_subtramas):
-    # Estimar tokens: 1 palabra ≈ 1.3 tokens
-    max_tokens_trama = int(palabras_trama * 1.3)
-    max_tokens_subtramas = int(palabras_subtramas * 1.3)
-    total_max_tokens = max_tokens_trama + max_tokens_subtramas
-
+# Función para planificar todas las escenas antes de escribirlas (beat sheet)
+# Cada escena recibe su objetivo, personajes, giro y la situación en la que deja la historia,
+# de modo que las escenas puedan escribirse en paralelo sin esperar a la anterior
+def planificar_escenas(num_capitulos, num_escenas, trama, subtramas, personajes, ambientacion):
     prompt = f"""
-Escribe la Escena {escena} del Capítulo {capitulo} de una novela de suspenso político de alta calidad con las siguientes características:
+Planifica escena por escena una novela de suspenso político de {num_capitulos} capítulos con {num_escenas} escenas cada uno, a partir de estos elementos:
 
 - **Trama Principal**: {trama}
 - **Subtramas**: {subtramas}
 - **Personajes**: {personajes}
 - **Ambientación**: {ambientacion}
+
+Para cada escena indica:
+- "objetivo": qué debe lograr la escena en la trama o las subtramas.
+- "personajes": personajes que intervienen.
+- "giro": giro, revelación o cambio que introduce.
+- "estado_final": situación concreta en la que queda la historia al terminar la escena (dónde están los personajes, qué saben y qué ha cambiado), que será el punto de partida de la escena siguiente.
+
+Responde únicamente con un objeto JSON, sin texto adicional, cuyo campo "escenas" sea la lista de los {num_capitulos * num_escenas} objetos, en orden, con este formato:
+{{"escenas": [{{"capitulo": 1, "escena": 1, "objetivo": "...", "personajes": "...", "giro": "...", "estado_final": "..."}}]}}
+"""
+    # Unas 70 palabras por escena en el plan
+    max_tokens = presupuesto_salida(num_capitulos * num_escenas * 70, "es")
+    datos = pedir_json_api(prompt, ESQUEMA_PLAN, "plan_escenas", max_tokens=max_tokens, temperature=0.7, tarea="plan")
+    if not datos:
+        return None
+    return extraer_plan(datos['escenas'])
+
+# Función para convertir el plan de escenas validado en un diccionario {(capítulo, escena): datos}
+def extraer_plan(escenas):
+    return {(item['capitulo'], item['escena']): item for item in escenas}
+
+# Función para normalizar la tabla de hechos de la memoria: lista de {"nombre", "tipo", "dato"}
+def normalizar_hechos(hechos):
+    normalizados = []
+    for hecho in hechos if isinstance(hechos, list) else []:
+        if isinstance(hecho, dict) and hecho.get("nombre") and hecho.get("dato"):
+            normalizados.append({
+                "nombre": str(hecho["nombre"]).strip(),
+                "tipo": str(hecho.get("tipo") or "personaje").strip(),
+                "dato": str(hecho["dato"]).strip(),
+            })
+    return normalizados[:MAX_HECHOS_MEMORIA]
+
+# Bloque con la estructura completa de la novela, tal como se enviaba en cada escena
+def bloque_estructura(trama, subtramas, personajes, ambientacion, tecnica):
+    return f"""- **Trama Principal**: {trama}
+- **Subtramas**: {subtramas}
+- **Personajes**: {personajes}
+- **Ambientación**: {ambientacion}
 - **Técnicas Literarias**: {tecnica}
+"""
+
+# Bloque con la memoria de continuidad que sustituye a la estructura completa en las escenas
+def formatear_memoria(memoria):
+    hechos = "\n".join(f"  - {h['nombre']} ({h['tipo']}): {h['dato']}" for h in memoria['hechos'])
+    return f"""- **Premisa**: {memoria['premisa']}
+- **Estilo y Técnicas Literarias**: {memoria['estilo']}
+- **Lo Ocurrido hasta Ahora**: {memoria['sinopsis'] or 'La novela aún no ha comenzado.'}
+- **Personajes y Lugares** (estado actual):
+{hechos or '  - Sin datos.'}
+"""
+
+# Función para condensar la estructura aprobada en la memoria de continuidad inicial
+# Retorna (memoria, tokens del prompt usado) o (None, tokens) si la respuesta no es válida
+def condensar_estructura(trama, subtramas, personajes, ambientacion, tecnica):
+    prompt = f"""
+Condensa la estructura de esta novela de suspenso político en una memoria de continuidad compacta que sustituirá a la estructura completa al escribir cada escena.
+
+{bloque_estructura(trama, subtramas, personajes, ambientacion, tecnica)}
+Responde únicamente con un objeto JSON, sin texto adicional, con este formato:
+{{"premisa": "trama principal y subtramas en un máximo de {PALABRAS_PREMISA} palabras",
+ "estilo": "tono y técnicas literarias en un máximo de 40 palabras",
+ "hechos": [{{"nombre": "...", "tipo": "personaje o lugar", "dato": "rasgos esenciales, motivación y situación inicial en una frase"}}]}}
+
+Incluye en "hechos" a todos los personajes con nombre y los lugares principales (como máximo {MAX_HECHOS_MEMORIA} entradas).
+"""
+    tokens = contar_tokens(prompt)
+    datos = pedir_json_api(prompt, ESQUEMA_MEMORIA_INICIAL, "memoria_inicial",
+                           max_tokens=presupuesto_salida(PALABRAS_PREMISA + 40 + MAX_HECHOS_MEMORIA * 25, "es"), temperature=0.3,
+                           tarea="memoria")
+    if not datos or not datos["premisa"].strip():
+        return None, tokens
+    memoria = {
+        "premisa": datos["premisa"].strip(),
+        "estilo": datos["estilo"].strip(),
+        "sinopsis": "",
+        "hechos": normalizar_hechos(datos.get("hechos")),
+        "hasta": 0,
+    }
+    return memoria, tokens
+
+# Función para incorporar una escena terminada a la memoria de continuidad
+# Retorna (memoria actualizada, tokens del prompt usado) o (None, tokens) si la respuesta no es válida
+def actualizar_memoria(memoria, capitulo, escena, texto):
+    hechos = json.dumps(memoria['hechos'], ensure_ascii=False)
+    prompt = f"""
+Actualiza la memoria de continuidad de una novela con la Escena {escena} del Capítulo {capitulo}.
+
+### Sinopsis hasta ahora:
+{memoria['sinopsis'] or 'La novela aún no ha comenzado.'}
+
+### Tabla de personajes y lugares:
+{hechos}
+
+### Escena:
+{texto}
+
+Responde únicamente con un objeto JSON, sin texto adicional, con este formato:
+{{"sinopsis": "...", "hechos": [{{"nombre": "...", "tipo": "personaje o lugar", "dato": "..."}}]}}
+
+- "sinopsis": lo ocurrido en toda la novela hasta el final de esta escena, en un máximo de {PALABRAS_SINOPSIS} palabras. Resume más lo antiguo y conserva con detalle lo reciente.
+- "hechos": la tabla completa actualizada (como máximo {MAX_HECHOS_MEMORIA} entradas): dónde está cada personaje, qué sabe, sus relaciones y cualquier detalle establecido que no deba contradecirse (heridas, objetos, fechas, nombres). Añade los personajes y lugares nuevos.
+"""
+    tokens = contar_tokens(prompt)
+    datos = pedir_json_api(prompt, ESQUEMA_MEMORIA, "memoria_escena",
+                           max_tokens=presupuesto_salida(PALABRAS_SINOPSIS + MAX_HECHOS_MEMORIA * 30, "es"), temperature=0.3,
+                           tarea="memoria")
+    if not datos or not datos["sinopsis"].strip():
+        return None, tokens
+    return dict(memoria, sinopsis=datos["sinopsis"].strip(),
+                hechos=normalizar_hechos(datos.get("hechos")) or memoria['hechos']), tokens
+
+# Función para generar cada escena con subtramas y técnicas avanzadas de escritura
+# `plan` es la entrada del plan de escenas y `estado_inicial` el estado final de la escena anterior
+# Con `memoria`, el prompt lleva la memoria de continuidad en lugar de la estructura completa
+# `vecinas` (final de la anterior, comienzo de la siguiente) e `indicaciones` se usan al regenerar una escena
+def generar_escena(capitulo, escena, trama, subtramas, personajes, ambientacion, tecnica, palabras_trama, palabras_subtramas, al_recibir=None, plan=None, estado_inicial=None, memoria=None, vecinas=None, indicaciones=None):
+    # Presupuesto de salida con la relación tokens/palabra calibrada para el español
+    total_max_tokens = presupuesto_salida(palabras_trama + palabras_subtramas, "es")
+
+    plan_escena = ""
+    if plan:
+        plan_escena = f"""
+### Plan de esta Escena:
+- **Objetivo**: {plan.get('objetivo', '')}
+- **Personajes que intervienen**: {plan.get('personajes', '')}
+- **Giro o revelación**: {plan.get('giro', '')}
+- **Situación al comenzar**: {estado_inicial or 'Es el comienzo de la novela.'}
+- **Situación al terminar**: {plan.get('estado_final', '')}
+
+Sigue este plan: la escena debe partir de la situación inicial y dejar la historia exactamente en la situación final.
+"""
 
+    if vecinas:
+        final_anterior, inicio_siguiente = vecinas
+        plan_escena += f"""
+### Escenas Vecinas (ya escritas):
+- **Final de la escena anterior**: {final_anterior or 'Es el comienzo de la novela.'}
+- **Comienzo de la escena siguiente**: {inicio_siguiente or 'Es el final de la novela.'}
+
+La escena reemplaza a una ya escrita: debe enlazar sin saltos con el final de la anterior y llevar con naturalidad al comienzo de la siguiente.
+"""
+    if indicaciones:
+        plan_escena += f"""
+### Indicaciones del Autor para esta Versión:
+{indicaciones}
+"""
+
+    if memoria:
+        contexto = formatear_memoria(memoria)
+    else:
+        contexto = bloque_estructura(trama, subtramas, personajes, ambientacion, tecnica)
+
+    prompt = f"""
+Escribe la Escena {escena} del Capítulo {capitulo} de una novela de suspenso político de alta calidad con las siguientes características:
+
+{contexto}{plan_escena}
 ### Requisitos de la Escena:
 1. **Trama**: Desarrolla la trama principal con profundidad y añade giros inesperados que mantengan al lector intrigado.
 2. **Subtramas**: Integra las subtramas de manera que complementen y enriquezcan la trama principal, asegurando que cada una contribuya al desarrollo de los personajes y al avance de la historia.
@@ -230,125 +445,567 @@ Escribe la Escena {escena} del Capítulo {capitulo} de una novela de suspenso po
 
 Asegúrate de mantener la coherencia y la cohesión en toda la escena, contribuyendo significativamente al desarrollo general de la novela.
 """
-    escena_texto = call_openrouter_api(prompt, max_tokens=total_max_tokens, temperature=0.7, top_p=0.9, top_k=50, repetition_penalty=1.2)
+    # Recortar la estructura o la memoria si el prompt no deja sitio para toda la escena
+    prompt = recortar_bloque(prompt, contexto, total_max_tokens, modelo_enviado("prosa", claves_api(st.secrets)))
+    escena_texto = call_openrouter_api(prompt, max_tokens=total_max_tokens, temperature=0.7, top_p=0.9, top_k=50, repetition_penalty=1.2, al_recibir=al_recibir)
     return escena_texto
 
-# Función para generar la novela completa después de la aprobación
-def generar_novela_completa(num_capitulos, num_escenas):
-    titulo = st.session_state.titulo
-    trama = st.session_state.trama
-    subtramas = st.session_state.subtramas
-    personajes = st.session_state.personajes
-    ambientacion = st.session_state.ambientacion
-    tecnica = st.session_state.tecnica
+# Función para construir el manuscrito de la novela a partir de las escenas guardadas {(capítulo, escena): texto}
+def ensamblar_novela(titulo, escenas):
+    manuscrito = Manuscrito(titulo)
+    for (cap, esc), texto in sorted(escenas.items()):
+        manuscrito.poner_escena(cap, esc, texto)
+    return manuscrito
+
+# Función para reunir la estructura y los parámetros que definen la ejecución de la novela
+def datos_ejecucion():
+    return {
+        'titulo': st.session_state.titulo,
+        'trama': st.session_state.trama,
+        'subtramas': st.session_state.subtramas,
+        'personajes': st.session_state.personajes,
+        'ambientacion': st.session_state.ambientacion,
+        'tecnica': st.session_state.tecnica,
+        'num_capitulos': num_capitulos,
+        'num_escenas': num_escenas,
+        'porcentaje_trama_principal': porcentaje_trama_principal,
+    }
 
-    total_palabras = 60000  # Ajustado a 60,000 palabras
+# Función para registrar en el almacén de ejecuciones la novela aprobada
+# El identificador depende de la estructura y los parámetros, así que aprobar de nuevo lo mismo reanuda la ejecución
+# (también la ejecución adelantada durante la revisión, si los parámetros no han cambiado)
+def crear_ejecucion():
+    datos = datos_ejecucion()
+    ejecucion = id_ejecucion("novela", datos)
+    obtener_almacen().crear(ejecucion, "novela", datos)
+    st.session_state.ejecucion = ejecucion
+    # Guardar el identificador en la URL para reanudar la ejecución si se recarga la página
+    st.query_params["ejecucion"] = ejecucion
+
+# Función para recuperar una ejecución guardada (por ejemplo, tras recargar la página)
+def restaurar_ejecucion(ejecucion_id):
+    ejecucion = obtener_almacen().obtener(ejecucion_id)
+    if ejecucion is None or ejecucion["tipo"] != "novela":
+        return False
+    datos = ejecucion["datos"]
+    for clave in ('titulo', 'trama', 'subtramas', 'personajes', 'ambientacion', 'tecnica'):
+        st.session_state[clave] = datos[clave]
+    st.session_state.ejecucion = ejecucion_id
+    if ejecucion["estado"] == COMPLETADA:
+        escenas = obtener_almacen().escenas(ejecucion_id)
+        st.session_state.novela_completa = ensamblar_novela(datos['titulo'], escenas)
+        st.session_state.etapa = "completado"
+    elif ejecucion["estado"] == INTERRUMPIDA:
+        st.session_state.etapa = "interrumpida"
+    else:
+        st.session_state.etapa = "generacion"
+    return True
+
+# Función para generar (o reanudar) la novela completa después de la aprobación
+# Cada escena se guarda en el almacén de ejecuciones en cuanto termina; las que fallan se reintentan por separado
+# Se ejecuta como trabajo en segundo plano (trabajos.py): informa a través de `trabajo` y no usa la sesión
+# Con `hasta_capitulo` solo se escriben las escenas hasta ese capítulo y la ejecución queda en curso
+def generar_novela_completa(trabajo, ejecucion_id, escenas_en_paralelo=4, streaming=False, hasta_capitulo=None):
+    almacen = obtener_almacen()
+    datos = almacen.obtener(ejecucion_id)["datos"]
+    titulo = datos['titulo']
+    trama = datos['trama']
+    subtramas = datos['subtramas']
+    personajes = datos['personajes']
+    ambientacion = datos['ambientacion']
+    tecnica = datos['tecnica']
+    num_capitulos = datos['num_capitulos']
+    num_escenas = datos['num_escenas']
     total_escenas = num_capitulos * num_escenas
-
-    # Distribuir las palabras entre trama principal y subtramas
-    porcentaje_trama_principal_decimal = porcentaje_trama_principal / 100  # Convertir a decimal
-    porcentaje_subtramas_decimal = porcentaje_subtramas / 100
-
-    palabras_trama_principal_total = int(total_palabras * porcentaje_trama_principal_decimal)
-    palabras_subtramas_total = total_palabras - palabras_trama_principal_total
-
-    # Distribuir palabras por escena para trama principal
-    palabras_por_escena_trama = palabras_trama_principal_total // total_escenas
-    palabras_restantes_trama = palabras_trama_principal_total - (palabras_por_escena_trama * total_escenas)
-
-    # Distribuir palabras por escena para subtramas
-    palabras_por_escena_subtramas = palabras_subtramas_total // total_escenas
-    palabras_restantes_subtramas = palabras_subtramas_total - (palabras_por_escena_subtramas * total_escenas)
-
-    # Crear listas de palabras por escena con variación del ±75 palabras para trama y ±45 para subtramas
-    palabras_por_escena_trama_lista = []
-    palabras_por_escena_subtramas_lista = []
-    for _ in range(total_escenas):
-        variacion_trama = random.randint(-75, 75)  # Variación recomendada
-        palabras_trama = palabras_por_escena_trama + variacion_trama
-        palabras_trama = max(350, palabras_trama)  # Mínimo recomendado
-        palabras_por_escena_trama_lista.append(palabras_trama)
-
-        variacion_subtramas = random.randint(-45, 45)  # Variación recomendada
-        palabras_subtramas = palabras_por_escena_subtramas + variacion_subtramas
-        palabras_subtramas = max(175, palabras_subtramas)  # Mínimo recomendado
-        palabras_por_escena_subtramas_lista.append(palabras_subtramas)
-
-    # Ajustar las palabras restantes
-    for i in range(palabras_restantes_trama):
-        palabras_por_escena_trama_lista[i % total_escenas] += 1
-
-    for i in range(palabras_restantes_subtramas):
-        palabras_por_escena_subtramas_lista[i % total_escenas] += 1
-
-    novela = f"**{titulo}**\n\n"
-
-    # Inicializar la barra de progreso
-    progress_bar = st.progress(0)
-    progress_text = st.empty()
-    current = 0
-
-    escena_index = 0  # Índice para acceder a las listas de palabras
-    palabras_por_capitulo = {cap: [] for cap in range(1, num_capitulos + 1)}  # Para la gráfica
-
-    # Generar cada capítulo y escena
-    for cap in range(1, num_capitulos + 1):
-        novela += f"## Capítulo {cap}\n\n"
-        for esc in range(1, num_escenas + 1):
-            palabras_trama_escena = palabras_por_escena_trama_lista[escena_index]
-            palabras_subtramas_escena = palabras_por_escena_subtramas_lista[escena_index]
-            total_palabras_escena = palabras_trama_escena + palabras_subtramas_escena
-
-            palabras_por_capitulo[cap].append(total_palabras_escena)
-            with st.spinner(f"Generando Capítulo {cap}, Escena {esc} ({total_palabras_escena} palabras)..."):
-                escena = generar_escena(cap, esc, trama, subtramas, personajes, ambientacion, tecnica, 
-                                        palabras_trama_escena, palabras_subtramas_escena)
+    almacen.marcar_estado(ejecucion_id, EN_CURSO)
+
+    # Las palabras por escena se fijan una sola vez para que una ejecución reanudada respete el reparto
+    if 'palabras' not in datos:
+        datos['palabras'] = repartir_palabras(total_escenas, datos['porcentaje_trama_principal'])
+        almacen.actualizar_datos(ejecucion_id, datos)
+
+    # Planificar todas las escenas antes de escribirlas; el plan se guarda con la ejecución
+    if 'plan' not in datos:
+        trabajo.progreso(texto="Planificando las escenas de la novela...")
+        plan = planificar_escenas(num_capitulos, num_escenas, trama, subtramas, personajes, ambientacion)
+        if not plan:
+            avisar("No se pudo obtener el plan de escenas; cada escena se escribirá solo a partir de la estructura.", "warning")
+        datos['plan'] = list((plan or {}).values())
+        almacen.actualizar_datos(ejecucion_id, datos)
+        # No seguir gastando si se canceló durante la planificación (p. ej. un adelanto descartado)
+        trabajo.comprobar_cancelacion()
+    plan_escenas = {(int(item['capitulo']), int(item['escena'])): item for item in datos['plan']}
+
+    # Orden de las escenas; el reparto inicial se conserva para comparar lo proyectado con lo producido
+    orden = [(cap, esc) for cap in range(1, num_capitulos + 1) for esc in range(1, num_escenas + 1)]
+    indice = {clave: i for i, clave in enumerate(orden)}
+    datos.setdefault('palabras_iniciales', [list(par) for par in datos['palabras']])
+
+    # Memoria de continuidad: premisa y tabla de personajes y lugares condensadas una sola vez,
+    # más una sinopsis que se actualiza con cada escena terminada, en el orden de la novela
+    ahorro = datos.setdefault('ahorro', {'escenas': 0, 'tokens_estructura': 0, 'tokens_memoria': 0, 'tokens_mantenimiento': 0})
+    if 'memoria' not in datos:
+        trabajo.progreso(texto="Condensando la estructura en la memoria de continuidad...")
+        memoria, tokens = condensar_estructura(trama, subtramas, personajes, ambientacion, tecnica)
+        ahorro['tokens_mantenimiento'] += tokens
+        if memoria is None:
+            avisar("No se pudo condensar la estructura; las escenas recibirán la estructura completa.", "warning")
+        else:
+            datos['memoria'] = memoria
+        almacen.actualizar_datos(ejecucion_id, datos)
+        trabajo.comprobar_cancelacion()
+    memoria = datos.get('memoria')
+    tokens_estructura = contar_tokens(bloque_estructura(trama, subtramas, personajes, ambientacion, tecnica))
+
+    # Manuscrito con las escenas ya guardadas en ejecuciones anteriores; las nuevas se colocan en él al terminar
+    manuscrito = ensamblar_novela(titulo, almacen.escenas(ejecucion_id))
+    faltantes = [clave for clave in orden if manuscrito.escena(*clave) is None]
+    if len(manuscrito) and faltantes:
+        avisar(f"Reanudando la novela: {len(manuscrito)} escenas ya estaban guardadas.", "info")
+    # Escenas posteriores a `hasta_capitulo`, que se dejan para la generación completa
+    aplazadas = [clave for clave in faltantes if hasta_capitulo is not None and clave[0] > hasta_capitulo]
+
+    # Control del presupuesto de palabras: cada escena terminada actualiza el sesgo del modelo y el
+    # presupuesto restante se reparte de nuevo entre las escenas que aún no se han pedido
+    reales = {indice[(capitulo.numero, escena.numero)]: escena.palabras for capitulo, escena in manuscrito.escenas()}
+    sesgo = datos.get('sesgo_palabras', 1.0)
+    pedidas = {}
+    proyeccion = redistribuir_palabras(datos['palabras'], reales, [], [indice[clave] for clave in faltantes])
+
+    # Inicializar el progreso del trabajo
+    current = len(manuscrito)
+    trabajo.progreso(current, total_escenas, f"Progreso: {current}/{total_escenas} escenas generadas "
+                                             f"(proyección: {proyeccion} palabras).")
+
+    def incorporar_escenas():
+        # Incorporar a la memoria las escenas terminadas que siguen, sin huecos, a la última incorporada
+        nonlocal memoria
+        while memoria is not None and memoria['hasta'] < total_escenas:
+            cap, esc = orden[memoria['hasta']]
+            terminada = manuscrito.escena(cap, esc)
+            if terminada is None:
+                break
+            trabajo.progreso(texto=f"Actualizando la memoria de continuidad con el Capítulo {cap}, Escena {esc}...")
+            # Guardar la sinopsis y la tabla de hechos previas a cada escena para poder regenerarla
+            # más adelante con su continuidad (sin hechos de escenas posteriores)
+            sinopsis_previas = datos.setdefault('sinopsis_previas', [])
+            if len(sinopsis_previas) == memoria['hasta']:
+                sinopsis_previas.append(memoria['sinopsis'])
+            hechos_previos = datos.setdefault('hechos_previos', [])
+            if len(hechos_previos) == memoria['hasta']:
+                hechos_previos.append(memoria['hechos'])
+            nueva, tokens = actualizar_memoria(memoria, cap, esc, terminada.texto)
+            ahorro['tokens_mantenimiento'] += tokens
+            if nueva is None:
+                avisar(f"No se pudo actualizar la memoria con el Capítulo {cap}, Escena {esc}; se conserva la anterior.", "warning")
+                nueva = memoria
+            memoria = dict(nueva, hasta=memoria['hasta'] + 1)
+            datos['memoria'] = memoria
+            almacen.actualizar_datos(ejecucion_id, datos)
+
+    # Documento de Word parcial: cada capítulo se añade en cuanto tiene todas sus escenas (y los anteriores
+    # ya están en el documento), de modo que se puede descargar lo terminado durante la generación
+    documento = documento_incremental(DOCUMENTO_PARCIAL, ejecucion_id)
+    exportados = documento.partes()
+
+    def exportar_capitulos():
+        nonlocal exportados
+        while exportados < num_capitulos:
+            capitulo = manuscrito.capitulo(exportados + 1)
+            if capitulo is None or len(capitulo.escenas) < num_escenas:
+                break
+            trabajo.progreso(texto=f"Añadiendo el Capítulo {capitulo.numero} al documento de Word...")
+            documento.agregar(lambda document: escribir_capitulo_word(document, capitulo),
+                              lambda document: iniciar_word(document, titulo))
+            exportados += 1
+
+    def escribir_escena(cap, esc, memoria_escena, palabras_trama_escena, palabras_subtramas_escena, al_recibir=None):
+        anterior = plan_escenas.get((cap, esc - 1)) or plan_escenas.get((cap - 1, num_escenas))
+        return generar_escena(cap, esc, trama, subtramas, personajes, ambientacion, tecnica,
+                              palabras_trama_escena, palabras_subtramas_escena, al_recibir=al_recibir,
+                              plan=plan_escenas.get((cap, esc)),
+                              estado_inicial=anterior.get('estado_final') if anterior else None,
+                              memoria=memoria_escena)
+
+    # Escribir las escenas con un número limitado de hilos; el limitador de tasa compartido
+    # (limitador.py) regula el ritmo de las llamadas. Las escenas se lanzan en orden a medida que
+    # quedan hilos libres, así cada una recibe la memoria con todo lo escrito hasta ese momento
+    # (con una sola escena en paralelo, la memoria llega exactamente hasta la escena anterior)
+    incorporar_escenas()
+    exportar_capitulos()
+    intentos = {clave: 0 for clave in faltantes}
+    cola = [clave for clave in faltantes if clave not in aplazadas]
+    fallidas = []
+    # La vista previa en streaming solo tiene sentido si las escenas se escriben de una en una
+    al_recibir = trabajo.actualizar_vista_previa if streaming and escenas_en_paralelo == 1 else None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=escenas_en_paralelo) as executor:
+        pendientes = {}
+
+        def detener_si_cancelado():
+            # Guardar el estado y detenerse sin pedir más escenas; las que están en curso se descartan
+            if trabajo.cancelado():
+                for pendiente in pendientes:
+                    pendiente.cancel()
+                almacen.actualizar_datos(ejecucion_id, datos)
+                almacen.marcar_estado(ejecucion_id, INTERRUMPIDA)
+                trabajo.comprobar_cancelacion()
+
+        def lanzar():
+            detener_si_cancelado()
+            while cola and len(pendientes) < escenas_en_paralelo:
+                cap, esc = cola.pop(0)
+                intentos[(cap, esc)] += 1
+                # Tokens de contexto enviados frente a los que ocuparía la estructura completa
+                ahorro['escenas'] += 1
+                ahorro['tokens_estructura'] += tokens_estructura
+                ahorro['tokens_memoria'] += contar_tokens(formatear_memoria(memoria)) if memoria else tokens_estructura
+                # Pedir el objetivo corregido por el sesgo del modelo para que lo producido se acerque al objetivo
+                palabras_trama_escena, palabras_subtramas_escena = (round(p / sesgo) for p in datos['palabras'][indice[(cap, esc)]])
+                pedidas[(cap, esc)] = palabras_trama_escena + palabras_subtramas_escena
+                # Copiar el contexto para que cada hilo herede el trabajo, el plazo y la telemetría
+                futuro = executor.submit(contextvars.copy_context().run, escribir_escena, cap, esc, memoria,
+                                         palabras_trama_escena, palabras_subtramas_escena, al_recibir)
+                pendientes[futuro] = (cap, esc)
+
+        lanzar()
+        while pendientes:
+            hechos, _ = concurrent.futures.wait(pendientes, return_when=concurrent.futures.FIRST_COMPLETED)
+            detener_si_cancelado()
+            for futuro in hechos:
+                cap, esc = pendientes.pop(futuro)
+                trabajo.actualizar_vista_previa(None)
+                escena = futuro.result()
                 if not escena:
-                    st.error(f"No se pudo generar la Escena {esc} del Capítulo {cap}.")
-                    return None
+                    if intentos[(cap, esc)] < INTENTOS_POR_ESCENA:
+                        avisar(f"Reintentando la Escena {esc} del Capítulo {cap}...", "warning")
+                        cola.insert(0, (cap, esc))
+                    else:
+                        fallidas.append((cap, esc))
+                    continue
+                registrar_salida(escena, "es")
                 # Limpiar saltos de línea manuales, reemplazándolos por saltos de párrafo
                 escena = escena.replace('\r\n', '\n').replace('\n', '\n\n')
-                novela += f"### Escena {esc}\n\n{escena}\n\n"
-                # Actualizar la barra de progreso
+                producidas = manuscrito.poner_escena(cap, esc, escena).palabras
+                almacen.guardar_escena(ejecucion_id, cap, esc, escena)
+                # Medir lo producido y repartir de nuevo el presupuesto restante
+                reales[indice[(cap, esc)]] = producidas
+                sesgo = actualizar_sesgo(sesgo, producidas, pedidas[(cap, esc)])
+                datos['sesgo_palabras'] = sesgo
+                proyeccion = redistribuir_palabras(datos['palabras'], reales,
+                                                   [indice[clave] for clave in pendientes.values()],
+                                                   [indice[clave] for clave in cola + aplazadas])
+                # Actualizar el progreso
                 current += 1
-                progress_bar.progress(current / total_escenas)
-                progress_text.text(f"Progreso: {current}/{total_escenas} escenas generadas.")
-                escena_index += 1
-                # Retraso para evitar exceder los límites de la API
-                time.sleep(1)
+                trabajo.progreso(current, texto=f"Progreso: {current}/{total_escenas} escenas generadas "
+                                                f"(última: Capítulo {cap}, Escena {esc}; "
+                                                f"proyección: {proyeccion} de {PALABRAS_NOVELA} palabras).")
+            incorporar_escenas()
+            exportar_capitulos()
+            almacen.actualizar_datos(ejecucion_id, datos)
+            lanzar()
+
+    if fallidas:
+        almacen.marcar_estado(ejecucion_id, INTERRUMPIDA)
+        lista = ", ".join(f"Capítulo {cap}, Escena {esc}" for cap, esc in sorted(fallidas))
+        avisar(f"No se pudieron generar {len(fallidas)} escenas ({lista}). "
+               f"Las {current} escenas terminadas están guardadas; puede reanudar la generación.")
+        return None
 
-    # Ocultar la barra de progreso y el texto de progreso
-    progress_bar.empty()
-    progress_text.empty()
+    if aplazadas:
+        return manuscrito
+    # Con todos los capítulos en el documento solo falta el conteo de palabras; el documento
+    # queda publicado como la exportación final, que así no hay que reconstruir
+    if exportados == num_capitulos:
+        documento.agregar(lambda document: cerrar_word(document, manuscrito.palabras))
+        exportados += 1
+    if exportados > num_capitulos:
+        documento.publicar("novela_docx", titulo, manuscrito.texto())
+    almacen.marcar_estado(ejecucion_id, COMPLETADA)
+    return manuscrito
+
+# Función que ejecuta la generación de la novela como trabajo en segundo plano, con su plazo y su telemetría
+# Si se estaba adelantando la misma ejecución, se lanza al terminar el adelanto (ver `enviar_generacion`)
+def ejecutar_novela(trabajo, ejecucion_id, escenas_en_paralelo, streaming):
+    # La ejecución ya está aprobada: deja de ser un adelanto que se pueda limpiar por inactividad
+    almacen = obtener_almacen()
+    ejecucion = almacen.obtener(ejecucion_id)
+    if ejecucion is not None and ejecucion["datos"].pop('especulativa', None):
+        almacen.actualizar_datos(ejecucion_id, ejecucion["datos"])
+    with plazo_trabajo(PLAZO_NOVELA), trabajo_telemetria("novela") as telemetria:
+        try:
+            novela = generar_novela_completa(trabajo, ejecucion_id, escenas_en_paralelo, streaming)
+        finally:
+            # El documento parcial ya está guardado en el almacén; se libera la copia en memoria
+            documento_incremental(DOCUMENTO_PARCIAL, ejecucion_id).cerrar()
+    return {"novela": novela, "telemetria": telemetria.resumen()}
+
+# Función para ofrecer el documento de Word con los capítulos terminados hasta el momento, si los hay
+def mostrar_descarga_parcial(ejecucion_id):
+    parcial = documento_incremental(DOCUMENTO_PARCIAL, ejecucion_id).contenido()
+    if parcial:
+        st.download_button(
+            label="Descargar los capítulos terminados",
+            data=parcial,
+            file_name="novela_parcial.docx",
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        )
 
-    # Mostrar el total de palabras generadas estimadas
-    total_palabras_generadas = len(novela.split())
-    st.write(f"**Total de palabras generadas estimadas:** {total_palabras_generadas}")
+# Función para enviar (o reanudar) la generación de la ejecución actual al gestor de trabajos
+# Si se está adelantando la misma ejecución, la generación espera a que el adelanto termine para
+# aprovecharlo, sin ocupar mientras tanto un hilo del gestor (el adelanto no se cancela: al
+# cancelarse borraría la ejecución)
+def enviar_generacion():
+    especulacion = obtener_gestor().obtener(id_especulacion(st.session_state.ejecucion))
+    trabajo = obtener_gestor().enviar("novela", ejecutar_novela, st.session_state.ejecucion, escenas_en_paralelo,
+                                      modo_streaming, id=st.session_state.ejecucion, despues_de=especulacion)
+    if trabajo.estado == PENDIENTE and especulacion is not None and especulacion.activo():
+        trabajo.progreso(texto="Terminando el capítulo adelantado durante la revisión...")
+
+# Identificador del trabajo que adelanta una ejecución durante la revisión de la estructura
+def id_especulacion(ejecucion_id):
+    return f"{ejecucion_id}-especulacion"
+
+# Función que adelanta el plan de escenas, la memoria y los primeros capítulos mientras se revisa la estructura
+# Su telemetría va en un trabajo aparte ("especulacion") y su resumen se guarda con la ejecución;
+# si se cancela (estructura rechazada o parámetros cambiados), la ejecución se borra del almacén,
+# salvo que ya se haya aprobado (existe su trabajo de generación)
+def especular_novela(trabajo, ejecucion_id, escenas_en_paralelo):
+    almacen = obtener_almacen()
+    antes = len(almacen.escenas(ejecucion_id))
+    descartada = False
+    with plazo_trabajo(PLAZO_NOVELA), trabajo_telemetria("especulacion") as telemetria:
+        try:
+            generar_novela_completa(trabajo, ejecucion_id, escenas_en_paralelo, hasta_capitulo=CAPITULOS_ESPECULATIVOS)
+            # Cancelado justo al terminar: también se descarta
+            descartada = trabajo.cancelado()
+        except TrabajoCancelado:
+            descartada = True
+    resultado = {
+        "escenas": len(almacen.escenas(ejecucion_id)) - antes,
+        "descartada": descartada,
+        "telemetria": telemetria.resumen(),
+    }
+    if descartada and obtener_gestor().obtener(ejecucion_id) is None:
+        almacen.eliminar(ejecucion_id)
+        documento_incremental(DOCUMENTO_PARCIAL, ejecucion_id).eliminar()
+    else:
+        documento_incremental(DOCUMENTO_PARCIAL, ejecucion_id).cerrar()
+        ejecucion = almacen.obtener(ejecucion_id)
+        if ejecucion is not None:
+            ejecucion["datos"]["especulacion"] = dict(resultado, telemetria={
+                clave: resultado["telemetria"][clave] for clave in ("llamadas", "coste", "tokens_prompt", "tokens_salida", "duracion")
+            })
+            almacen.actualizar_datos(ejecucion_id, ejecucion["datos"])
+    return resultado
+
+# Función para borrar las ejecuciones adelantadas que nunca se aprobaron ni descartaron (pestaña cerrada
+# durante la revisión) y que llevan más de `RETENCION_ESPECULACION` segundos sin actualizarse
+def limpiar_especulaciones():
+    almacen = obtener_almacen()
+    gestor = obtener_gestor()
+    for ejecucion in almacen.inactivas("novela", RETENCION_ESPECULACION):
+        if not ejecucion["datos"].get('especulativa'):
+            continue
+        trabajos = (gestor.obtener(id_especulacion(ejecucion["id"])), gestor.obtener(ejecucion["id"]))
+        if any(trabajo is not None and trabajo.activo() for trabajo in trabajos):
+            continue
+        almacen.eliminar(ejecucion["id"])
+        documento_incremental(DOCUMENTO_PARCIAL, ejecucion["id"]).eliminar()
+
+# Función para adelantar en segundo plano la ejecución de la estructura en revisión
+# Si los parámetros cambian durante la revisión, el trabajo anterior se descarta y se adelanta la nueva ejecución
+def enviar_especulacion():
+    datos = datos_ejecucion()
+    ejecucion = id_ejecucion("novela", datos)
+    if st.session_state.especulacion == ejecucion:
+        return
+    descartar_especulacion()
+    limpiar_especulaciones()
+    # Una ejecución que ya existía (p. ej. aprobada antes) no se adelanta ni, por tanto, se descarta
+    if obtener_almacen().obtener(ejecucion) is not None:
+        return
+    # Marcada como adelantada hasta que se apruebe, para limpiarla si se abandona la revisión
+    obtener_almacen().crear(ejecucion, "novela", dict(datos, especulativa=True))
+    obtener_gestor().enviar("especulacion", especular_novela, ejecucion, escenas_en_paralelo, id=id_especulacion(ejecucion))
+    st.session_state.especulacion = ejecucion
+
+# Función para cancelar y descartar el trabajo adelantado (estructura rechazada o parámetros cambiados)
+def descartar_especulacion():
+    ejecucion = st.session_state.especulacion
+    if ejecucion is None:
+        return
+    trabajo = obtener_gestor().obtener(id_especulacion(ejecucion))
+    if trabajo is not None and trabajo.estado == TRABAJO_EN_CURSO:
+        # El propio trabajo borra la ejecución al detenerse
+        trabajo.cancelar()
+    else:
+        if trabajo is not None:
+            trabajo.cancelar()
+        obtener_almacen().eliminar(ejecucion)
+        documento_incremental(DOCUMENTO_PARCIAL, ejecucion).eliminar()
+    if trabajo is not None:
+        st.session_state.especulaciones_descartadas.append(trabajo.id)
+    st.session_state.especulacion = None
+
+# Función para mostrar el estado del trabajo adelantado y el coste de los descartados, que se contabiliza aparte
+def mostrar_especulacion():
+    gestor = obtener_gestor()
+    if st.session_state.especulacion:
+        trabajo = gestor.obtener(id_especulacion(st.session_state.especulacion))
+        if trabajo is not None and trabajo.activo():
+            st.caption(f"Adelantando la novela en segundo plano. {trabajo.texto}")
+        elif trabajo is not None and trabajo.resultado:
+            st.caption(f"Capítulo adelantado listo ({trabajo.resultado['escenas']} escenas): "
+                       f"{formatear_resumen(trabajo.resultado['telemetria'])}")
+    descartados = [gestor.obtener(id) for id in st.session_state.especulaciones_descartadas]
+    resultados = [trabajo.resultado for trabajo in descartados if trabajo is not None and trabajo.resultado]
+    if resultados:
+        st.caption(
+            f"Trabajo adelantado descartado: {sum(r['escenas'] for r in resultados)} escenas, "
+            f"{sum(r['telemetria']['llamadas'] for r in resultados)} llamadas, "
+            f"coste estimado ${sum(r['telemetria']['coste'] for r in resultados):.4f}."
+        )
+    if any(trabajo is not None and trabajo.activo() for trabajo in descartados):
+        st.caption("Cancelando el trabajo adelantado descartado...")
+
+# Función para regenerar una sola escena de una novela terminada, con la continuidad guardada de sus vecinas
+# Recibe la sinopsis y los hechos previos a la escena, su plan, el final de la escena anterior y el comienzo de la siguiente;
+# la nueva versión se guarda en el almacén y se coloca en el manuscrito. Retorna el resumen de telemetría o None
+def regenerar_escena(ejecucion_id, manuscrito, cap, esc, indicaciones=""):
+    almacen = obtener_almacen()
+    datos = almacen.obtener(ejecucion_id)["datos"]
+    num_capitulos = datos['num_capitulos']
+    num_escenas = datos['num_escenas']
+    orden = [(c, e) for c in range(1, num_capitulos + 1) for e in range(1, num_escenas + 1)]
+    posicion = orden.index((cap, esc))
+    # Objetivo de la escena corregido por el sesgo de longitud medido durante la generación
+    palabras_trama_escena, palabras_subtramas_escena = (round(p / datos.get('sesgo_palabras', 1.0)) for p in datos['palabras'][posicion])
+    plan_escenas = {(int(item['capitulo']), int(item['escena'])): item for item in datos.get('plan', [])}
+    anterior_plan = plan_escenas.get(orden[posicion - 1]) if posicion > 0 else None
+
+    # Memoria con la sinopsis y los hechos de lo ocurrido antes de esta escena (si se guardaron)
+    memoria = datos.get('memoria')
+    sinopsis_previas = datos.get('sinopsis_previas', [])
+    hechos_previos = datos.get('hechos_previos', [])
+    if memoria and posicion < len(sinopsis_previas):
+        memoria = dict(memoria, sinopsis=sinopsis_previas[posicion])
+    if memoria and posicion < len(hechos_previos):
+        memoria = dict(memoria, hechos=hechos_previos[posicion])
+
+    # Final de la escena anterior y comienzo de la siguiente
+    anterior = manuscrito.escena(*orden[posicion - 1]) if posicion > 0 else None
+    siguiente = manuscrito.escena(*orden[posicion + 1]) if posicion + 1 < len(orden) else None
+    vecinas = (
+        " ".join(anterior.texto.split()[-PALABRAS_VECINAS:]) if anterior else None,
+        " ".join(siguiente.texto.split()[:PALABRAS_VECINAS]) if siguiente else None,
+    )
+
+    with plazo_trabajo(PLAZO_ESCENA), trabajo_telemetria("escena") as telemetria:
+        escena = generar_escena(cap, esc, datos['trama'], datos['subtramas'], datos['personajes'],
+                                datos['ambientacion'], datos['tecnica'], palabras_trama_escena,
+                                palabras_subtramas_escena, plan=plan_escenas.get((cap, esc)),
+                                estado_inicial=anterior_plan.get('estado_final') if anterior_plan else None,
+                                memoria=memoria, vecinas=vecinas, indicaciones=indicaciones.strip() or None)
+    if not escena:
+        return None
+    registrar_salida(escena, "es")
+    escena = escena.replace('\r\n', '\n').replace('\n', '\n\n')
+    almacen.guardar_escena(ejecucion_id, cap, esc, escena)
+    manuscrito.poner_escena(cap, esc, escena)
+    return telemetria.resumen()
+
+# Interfaz para elegir una escena de la novela terminada y regenerarla
+def mostrar_regeneracion():
+    st.subheader("Regenerar una escena")
+    manuscrito = st.session_state.novela_completa
+    columna_capitulo, columna_escena = st.columns(2)
+    with columna_capitulo:
+        cap = st.selectbox("Capítulo", [c.numero for c in manuscrito.capitulos], key="regenerar_capitulo")
+    with columna_escena:
+        esc = st.selectbox("Escena", [e.numero for e in manuscrito.capitulo(cap).escenas], key="regenerar_escena")
+    with st.expander("Texto actual de la escena"):
+        st.write(manuscrito.escena(cap, esc).texto)
+    indicaciones = st.text_area("Indicaciones para la nueva versión (opcional):", key="regenerar_indicaciones")
+    if st.button("Regenerar esta escena", key="regenerar"):
+        with st.spinner(f"Regenerando la Escena {esc} del Capítulo {cap}..."):
+            resumen = regenerar_escena(st.session_state.ejecucion, manuscrito, cap, esc, indicaciones)
+        if resumen is None:
+            st.error("No se pudo regenerar la escena; se conserva la versión anterior.")
+        else:
+            st.success(f"Escena {esc} del Capítulo {cap} regenerada. {formatear_resumen(resumen)}")
+
+# Función para mostrar las estadísticas de una novela terminada (`novela` es el manuscrito)
+def mostrar_estadisticas(ejecucion_id, novela):
+    datos = obtener_almacen().obtener(ejecucion_id)["datos"]
+    num_escenas = datos['num_escenas']
+    # Palabras proyectadas (reparto inicial) y producidas por escena en cada capítulo
+    palabras_por_capitulo = {}
+    for i, (palabras_trama, palabras_subtramas) in enumerate(datos.get('palabras_iniciales', datos['palabras'])):
+        palabras_por_capitulo.setdefault(i // num_escenas + 1, []).append(palabras_trama + palabras_subtramas)
+    reales_por_capitulo = {capitulo.numero: [escena.palabras for escena in capitulo.escenas] for capitulo in novela.capitulos}
+    total_proyectado = sum(sum(palabras) for palabras in palabras_por_capitulo.values())
+
+    # Mostrar el total de palabras generadas frente al proyectado
+    total_palabras_generadas = novela.palabras
+    st.write(f"**Total de palabras generadas:** {total_palabras_generadas} "
+             f"(proyectadas: {total_proyectado}; objetivo: {PALABRAS_NOVELA})")
+    if datos.get('sesgo_palabras'):
+        st.caption(f"El modelo produjo de media {datos['sesgo_palabras']:.2f} palabras por palabra pedida; "
+                   f"las escenas pendientes se pidieron corregidas por ese factor.")
+
+    # Mostrar la reutilización de conexiones del cliente HTTP compartido
+    estadisticas_http = obtener_cliente().estadisticas()
+    st.caption(
+        f"Conexiones HTTP: {estadisticas_http['conexiones_nuevas']} nuevas, "
+        f"{estadisticas_http['conexiones_reutilizadas']} reutilizadas "
+        f"en {estadisticas_http['peticiones']} peticiones."
+    )
+
+    # Mostrar el ahorro de tokens de prompt de la memoria de continuidad frente a la estructura completa
+    ahorro = datos.get('ahorro')
+    if ahorro and ahorro['escenas']:
+        neto = ahorro['tokens_estructura'] - ahorro['tokens_memoria'] - ahorro['tokens_mantenimiento']
+        st.caption(
+            f"Memoria de continuidad: {ahorro['tokens_memoria']} tokens de contexto en {ahorro['escenas']} "
+            f"prompts de escena frente a {ahorro['tokens_estructura']} con la estructura completa; "
+            f"{ahorro['tokens_mantenimiento']} tokens en mantener la memoria; ahorro neto de {neto} tokens de prompt."
+        )
 
-    # Graficar la distribución de palabras por capítulo
+    # Mostrar lo que se adelantó durante la revisión de la estructura (su coste no está en la telemetría de la generación)
+    especulacion = datos.get('especulacion')
+    if especulacion:
+        st.caption(
+            f"Adelantado durante la revisión y aprovechado: plan de escenas y {especulacion['escenas']} escenas en "
+            f"{especulacion['telemetria']['duracion']} s, {especulacion['telemetria']['llamadas']} llamadas, "
+            f"coste estimado ${especulacion['telemetria']['coste']:.4f}."
+        )
+
+    # Graficar la distribución de palabras por capítulo: producidas (línea continua) y proyectadas (discontinua)
     fig, ax = plt.subplots(figsize=(10, 6))
     for cap in palabras_por_capitulo:
+        linea, = ax.plot(
+            range(1, len(reales_por_capitulo.get(cap, [])) + 1),
+            reales_por_capitulo.get(cap, []),
+            marker='o',
+            label=f'Capítulo {cap}'
+        )
         ax.plot(
             range(1, num_escenas + 1),
             palabras_por_capitulo[cap],
-            marker='o',
-            label=f'Capítulo {cap}'
+            linestyle='--',
+            alpha=0.5,
+            color=linea.get_color()
         )
+    ax.plot([], [], linestyle='--', color='gray', label='Proyectado')
     ax.set_xlabel('Escena')
     ax.set_ylabel('Palabras')
-    ax.set_title('Distribución de Palabras por Escena en Cada Capítulo')
+    ax.set_title(f'Distribución de Palabras por Escena en Cada Capítulo\n'
+                 f'Total producido: {total_palabras_generadas} · proyectado: {total_proyectado} · objetivo: {PALABRAS_NOVELA}')
     ax.legend()
     st.pyplot(fig)
 
-    st.session_state.novela_completa = novela
-    st.session_state.etapa = "completado"
-
-    return novela
-
-# Función para exportar la novela a un archivo de Word con el formato especificado
-def exportar_a_word(titulo, novela_completa):
-    document = Document()
-
+# Función para preparar el documento de Word de la novela: página, estilos, título y tabla de contenidos
+def iniciar_word(document, titulo):
     # Configurar el tamaño de la página y márgenes
     section = document.sections[0]
     section.page_width = Inches(5)
@@ -372,47 +1029,42 @@ def exportar_a_word(titulo, novela_completa):
     agregar_tabla_de_contenidos(document)
     document.add_page_break()
 
-    # Separar la novela por capítulos
-    capítulos = novela_completa.split("## Capítulo")
-    for cap in capítulos:
-        cap = cap.strip()
-        if not cap:
-            continue
-        cap_num_match = re.match(r"(\d+)", cap)
-        cap_num = cap_num_match.group(1) if cap_num_match else "Sin número"
-        cap_content = cap.split('\n', 1)[1].strip() if '\n' in cap else ""
-
-        # Agregar el capítulo
-        document.add_heading(f"Capítulo {cap_num}", level=1)
-
-        # Separar por escenas
-        escenas = cap_content.split("### Escena")
-        for esc in escenas:
-            esc = esc.strip()
-            if not esc:
-                continue
-            esc_num_match = re.match(r"(\d+)", esc)
-            esc_num = esc_num_match.group(1) if esc_num_match else "Sin número"
-            esc_text = esc.split('\n', 1)[1].strip() if '\n' in esc else ""
-
-            # Agregar la escena
-            document.add_heading(f"Escena {esc_num}", level=2)
-
-            # Agregar el texto de la escena con saltos de párrafo
-            for paragraph_text in esc_text.split('\n\n'):
-                paragraph_text = paragraph_text.strip()
-                if paragraph_text:
-                    paragraph = document.add_paragraph(paragraph_text)
-                    paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-                    paragraph_format = paragraph.paragraph_format
-                    paragraph_format.line_spacing = 1.15
-                    paragraph_format.space_after = Pt(6)
-
-    # Agregar el conteo total de palabras al final del documento
-    total_palabras = len(novela_completa.split())
+# Función para agregar un capítulo del manuscrito (con sus escenas) al documento de Word
+def escribir_capitulo_word(document, capitulo):
+    # Agregar el capítulo
+    document.add_heading(capitulo.titulo, level=1)
+
+    for escena in capitulo.escenas:
+        # Agregar la escena
+        document.add_heading(escena.titulo, level=2)
+
+        # Agregar el texto de la escena con saltos de párrafo
+        for paragraph_text in escena.texto.split('\n\n'):
+            paragraph_text = paragraph_text.strip()
+            if paragraph_text:
+                paragraph = document.add_paragraph(paragraph_text)
+                paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+                paragraph_format = paragraph.paragraph_format
+                paragraph_format.line_spacing = 1.15
+                paragraph_format.space_after = Pt(6)
+
+# Función para cerrar el documento de Word con el conteo total de palabras
+def cerrar_word(document, total_palabras):
     document.add_page_break()
     document.add_paragraph(f"**Total de palabras generadas:** {total_palabras}", style='Intense Quote')
 
+# Función para exportar la novela (el manuscrito) a un archivo de Word con el formato especificado
+def exportar_a_word(titulo, novela_completa):
+    document = Document()
+    iniciar_word(document, titulo)
+
+    # Recorrer los capítulos y escenas del manuscrito
+    for capitulo in novela_completa.capitulos:
+        escribir_capitulo_word(document, capitulo)
+
+    # Agregar el conteo total de palabras al final del documento
+    cerrar_word(document, novela_completa.palabras)
+
     # Guardar el documento en memoria
     buffer = BytesIO()
     document.save(buffer)
@@ -457,15 +1109,30 @@ def mostrar_aprobacion():
     st.subheader("Técnicas Literarias")
     st.write(st.session_state.tecnica)
 
+    # Adelantar la generación mientras se revisa la estructura
+    if modo_especulativo:
+        enviar_especulacion()
+    mostrar_especulacion()
+
     # Botones de aprobación y rechazo
     aprobar, rechazar = st.columns(2)
     with aprobar:
         if st.button("Aprobar y Generar Novela", key="aprobar"):
+            crear_ejecucion()
+            # La generación aprovecha el trabajo adelantado si es la misma ejecución; si no, se descarta
+            if st.session_state.especulacion == st.session_state.ejecucion:
+                st.session_state.especulacion = None
+            else:
+                descartar_especulacion()
+            enviar_generacion()
             st.session_state.etapa = "generacion"
     with rechazar:
         if st.button("Rechazar y Regenerar Estructura", key="rechazar"):
+            descartar_especulacion()
             # Reiniciamos los valores
             st.session_state.estructura = None
+            st.session_state.ejecucion = None
+            st.query_params.pop("ejecucion", None)
             st.session_state.titulo = ""
             st.session_state.trama = ""
             st.session_state.subtramas = ""
@@ -475,11 +1142,17 @@ def mostrar_aprobacion():
             st.session_state.etapa = "inicio"
 
 # Interfaz de usuario principal
+# Tras recargar la página, reanudar la ejecución indicada en la URL
+if st.session_state.etapa == "inicio" and st.session_state.ejecucion is None and "ejecucion" in st.query_params:
+    if not restaurar_ejecucion(st.query_params["ejecucion"]):
+        st.query_params.pop("ejecucion", None)
+
 st.write(f"**Etapa actual:** {st.session_state.etapa}")  # Información de depuración
 
 if st.session_state.etapa == "inicio":
     st.header("Generación de Elementos Iniciales")
     theme = st.text_input("Ingrese el tema para su thriller político:", "")
+    mostrar_especulacion()
 
     if st.button("Generar Elementos Iniciales"):
         if not theme:
@@ -505,16 +1178,50 @@ if st.session_state.etapa == "aprobacion":
     mostrar_aprobacion()
 
 if st.session_state.etapa == "generacion":
-    with st.spinner("Generando la novela completa..."):
-        novela_completa = generar_novela_completa(num_capitulos, num_escenas)
-        if novela_completa:
-            st.session_state.etapa = "completado"
+    st.header("Generando la novela completa")
+    trabajo = obtener_gestor().obtener(st.session_state.ejecucion)
+    if trabajo is None:
+        # El servidor se reinició o la página se recargó sin trabajo activo: reanudar la ejecución
+        enviar_generacion()
+        trabajo = obtener_gestor().obtener(st.session_state.ejecucion)
+    mostrar_trabajo(trabajo)
+    if trabajo.activo():
+        mostrar_descarga_parcial(st.session_state.ejecucion)
+    sondear(trabajo)
+    if trabajo.estado == COMPLETADO and trabajo.resultado["novela"]:
+        st.session_state.novela_completa = trabajo.resultado["novela"]
+        st.session_state.telemetria = trabajo.resultado["telemetria"]
+        st.session_state.etapa = "completado"
+    else:
+        if trabajo.resultado:
+            st.session_state.telemetria = trabajo.resultado["telemetria"]
+        st.session_state.etapa = "interrumpida"
+    st.rerun()
+
+if st.session_state.etapa == "interrumpida":
+    st.warning("La generación de la novela se interrumpió. Las escenas terminadas están guardadas.")
+    trabajo = obtener_gestor().obtener(st.session_state.ejecucion)
+    if trabajo is not None:
+        mostrar_trabajo(trabajo)
+    mostrar_descarga_parcial(st.session_state.ejecucion)
+    if st.button("Reanudar la generación"):
+        enviar_generacion()
+        st.session_state.etapa = "generacion"
+        st.rerun()
+
+if st.session_state.get("telemetria"):
+    st.caption(f"Telemetría de la generación: {formatear_resumen(st.session_state.telemetria)}")
 
 if st.session_state.etapa == "completado":
     if st.session_state.novela_completa:
         st.success("Novela generada con éxito.")
-        # Exportar a Word
-        doc_buffer = exportar_a_word(st.session_state.titulo, st.session_state.novela_completa)
+        mostrar_estadisticas(st.session_state.ejecucion, st.session_state.novela_completa)
+        mostrar_regeneracion()
+        # Exportar a Word; el trabajo deja publicado el documento escrito durante la generación, que
+        # solo se reconstruye si cambian el título o el texto (por ejemplo, al regenerar una escena)
+        novela_completa = st.session_state.novela_completa
+        doc_buffer = artefacto("novela_docx", lambda: exportar_a_word(st.session_state.titulo, novela_completa),
+                               st.session_state.titulo, novela_completa.texto())
         st.download_button(
             label="Descargar Novela en Word",
             data=doc_buffer,
@@ -522,7 +1229,7 @@ if st.session_state.etapa == "completado":
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
         # Mostrar la novela en la interfaz
-        st.text_area("Novela Generada:", st.session_state.novela_completa, height=600)
+        st.text_area("Novela Generada:", st.session_state.novela_completa.texto(), height=600)
         st.info("Después de descargar el documento en Word, abre el archivo y actualiza la tabla de contenidos:")
         st.markdown("""
 1. Selecciona la tabla de contenidos.
@@ -0,0 +1,104 @@
+"""
+Plazos por trabajo y estadísticas de latencia para las llamadas a la API.
+
+Un trabajo (una novela, un libro, un análisis) abre un plazo con
+`plazo_trabajo(segundos)`; cada llamada hecha dentro de él recibe como timeout
+el tiempo que queda, de modo que una conexión bloqueada no detiene la
+ejecución completa. `RegistroLatencias` guarda las latencias recientes por
+proveedor y modelo para decidir cuándo lanzar una petición de cobertura.
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+
+_plazo_actual = contextvars.ContextVar("plazo_actual", default=None)
+
+
+class PlazoExcedido(requests.exceptions.Timeout):
+    """El trabajo ha agotado su plazo antes de poder enviar o completar la llamada."""
+
+
+class Plazo:
+    """
+    Tiempo límite absoluto de un trabajo.
+
+    Parámetros:
+        segundos (float): Duración total del plazo desde su creación.
+    """
+
+    def __init__(self, segundos):
+        self.segundos = segundos
+        self.limite = time.monotonic() + segundos
+
+    def restante(self):
+        return max(0.0, self.limite - time.monotonic())
+
+    def expirado(self):
+        return self.restante() <= 0
+
+    def timeout(self, timeout=None):
+        """
+        Ajusta un timeout de `requests` (número o tupla conexión/lectura) al tiempo restante.
+
+        Lanza:
+            PlazoExcedido: Si el plazo ya ha expirado.
+        """
+        restante = self.restante()
+        if restante <= 0:
+            raise PlazoExcedido(f"Se agotó el plazo de {self.segundos:.0f} s del trabajo.")
+        if timeout is None:
+            return restante
+        if isinstance(timeout, tuple):
+            return tuple(min(t, restante) if t is not None else restante for t in timeout)
+        return min(timeout, restante)
+
+
+@contextmanager
+def plazo_trabajo(segundos):
+    """Abre un plazo para todas las llamadas hechas dentro del bloque `with`."""
+    token = _plazo_actual.set(Plazo(segundos))
+    try:
+        yield _plazo_actual.get()
+    finally:
+        _plazo_actual.reset(token)
+
+
+def plazo_actual():
+    """Devuelve el plazo activo en el contexto actual o None."""
+    return _plazo_actual.get()
+
+
+class RegistroLatencias:
+    """
+    Latencias recientes por clave (proveedor, modelo) para calcular percentiles.
+
+    Parámetros:
+        ventana (int): Número de muestras que se conservan por clave.
+        minimo_muestras (int): Muestras necesarias antes de ofrecer un percentil.
+    """
+
+    def __init__(self, ventana=200, minimo_muestras=20):
+        self.ventana = ventana
+        self.minimo_muestras = minimo_muestras
+        self._muestras = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, clave, segundos):
+        with self._lock:
+            self._muestras.setdefault(clave, deque(maxlen=self.ventana)).append(segundos)
+
+    def percentil(self, clave, fraccion=0.95):
+        """Devuelve el percentil pedido o None si aún no hay muestras suficientes."""
+        with self._lock:
+            muestras = sorted(self._muestras.get(clave, ()))
+        if len(muestras) < self.minimo_muestras:
+            return None
+        return muestras[min(len(muestras) - 1, int(fraccion * len(muestras)))]
+
+
+latencias = RegistroLatencias()
@@ -0,0 +1,80 @@
+"""
+Presupuesto de palabras de una novela repartido entre sus escenas.
+
+Cada escena recibe un objetivo de palabras de trama principal y de subtramas.
+A medida que se terminan escenas, el presupuesto que queda se reparte de nuevo
+entre las que aún no se han pedido, y el sesgo del modelo (palabras producidas
+/ pedidas) se estima con una media móvil exponencial para corregir lo que se
+le pide a las siguientes.
+"""
+
+import random
+
+# Extensión total de la novela y mínimos por escena (trama principal, subtramas)
+PALABRAS_NOVELA = 60000
+MINIMO_PALABRAS_TRAMA = 350
+MINIMO_PALABRAS_SUBTRAMAS = 175
+# Variación aleatoria de cada escena respecto al reparto uniforme (trama principal, subtramas)
+VARIACION_TRAMA = 75
+VARIACION_SUBTRAMAS = 45
+# Peso de cada escena en la estimación del sesgo del modelo (palabras producidas / pedidas),
+# límites del sesgo y del ajuste de las escenas pendientes en cada paso
+ALFA_SESGO = 0.3
+LIMITES_SESGO = (0.5, 2.0)
+LIMITES_AJUSTE = (0.5, 1.5)
+
+
+def repartir_palabras(total_escenas, porcentaje_trama_principal, total=PALABRAS_NOVELA):
+    """Reparte `total` palabras entre las escenas.
+
+    Devuelve una lista de pares [palabras de trama principal, palabras de
+    subtramas], una por escena, con una variación aleatoria alrededor del
+    reparto uniforme y los mínimos por escena.
+    """
+    palabras_trama_total = int(total * (porcentaje_trama_principal / 100))
+    palabras_subtramas_total = total - palabras_trama_total
+
+    por_escena_trama, restantes_trama = divmod(palabras_trama_total, total_escenas)
+    por_escena_subtramas, restantes_subtramas = divmod(palabras_subtramas_total, total_escenas)
+
+    palabras = []
+    for _ in range(total_escenas):
+        palabras_trama = por_escena_trama + random.randint(-VARIACION_TRAMA, VARIACION_TRAMA)
+        palabras_subtramas = por_escena_subtramas + random.randint(-VARIACION_SUBTRAMAS, VARIACION_SUBTRAMAS)
+        palabras.append([max(MINIMO_PALABRAS_TRAMA, palabras_trama),
+                         max(MINIMO_PALABRAS_SUBTRAMAS, palabras_subtramas)])
+
+    # Repartir el resto de la división entre las primeras escenas
+    for i in range(restantes_trama):
+        palabras[i % total_escenas][0] += 1
+    for i in range(restantes_subtramas):
+        palabras[i % total_escenas][1] += 1
+    return palabras
+
+
+def redistribuir_palabras(palabras, reales, en_curso, por_pedir, total=PALABRAS_NOVELA):
+    """Reparte el presupuesto de palabras restante entre las escenas que aún no se han pedido.
+
+    `palabras` es la lista de pares [trama, subtramas] objetivo por escena y se
+    modifica en su lugar; `reales` son las palabras producidas por índice de
+    escena, `en_curso` los índices pedidos sin terminar y `por_pedir` los que
+    se van a reescalar. Retorna la proyección del total: palabras reales más
+    los objetivos de las escenas sin terminar.
+    """
+    comprometido = sum(reales.values()) + sum(sum(palabras[i]) for i in en_curso)
+    asignado = sum(sum(palabras[i]) for i in por_pedir)
+    if asignado:
+        # Escalar los objetivos pendientes conservando sus proporciones y el reparto trama/subtramas
+        ajuste = min(max((total - comprometido) / asignado, LIMITES_AJUSTE[0]), LIMITES_AJUSTE[1])
+        for i in por_pedir:
+            palabras_trama, palabras_subtramas = palabras[i]
+            palabras[i] = [max(MINIMO_PALABRAS_TRAMA, round(palabras_trama * ajuste)),
+                           max(MINIMO_PALABRAS_SUBTRAMAS, round(palabras_subtramas * ajuste))]
+    return comprometido + sum(sum(palabras[i]) for i in por_pedir)
+
+
+def actualizar_sesgo(sesgo, producidas, pedidas):
+    """Actualiza el sesgo del modelo (palabras producidas / pedidas) con una escena terminada."""
+    observado = producidas / pedidas if pedidas else 1.0
+    sesgo = (1 - ALFA_SESGO) * sesgo + ALFA_SESGO * observado
+    return min(max(sesgo, LIMITES_SESGO[0]), LIMITES_SESGO[1])
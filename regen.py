@@ -1,10 +1,11 @@
 import streamlit as st
 import requests
-import time
-import re
 from io import StringIO, BytesIO
 from docx import Document
 
+from cliente_llm import OPENROUTER_URL, chat_completion
+from manuscrito import Manuscrito
+
 st.set_page_config(
     page_title="Regenerador de Novelas",
     layout="wide",
@@ -16,17 +17,12 @@ st.write("""
     Sube tu novela en formato `.txt` o `.docx`, proporciona análisis y recomendaciones, y la aplicación regenerará tu novela capítulo por capítulo.
 """)
 
+# Divide la novela en capítulos con el modelo de manuscrito (manuscrito.py)
 def split_into_chapters(text):
-    chapters = re.split(r'(Capítulo\s+\d+|Chapter\s+\d+)', text, flags=re.IGNORECASE)
-    combined = []
-    for i in range(1, len(chapters), 2):
-        title = chapters[i]
-        content = chapters[i+1] if i+1 < len(chapters) else ""
-        combined.append(f"{title}\n{content}")
-    return combined
+    return Manuscrito.desde_texto(text).capitulos
 
 def call_openrouter_api(prompt):
-    api_url = "https://openrouter.ai/api/v1/chat/completions"
+    api_url = OPENROUTER_URL
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {st.secrets['OPENROUTER_API_KEY']}",
@@ -40,11 +36,11 @@ def call_openrouter_api(prompt):
             }
         ]
     }
-    response = requests.post(api_url, headers=headers, json=payload)
-    if response.status_code == 200:
-        return response.json()['choices'][0]['message']['content']
-    else:
-        st.error(f"Error en la API: {response.status_code} - {response.text}")
+    try:
+        # Caché persistente: regenerar el mismo capítulo con el mismo análisis no repite la llamada
+        return chat_completion(api_url, headers, payload, usar_cache=True)['choices'][0]['message']['content']
+    except requests.exceptions.HTTPError as e:
+        st.error(f"Error en la API: {e.response.status_code} - {e.response.text}")
         return None
 
 def extract_text_from_docx(file):
@@ -54,10 +50,11 @@ def extract_text_from_docx(file):
         full_text.append(para.text)
     return '\n'.join(full_text)
 
-def create_docx(text):
+def create_docx(manuscrito):
     doc = Document()
-    for line in text.split('\n\n'):
-        doc.add_paragraph(line)
+    for _, escena in manuscrito.escenas():
+        for line in escena.texto.split('\n\n'):
+            doc.add_paragraph(line)
     buf = BytesIO()
     doc.save(buf)
     buf.seek(0)
@@ -86,30 +83,29 @@ if submit_button:
             progress_bar = st.progress(0)
             progress_text = st.empty()
 
-            regenerated_chapters = []
+            regenerated = Manuscrito()
             for idx, chapter in enumerate(chapters, 1):
                 progress_text.text(f"Regenerando capítulo {idx} de {num_chapters}...")
                 prompt = f"""
 Aquí está el capítulo {idx} de mi novela:
 
-{chapter}
+{chapter.texto()}
 
 Basándote en el siguiente análisis y recomendaciones, regenera este capítulo mejorándolo sin agregar comentarios o explicaciones adicionales:
 
 {analysis}
 """
-                regenerated = call_openrouter_api(prompt)
-                if regenerated:
-                    regenerated_chapters.append(regenerated.strip())
+                regenerated_chapter = call_openrouter_api(prompt)
+                if regenerated_chapter:
+                    regenerated.agregar_escena(regenerated.agregar_capitulo(numero=chapter.numero), regenerated_chapter.strip())
                 else:
                     st.error("Hubo un problema al regenerar el capítulo. El proceso se detendrá.")
                     break
                 progress_bar.progress(idx / num_chapters)
-                time.sleep(1)
 
-            if len(regenerated_chapters) == num_chapters:
-                st.success("Novela regenerada con éxito.")
-                regenerated_novel = "\n\n".join(regenerated_chapters)
+            if len(regenerated.capitulos) == num_chapters:
+                st.success(f"Novela regenerada con éxito ({regenerated.palabras} palabras).")
+                regenerated_novel = regenerated.texto()
                 
                 st.markdown("### Novela Regenerada")
                 with st.expander("Ver Novela Regenerada"):
@@ -122,7 +118,7 @@ Basándote en el siguiente análisis y recomendaciones, regenera este capítulo
                     mime="text/plain"
                 )
 
-                docx_file = create_docx(regenerated_novel)
+                docx_file = create_docx(regenerated)
                 st.download_button(
                     label="Descargar Novela Regenerada (.docx)",
                     data=docx_file,
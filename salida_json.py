@@ -0,0 +1,213 @@
+"""
+Salida estructurada de los modelos: esquemas JSON, analizador con validación y reparación.
+
+Las respuestas que el código tiene que descomponer (la estructura de una
+novela, un plan de escenas, los momentos clave de una fábula...) se piden en
+modo JSON con un esquema (`response_format`) en lugar de extraerse del texto
+libre con expresiones regulares. La respuesta se analiza en tiempo lineal
+(sin retroceso) y se valida contra el esquema; si no lo cumple, se hace una
+única pasada de reparación barata que solo envía la respuesta defectuosa, los
+errores y el esquema, en lugar de repetir la petición original completa.
+
+Cada análisis deja un registro de telemetría (`analisis`) con el nombre del
+analizador, si la primera respuesta falló y si la reparación la recuperó, de
+modo que el resumen de un trabajo muestra la tasa de fallos de formato.
+"""
+
+import json
+import re
+
+from telemetria import registrar_analisis
+
+# Candidatos de inicio de JSON que se prueban como máximo en una respuesta con texto alrededor
+MAX_CANDIDATOS = 4
+# Caracteres de la respuesta defectuosa que se envían en la reparación
+MAX_CARACTERES_REPARACION = 12000
+
+_INICIO_JSON = re.compile(r"[\[{]")
+
+TEXTO = {"type": "string"}
+ENTERO = {"type": "integer"}
+
+_TIPOS = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+class RespuestaNoValida(ValueError):
+    """La respuesta no contiene JSON o no cumple el esquema; `errores` detalla por qué."""
+
+    def __init__(self, errores):
+        self.errores = errores
+        super().__init__("; ".join(errores))
+
+
+def objeto(**propiedades):
+    """Esquema de un objeto con todas las `propiedades` obligatorias y sin propiedades adicionales."""
+    return {
+        "type": "object",
+        "properties": propiedades,
+        "required": list(propiedades),
+        "additionalProperties": False,
+    }
+
+
+def lista(elementos):
+    """Esquema de una lista cuyos elementos cumplen el esquema `elementos`."""
+    return {"type": "array", "items": elementos}
+
+
+def formato_json(nombre, esquema, proveedor="openrouter"):
+    """
+    Devuelve el campo `response_format` que pide una respuesta conforme a `esquema`.
+
+    OpenRouter (y OpenAI) reciben el esquema estricto `json_schema`; Together,
+    el modo JSON con esquema (`json_object` + `schema`).
+    """
+    if proveedor == "together":
+        return {"type": "json_object", "schema": esquema}
+    return {"type": "json_schema", "json_schema": {"name": nombre, "strict": True, "schema": esquema}}
+
+
+def adaptar_formato(formato, proveedor):
+    """Traduce un `response_format` de `formato_json` al formato que acepta `proveedor`."""
+    if formato and formato.get("type") == "json_schema":
+        return formato_json(formato["json_schema"]["name"], formato["json_schema"]["schema"], proveedor)
+    if formato and formato.get("type") == "json_object" and proveedor != "together":
+        return formato_json("respuesta", formato["schema"], proveedor) if formato.get("schema") else formato
+    return formato
+
+
+def extraer_json(texto):
+    """
+    Decodifica el valor JSON de una respuesta.
+
+    Con salida estructurada la respuesta es JSON puro; si no, se admite texto o
+    un bloque ```json alrededor y se prueba desde cada `{` o `[` (como máximo
+    `MAX_CANDIDATOS`), así que el coste es lineal en la longitud de la respuesta.
+
+    Lanza:
+        RespuestaNoValida: Si la respuesta no contiene un valor JSON.
+    """
+    texto = (texto or "").strip()
+    try:
+        return json.loads(texto)
+    except (ValueError, RecursionError):
+        pass
+    decodificador = json.JSONDecoder()
+    for intento, inicio in enumerate(_INICIO_JSON.finditer(texto)):
+        if intento >= MAX_CANDIDATOS:
+            break
+        try:
+            valor, _ = decodificador.raw_decode(texto, inicio.start())
+        except (ValueError, RecursionError):
+            continue
+        return valor
+    raise RespuestaNoValida(["la respuesta no contiene JSON válido"])
+
+
+def validar(valor, esquema, ruta="$"):
+    """
+    Comprueba `valor` contra `esquema` (type, properties, required, items, enum, minItems).
+
+    Retorna:
+        list: Errores encontrados, con la ruta de cada uno; vacía si el valor es válido.
+    """
+    errores = []
+    tipo = esquema.get("type")
+    if tipo:
+        esperado = _TIPOS[tipo]
+        # bool es subclase de int: no se acepta como número
+        if not isinstance(valor, esperado) or (isinstance(valor, bool) and tipo != "boolean"):
+            return [f"{ruta}: se esperaba {tipo}, se recibió {type(valor).__name__}"]
+    if "enum" in esquema and valor not in esquema["enum"]:
+        errores.append(f"{ruta}: valor no permitido {valor!r}")
+    if isinstance(valor, dict):
+        for clave in esquema.get("required", []):
+            if clave not in valor:
+                errores.append(f"{ruta}: falta la propiedad '{clave}'")
+        for clave, subesquema in esquema.get("properties", {}).items():
+            if clave in valor:
+                errores.extend(validar(valor[clave], subesquema, f"{ruta}.{clave}"))
+    if isinstance(valor, list):
+        if len(valor) < esquema.get("minItems", 0):
+            errores.append(f"{ruta}: se esperaban al menos {esquema['minItems']} elementos")
+        if "items" in esquema:
+            for i, elemento in enumerate(valor):
+                errores.extend(validar(elemento, esquema["items"], f"{ruta}[{i}]"))
+    return errores
+
+
+def analizar(texto, esquema):
+    """
+    Extrae y valida el JSON de una respuesta.
+
+    Lanza:
+        RespuestaNoValida: Si no hay JSON o no cumple el esquema.
+    """
+    valor = extraer_json(texto)
+    errores = validar(valor, esquema)
+    if errores:
+        raise RespuestaNoValida(errores[:10])
+    return valor
+
+
+def prompt_reparacion(texto, esquema, errores):
+    """Prompt de la pasada de reparación: la respuesta defectuosa, sus errores y el esquema."""
+    return f"""
+La siguiente respuesta debía ser un JSON conforme al esquema indicado, pero no lo es.
+
+### Errores:
+{chr(10).join(f"- {error}" for error in errores)}
+
+### Esquema:
+{json.dumps(esquema, ensure_ascii=False)}
+
+### Respuesta:
+{texto[:MAX_CARACTERES_REPARACION]}
+
+Corrige la respuesta conservando todo su contenido y responde únicamente con el JSON corregido, sin texto adicional.
+"""
+
+
+def pedir_json(llamar, prompt, esquema, nombre, reparar=None):
+    """
+    Pide una respuesta JSON conforme a `esquema` y la analiza, con una única reparación.
+
+    Parámetros:
+        llamar (callable): `llamar(prompt, formato)` hace la petición con
+            `response_format=formato` y devuelve el texto de la respuesta (o None si falla).
+        prompt (str): Prompt original.
+        esquema (dict): Esquema JSON de la respuesta.
+        nombre (str): Nombre del analizador, para el formato y la telemetría.
+        reparar (callable): Igual que `llamar`, para la pasada de reparación
+            (p. ej. con temperatura 0 o un modelo más barato); por defecto, `llamar`.
+
+    Retorna:
+        El valor JSON validado, o None si no hubo respuesta o no pudo repararse.
+    """
+    formato = formato_json(nombre, esquema)
+    texto = llamar(prompt, formato)
+    if texto is None:
+        return None
+    try:
+        valor = analizar(texto, esquema)
+    except RespuestaNoValida as e:
+        errores = e.errores
+    else:
+        registrar_analisis(nombre, fallo=False)
+        return valor
+
+    reparada = (reparar or llamar)(prompt_reparacion(texto, esquema, errores), formato)
+    try:
+        valor = analizar(reparada, esquema) if reparada is not None else None
+    except RespuestaNoValida as e:
+        errores = errores + [f"reparación: {error}" for error in e.errores]
+        valor = None
+    registrar_analisis(nombre, fallo=True, reparado=valor is not None, errores=errores[:5])
+    return valor
@@ -0,0 +1,340 @@
+"""
+Servidor local que simula OpenRouter y Together para pruebas sin claves.
+
+Implementa `/api/v1/chat/completions` (OpenRouter), `/v1/chat/completions`
+y `/v1/images/generations` (Together) con latencia, velocidad de tokens,
+errores inyectados (429/5xx/timeouts) y streaming configurables. Las
+peticiones con `response_format` JSON reciben un JSON conforme a su esquema.
+En modo `grabar` reenvía cada petición al proveedor real y guarda la
+respuesta en un cassette JSONL; en modo `reproducir` responde de forma
+determinista desde él.
+
+Uso:
+    python servidor_simulado.py --puerto 8765 --latencia 0.5 --tokens-por-segundo 80
+    python servidor_simulado.py --modo grabar --cassette cassettes/novela.jsonl
+    python servidor_simulado.py --modo reproducir --cassette cassettes/novela.jsonl
+
+Para que las aplicaciones usen el servidor:
+    export LLM_OPENROUTER_BASE=http://127.0.0.1:8765
+    export LLM_TOGETHER_BASE=http://127.0.0.1:8765
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+RUTA_OPENROUTER = "/api/v1/chat/completions"
+RUTA_TOGETHER = "/v1/chat/completions"
+RUTA_IMAGENES = "/v1/images/generations"
+
+# Destino real de cada ruta en modo grabar
+PROVEEDORES_REALES = {
+    RUTA_OPENROUTER: "https://openrouter.ai" + RUTA_OPENROUTER,
+    RUTA_TOGETHER: "https://api.together.xyz" + RUTA_TOGETHER,
+    RUTA_IMAGENES: "https://api.together.xyz" + RUTA_IMAGENES,
+}
+
+# PNG de 1x1 píxel para las respuestas de imágenes simuladas
+PNG_1X1_B64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+PALABRAS_SIMULADAS = (
+    "la noche cayó sobre el palacio mientras el ministro repasaba los informes secretos "
+    "y nadie en la sala se atrevía a romper el silencio"
+).split()
+
+
+def clave_peticion(ruta, payload):
+    """Clave determinista de una petición: ruta más payload canónico (sin `stream`)."""
+    relevante = {k: v for k, v in payload.items() if k != "stream"}
+    canonico = json.dumps([ruta, relevante], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """Respuestas grabadas en un archivo JSONL, indexadas por clave de petición."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.respuestas = {}
+        self._lock = threading.Lock()
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                for linea in f:
+                    if linea.strip():
+                        registro = json.loads(linea)
+                        self.respuestas[registro["clave"]] = registro["respuesta"]
+
+    def obtener(self, clave):
+        return self.respuestas.get(clave)
+
+    def grabar(self, clave, respuesta):
+        with self._lock:
+            self.respuestas[clave] = respuesta
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            with open(self.ruta, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"clave": clave, "respuesta": respuesta}, ensure_ascii=False) + "\n")
+
+
+def texto_simulado(payload, semilla):
+    """Genera un texto determinista de longitud acorde a `max_tokens`."""
+    generador = random.Random(semilla)
+    num_palabras = max(20, int(payload.get("max_tokens") or 400) // 2)
+    return " ".join(generador.choice(PALABRAS_SIMULADAS) for _ in range(num_palabras)).capitalize() + "."
+
+
+def esquema_peticion(payload):
+    """
+    Devuelve el esquema JSON que pide `response_format`, {} si pide JSON sin
+    esquema, o None si la respuesta es texto libre.
+    """
+    formato = payload.get("response_format") or {}
+    if formato.get("type") == "json_schema":
+        return (formato.get("json_schema") or {}).get("schema") or {}
+    if formato.get("type") == "json_object":
+        return formato.get("schema") or {}
+    return None
+
+
+def valor_simulado(esquema, generador):
+    """Genera un valor aleatorio (con `generador`) conforme a `esquema`."""
+    if "enum" in esquema:
+        return generador.choice(esquema["enum"])
+    tipo = esquema.get("type")
+    if tipo == "object" or (tipo is None and "properties" in esquema):
+        return {clave: valor_simulado(subesquema, generador) for clave, subesquema in esquema.get("properties", {}).items()}
+    if tipo == "array":
+        elementos = max(esquema.get("minItems", 0), generador.randint(2, 4))
+        return [valor_simulado(esquema.get("items", {}), generador) for _ in range(elementos)]
+    if tipo == "integer":
+        return generador.randint(1, 5)
+    if tipo == "number":
+        return round(generador.uniform(1, 10), 2)
+    if tipo == "boolean":
+        return generador.random() < 0.5
+    return " ".join(generador.choice(PALABRAS_SIMULADAS) for _ in range(generador.randint(6, 16))).capitalize() + "."
+
+
+def json_simulado(esquema, semilla):
+    """Genera una respuesta JSON determinista conforme a `esquema` (un objeto con texto si no hay esquema)."""
+    if not esquema:
+        esquema = {"type": "object", "properties": {"texto": {"type": "string"}}}
+    return json.dumps(valor_simulado(esquema, random.Random(semilla)), ensure_ascii=False)
+
+
+def respuesta_chat(payload, contenido, finish_reason="stop"):
+    tokens_prompt = sum(len((m.get("content") or "").split()) for m in payload.get("messages", []))
+    tokens_salida = len(contenido.split())
+    return {
+        "id": "simulado-" + hashlib.md5(contenido.encode("utf-8")).hexdigest()[:12],
+        "object": "chat.completion",
+        "model": payload.get("model", "simulado"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": contenido},
+            "finish_reason": finish_reason,
+        }],
+        "usage": {
+            "prompt_tokens": tokens_prompt,
+            "completion_tokens": tokens_salida,
+            "total_tokens": tokens_prompt + tokens_salida,
+        },
+    }
+
+
+def respuesta_imagenes(payload):
+    return {"data": [{"b64_json": PNG_1X1_B64} for _ in range(int(payload.get("n") or 1))]}
+
+
+class ManejadorSimulado(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+    cassette = None
+
+    def log_message(self, formato, *args):
+        if self.config.verboso:
+            super().log_message(formato, *args)
+
+    def _enviar_json(self, estado, cuerpo, cabeceras=None):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _inyectar_error(self):
+        """Devuelve True si se ha inyectado un error y la petición ya está respondida."""
+        config = self.config
+        azar = random.random()
+        if azar < config.tasa_429:
+            self._enviar_json(429, {"error": {"message": "Rate limit simulado", "code": 429}},
+                              {"Retry-After": str(config.retry_after)})
+            return True
+        azar -= config.tasa_429
+        if azar < config.tasa_5xx:
+            self._enviar_json(random.choice([500, 502, 503]), {"error": {"message": "Error simulado"}})
+            return True
+        azar -= config.tasa_5xx
+        if azar < config.tasa_timeout:
+            # Mantener la conexión abierta sin responder hasta que el cliente se rinda
+            time.sleep(config.duracion_timeout)
+            self.close_connection = True
+            return True
+        return False
+
+    def _enviar_stream(self, respuesta):
+        contenido = respuesta["choices"][0]["message"]["content"]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        self.wfile.write(b": SIMULADO PROCESSING\n\n")
+        pausa = 1.0 / self.config.tokens_por_segundo if self.config.tokens_por_segundo > 0 else 0
+        palabras = contenido.split(" ")
+        for indice, palabra in enumerate(palabras):
+            fragmento = palabra if indice == 0 else " " + palabra
+            evento = {"choices": [{"index": 0, "delta": {"content": fragmento}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(evento, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if pausa:
+                time.sleep(pausa)
+        final = {
+            "choices": [{"index": 0, "delta": {}, "finish_reason": respuesta["choices"][0].get("finish_reason")}],
+            "usage": respuesta.get("usage"),
+        }
+        self.wfile.write(f"data: {json.dumps(final, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _respuesta_real(self, ruta, payload):
+        """Reenvía la petición al proveedor real (modo grabar)."""
+        cabeceras = {"Content-Type": "application/json"}
+        if self.headers.get("Authorization"):
+            cabeceras["Authorization"] = self.headers["Authorization"]
+        response = requests.post(PROVEEDORES_REALES[ruta], headers=cabeceras,
+                                 json=dict(payload, stream=False), timeout=600)
+        response.raise_for_status()
+        return response.json()
+
+    def do_POST(self):
+        ruta = self.path.split("?", 1)[0]
+        if ruta not in PROVEEDORES_REALES:
+            self._enviar_json(404, {"error": {"message": f"Ruta desconocida: {ruta}"}})
+            return
+        longitud = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(longitud) or b"{}")
+        except json.JSONDecodeError:
+            self._enviar_json(400, {"error": {"message": "JSON inválido"}})
+            return
+
+        config = self.config
+        clave = clave_peticion(ruta, payload)
+        if config.modo == "simular" and self._inyectar_error():
+            return
+        if config.latencia:
+            time.sleep(config.latencia)
+
+        if config.modo == "reproducir":
+            respuesta = self.cassette.obtener(clave)
+            if respuesta is None:
+                self._enviar_json(404, {"error": {"message": "Petición no grabada en el cassette"}})
+                return
+        elif config.modo == "grabar":
+            respuesta = self.cassette.obtener(clave)
+            if respuesta is None:
+                try:
+                    respuesta = self._respuesta_real(ruta, payload)
+                except requests.exceptions.RequestException as e:
+                    self._enviar_json(502, {"error": {"message": f"Error del proveedor real: {e}"}})
+                    return
+                self.cassette.grabar(clave, respuesta)
+        elif ruta == RUTA_IMAGENES:
+            respuesta = respuesta_imagenes(payload)
+        else:
+            esquema = esquema_peticion(payload)
+            if esquema is None:
+                respuesta = respuesta_chat(payload, texto_simulado(payload, clave))
+            else:
+                respuesta = respuesta_chat(payload, json_simulado(esquema, clave))
+
+        if ruta != RUTA_IMAGENES and payload.get("stream"):
+            self._enviar_stream(respuesta)
+            return
+        if ruta != RUTA_IMAGENES and config.modo == "simular" and config.tokens_por_segundo > 0:
+            tokens = respuesta.get("usage", {}).get("completion_tokens", 0)
+            time.sleep(tokens / config.tokens_por_segundo)
+        self._enviar_json(200, respuesta)
+
+
+def crear_servidor(puerto=8765, modo="simular", cassette=None, latencia=0.0, tokens_por_segundo=0.0,
+                   tasa_429=0.0, tasa_5xx=0.0, tasa_timeout=0.0, retry_after=1, duracion_timeout=30.0,
+                   verboso=False, host="127.0.0.1"):
+    """
+    Crea (sin arrancar) un servidor simulado; útil para pruebas y benchmarks.
+
+    Retorna:
+        ThreadingHTTPServer: Servidor listo para `serve_forever()`.
+    """
+    if modo in ("grabar", "reproducir") and not cassette:
+        raise ValueError(f"El modo '{modo}' necesita un cassette.")
+    config = argparse.Namespace(
+        modo=modo, latencia=latencia, tokens_por_segundo=tokens_por_segundo, tasa_429=tasa_429,
+        tasa_5xx=tasa_5xx, tasa_timeout=tasa_timeout, retry_after=retry_after,
+        duracion_timeout=duracion_timeout, verboso=verboso,
+    )
+    manejador = type("Manejador", (ManejadorSimulado,), {
+        "config": config,
+        "cassette": Cassette(cassette) if cassette else None,
+    })
+    return ThreadingHTTPServer((host, puerto), manejador)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor simulado de OpenRouter/Together.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--modo", choices=["simular", "grabar", "reproducir"], default="simular")
+    parser.add_argument("--cassette", help="Archivo JSONL para grabar o reproducir respuestas.")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos hasta el primer byte.")
+    parser.add_argument("--tokens-por-segundo", type=float, default=0.0, help="Velocidad de generación simulada.")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="Probabilidad de responder 429.")
+    parser.add_argument("--tasa-5xx", type=float, default=0.0, help="Probabilidad de responder 5xx.")
+    parser.add_argument("--tasa-timeout", type=float, default=0.0, help="Probabilidad de no responder.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Valor de Retry-After en los 429.")
+    parser.add_argument("--duracion-timeout", type=float, default=30.0)
+    parser.add_argument("--verboso", action="store_true")
+    args = parser.parse_args()
+
+    servidor = crear_servidor(
+        puerto=args.puerto, modo=args.modo, cassette=args.cassette, latencia=args.latencia,
+        tokens_por_segundo=args.tokens_por_segundo, tasa_429=args.tasa_429, tasa_5xx=args.tasa_5xx,
+        tasa_timeout=args.tasa_timeout, retry_after=args.retry_after,
+        duracion_timeout=args.duracion_timeout, verboso=args.verboso, host=args.host,
+    )
+    print(f"Servidor simulado ({args.modo}) en http://{args.host}:{args.puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
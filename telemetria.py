@@ -0,0 +1,385 @@
+"""
+Telemetría por llamada a la API: latencia, tokens, coste y reintentos.
+
+Cada petición de chat o de imagen deja un registro con la duración total, el
+tiempo hasta el primer byte, los tokens de prompt y de salida (del campo
+`usage`), el coste estimado, los reintentos y el estado. Los registros se
+añaden a un fichero JSONL y, si hay un trabajo abierto con
+`trabajo_telemetria(nombre)`, también se acumulan en él para mostrar un
+resumen al terminar (una novela, un libro, un análisis).
+
+Las respuestas JSON analizadas con `salida_json` dejan además registros de
+análisis (campo `analisis`), que no cuentan como llamadas: el resumen los
+agrega por analizador para seguir la tasa de fallos de formato.
+
+Las llamadas hechas dentro de `tarea_telemetria(tarea)` (por ejemplo, las de
+`enrutador.chat_tarea`) llevan el campo `tarea`, y el resumen las agrega
+también por tarea (prosa, resumen, momentos clave...).
+
+Configuración mediante variables de entorno:
+    LLM_TELEMETRIA        Si vale 0, no se escriben registros en disco.
+    LLM_TELEMETRIA_RUTA   Fichero JSONL (por defecto .cache_llm/telemetria.jsonl).
+
+Uso desde la línea de órdenes, para resumir los trabajos registrados:
+    python telemetria.py [--ruta RUTA] [--ultimos N]
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+# Precio en dólares por millón de tokens (prompt, salida)
+PRECIOS_TOKENS = {
+    "openai/gpt-4o-mini": (0.15, 0.60),
+    "gpt-4": (30.0, 60.0),
+    "openai/gpt-4": (30.0, 60.0),
+    "qwen/qwen-2.5-72b-instruct": (0.35, 0.40),
+    "qwen/qwen-2.5-7b-instruct": (0.27, 0.27),
+    "Qwen/Qwen2.5-72B-Instruct-Turbo": (1.20, 1.20),
+    "Qwen/Qwen2.5-7B-Instruct-Turbo": (0.30, 0.30),
+    "meta-llama/Llama-3.3-70B-Instruct-Turbo": (0.88, 0.88),
+}
+# Precio en dólares por megapíxel generado
+PRECIOS_IMAGEN = {
+    "black-forest-labs/FLUX.1.1-pro": 0.04,
+    "black-forest-labs/FLUX.1-pro": 0.05,
+}
+
+RUTA_POR_DEFECTO = os.path.join(".cache_llm", "telemetria.jsonl")
+
+_trabajo_actual = contextvars.ContextVar("trabajo_telemetria", default=None)
+_tarea_actual = contextvars.ContextVar("tarea_telemetria", default=None)
+
+
+def coste_estimado(modelo, usage=None, payload=None):
+    """
+    Estima el coste en dólares de una llamada.
+
+    Para modelos de texto usa los tokens de `usage`; para modelos de imagen,
+    el número y tamaño de las imágenes pedidas en `payload`. Devuelve None si
+    el modelo no tiene precio conocido.
+    """
+    if modelo in PRECIOS_TOKENS and usage:
+        precio_prompt, precio_salida = PRECIOS_TOKENS[modelo]
+        return (
+            (usage.get("prompt_tokens") or 0) * precio_prompt
+            + (usage.get("completion_tokens") or 0) * precio_salida
+        ) / 1_000_000
+    if modelo in PRECIOS_IMAGEN and payload is not None:
+        megapixeles = (payload.get("width") or 1024) * (payload.get("height") or 768) / 1_000_000
+        return (payload.get("n") or 1) * megapixeles * PRECIOS_IMAGEN[modelo]
+    return None
+
+
+class Trabajo:
+    """
+    Registros acumulados de un trabajo (una novela, un libro, un análisis).
+
+    Parámetros:
+        nombre (str): Nombre descriptivo del trabajo.
+    """
+
+    def __init__(self, nombre):
+        self.id = uuid.uuid4().hex[:12]
+        self.nombre = nombre
+        self.inicio = time.monotonic()
+        self.fin = None
+        self.registros = []
+        self._lock = threading.Lock()
+
+    def agregar(self, registro):
+        with self._lock:
+            self.registros.append(registro)
+
+    def duracion(self):
+        return (self.fin or time.monotonic()) - self.inicio
+
+    def resumen(self):
+        """Devuelve el resumen del trabajo (ver `resumir_registros`)."""
+        with self._lock:
+            registros = list(self.registros)
+        return dict(resumir_registros(registros), trabajo=self.nombre, duracion=round(self.duracion(), 2))
+
+
+def resumir_registros(registros):
+    """
+    Agrega una lista de registros de telemetría.
+
+    Retorna:
+        dict: llamadas, segundos acumulados en llamadas, TTFB medio, tokens,
+            coste, reintentos, errores, aciertos de caché, desglose por modelo y
+            por tarea y respuestas JSON analizadas, fallidas y reparadas (total y
+            por analizador).
+    """
+    resumen = {
+        "llamadas": 0,
+        "segundos_llamadas": 0.0,
+        "ttfb_medio": None,
+        "tokens_prompt": 0,
+        "tokens_salida": 0,
+        "coste": 0.0,
+        "reintentos": 0,
+        "errores": 0,
+        "cache": 0,
+        "por_modelo": {},
+        "por_tarea": {},
+        "respuestas_json": 0,
+        "fallos_json": 0,
+        "reparadas_json": 0,
+        "por_analizador": {},
+    }
+    ttfbs = []
+    for registro in registros:
+        if registro.get("analisis"):
+            analizador = resumen["por_analizador"].setdefault(
+                registro["analisis"], {"respuestas": 0, "fallos": 0, "reparadas": 0}
+            )
+            analizador["respuestas"] += 1
+            resumen["respuestas_json"] += 1
+            if registro.get("fallo"):
+                analizador["fallos"] += 1
+                resumen["fallos_json"] += 1
+            if registro.get("reparado"):
+                analizador["reparadas"] += 1
+                resumen["reparadas_json"] += 1
+            continue
+        if registro.get("cache"):
+            resumen["cache"] += 1
+            continue
+        resumen["llamadas"] += 1
+        resumen["segundos_llamadas"] += registro.get("duracion") or 0.0
+        if registro.get("ttfb") is not None:
+            ttfbs.append(registro["ttfb"])
+        resumen["tokens_prompt"] += registro.get("tokens_prompt") or 0
+        resumen["tokens_salida"] += registro.get("tokens_salida") or 0
+        resumen["coste"] += registro.get("coste") or 0.0
+        resumen["reintentos"] += registro.get("reintentos") or 0
+        if registro.get("error") or not 200 <= (registro.get("estado") or 0) < 300:
+            resumen["errores"] += 1
+        modelo = resumen["por_modelo"].setdefault(
+            registro.get("modelo") or "desconocido", {"llamadas": 0, "segundos": 0.0, "coste": 0.0}
+        )
+        modelo["llamadas"] += 1
+        modelo["segundos"] += registro.get("duracion") or 0.0
+        modelo["coste"] += registro.get("coste") or 0.0
+        if registro.get("tarea"):
+            tarea = resumen["por_tarea"].setdefault(
+                registro["tarea"], {"llamadas": 0, "segundos": 0.0, "coste": 0.0, "modelos": []}
+            )
+            tarea["llamadas"] += 1
+            tarea["segundos"] += registro.get("duracion") or 0.0
+            tarea["coste"] += registro.get("coste") or 0.0
+            if registro.get("modelo") and registro["modelo"] not in tarea["modelos"]:
+                tarea["modelos"].append(registro["modelo"])
+    if ttfbs:
+        resumen["ttfb_medio"] = round(sum(ttfbs) / len(ttfbs), 3)
+    resumen["segundos_llamadas"] = round(resumen["segundos_llamadas"], 2)
+    resumen["coste"] = round(resumen["coste"], 6)
+    return resumen
+
+
+class RegistroTelemetria:
+    """
+    Destino JSONL de los registros de telemetría, seguro entre hilos.
+
+    Parámetros:
+        ruta (str): Fichero JSONL; None para no escribir en disco.
+    """
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        if ruta:
+            directorio = os.path.dirname(ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+
+    def registrar(self, usage=None, payload=None, **campos):
+        """
+        Completa el registro con el trabajo activo, la fecha, los tokens y el coste, y lo guarda.
+
+        Parámetros:
+            usage (dict): Campo `usage` de la respuesta, si lo hay.
+            payload (dict): Cuerpo de la petición, para estimar el coste de las imágenes.
+            **campos: proveedor, modelo, duracion, ttfb, estado, reintentos, error, cache...
+        """
+        trabajo = _trabajo_actual.get()
+        registro = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "trabajo": trabajo.nombre if trabajo else None,
+            "trabajo_id": trabajo.id if trabajo else None,
+        }
+        if _tarea_actual.get() and not campos.get("analisis"):
+            registro["tarea"] = _tarea_actual.get()
+        registro.update(campos)
+        if usage:
+            registro["tokens_prompt"] = usage.get("prompt_tokens")
+            registro["tokens_salida"] = usage.get("completion_tokens")
+        if not registro.get("cache") and not registro.get("analisis"):
+            registro["coste"] = coste_estimado(registro.get("modelo"), usage, payload)
+        if trabajo is not None:
+            trabajo.agregar(registro)
+        if self.ruta:
+            linea = json.dumps(registro, ensure_ascii=False)
+            with self._lock:
+                with open(self.ruta, "a", encoding="utf-8") as f:
+                    f.write(linea + "\n")
+        return registro
+
+
+_telemetria = None
+_telemetria_lock = threading.Lock()
+
+
+def obtener_telemetria():
+    """Devuelve el registro de telemetría del proceso, creándolo la primera vez."""
+    global _telemetria
+    if _telemetria is None:
+        with _telemetria_lock:
+            if _telemetria is None:
+                ruta = None
+                if os.environ.get("LLM_TELEMETRIA", "1") != "0":
+                    ruta = os.environ.get("LLM_TELEMETRIA_RUTA", RUTA_POR_DEFECTO)
+                _telemetria = RegistroTelemetria(ruta)
+    return _telemetria
+
+
+def registrar_llamada(**campos):
+    """Atajo para `obtener_telemetria().registrar(...)`."""
+    return obtener_telemetria().registrar(**campos)
+
+
+def registrar_analisis(analizador, fallo, reparado=False, errores=None):
+    """
+    Registra el análisis de una respuesta JSON.
+
+    Parámetros:
+        analizador (str): Nombre del analizador (p. ej. "estructura_novela").
+        fallo (bool): Si la primera respuesta no era JSON válido conforme al esquema.
+        reparado (bool): Si la pasada de reparación obtuvo una respuesta válida.
+        errores (list): Errores de validación, para depurar el formato.
+    """
+    campos = {"analisis": analizador, "fallo": fallo, "reparado": reparado}
+    if errores:
+        campos["errores"] = errores
+    return obtener_telemetria().registrar(**campos)
+
+
+def uso_de_respuesta(response):
+    """Extrae el campo `usage` del cuerpo JSON de una respuesta ya leída, si lo hay."""
+    try:
+        datos = response.json()
+    except ValueError:
+        return None
+    return datos.get("usage") if isinstance(datos, dict) else None
+
+
+@contextmanager
+def trabajo_telemetria(nombre):
+    """Agrupa bajo `nombre` los registros de las llamadas hechas dentro del bloque `with`."""
+    trabajo = Trabajo(nombre)
+    token = _trabajo_actual.set(trabajo)
+    try:
+        yield trabajo
+    finally:
+        trabajo.fin = time.monotonic()
+        _trabajo_actual.reset(token)
+
+
+@contextmanager
+def tarea_telemetria(tarea):
+    """Marca con `tarea` los registros de las llamadas hechas dentro del bloque `with`."""
+    token = _tarea_actual.set(tarea)
+    try:
+        yield
+    finally:
+        _tarea_actual.reset(token)
+
+
+def trabajo_actual():
+    """Devuelve el trabajo de telemetría activo en el contexto actual o None."""
+    return _trabajo_actual.get()
+
+
+def leer_registros(ruta=None):
+    """Lee los registros de un fichero JSONL de telemetría, ignorando líneas dañadas."""
+    ruta = ruta or os.environ.get("LLM_TELEMETRIA_RUTA", RUTA_POR_DEFECTO)
+    registros = []
+    if not os.path.exists(ruta):
+        return registros
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registros.append(json.loads(linea))
+            except json.JSONDecodeError:
+                continue
+    return registros
+
+
+def resumen_por_trabajo(registros):
+    """Agrupa los registros por trabajo y devuelve un resumen de cada uno, en orden de aparición."""
+    grupos = {}
+    for registro in registros:
+        grupos.setdefault((registro.get("trabajo_id"), registro.get("trabajo")), []).append(registro)
+    resumenes = []
+    for (trabajo_id, nombre), grupo in grupos.items():
+        resumen = resumir_registros(grupo)
+        resumen.update(trabajo=nombre or "(sin trabajo)", trabajo_id=trabajo_id,
+                       inicio=grupo[0].get("fecha"), fin=grupo[-1].get("fecha"))
+        resumenes.append(resumen)
+    return resumenes
+
+
+def formatear_resumen(resumen):
+    """Resume en una línea un trabajo, para mostrarlo en la interfaz."""
+    texto = (
+        f"{resumen['llamadas']} llamadas ({resumen['cache']} desde caché, {resumen['reintentos']} reintentos, "
+        f"{resumen['errores']} errores), {resumen['segundos_llamadas']} s en llamadas"
+    )
+    if resumen.get("duracion") is not None:
+        texto += f" de {resumen['duracion']} s totales"
+    texto += (
+        f", TTFB medio {resumen['ttfb_medio']} s, {resumen['tokens_prompt']} tokens de prompt y "
+        f"{resumen['tokens_salida']} de salida, coste estimado ${resumen['coste']:.4f}."
+    )
+    if resumen.get("respuestas_json"):
+        texto += (
+            f" {resumen['respuestas_json']} respuestas JSON, {resumen['fallos_json']} con fallo de formato "
+            f"({resumen['reparadas_json']} reparadas)."
+        )
+    if resumen.get("por_tarea"):
+        texto += " Por tarea: " + ", ".join(
+            f"{tarea} {datos['llamadas']} llamadas (${datos['coste']:.4f})"
+            for tarea, datos in resumen["por_tarea"].items()
+        ) + "."
+    return texto
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumen de la telemetría de llamadas por trabajo.")
+    parser.add_argument("--ruta", default=None, help="Fichero JSONL de telemetría.")
+    parser.add_argument("--ultimos", type=int, default=10, help="Número de trabajos a mostrar.")
+    args = parser.parse_args()
+
+    for resumen in resumen_por_trabajo(leer_registros(args.ruta))[-args.ultimos:]:
+        print(f"{resumen['trabajo']} [{resumen['trabajo_id']}] {resumen['inicio']} - {resumen['fin']}")
+        print(f"  {formatear_resumen(resumen)}")
+        for modelo, datos in resumen["por_modelo"].items():
+            print(f"    {modelo}: {datos['llamadas']} llamadas, {datos['segundos']:.1f} s, ${datos['coste']:.4f}")
+        for tarea, datos in resumen["por_tarea"].items():
+            print(f"    tarea {tarea} ({', '.join(datos['modelos'])}): {datos['llamadas']} llamadas, "
+                  f"{datos['segundos']:.1f} s, ${datos['coste']:.4f}")
+        for analizador, datos in resumen["por_analizador"].items():
+            tasa = datos["fallos"] / datos["respuestas"]
+            print(f"    {analizador}: {datos['respuestas']} respuestas JSON, {tasa:.1%} con fallo de formato, "
+                  f"{datos['reparadas']} reparadas")
+
+
+if __name__ == "__main__":
+    main()
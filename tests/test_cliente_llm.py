@@ -0,0 +1,36 @@
+"""Pruebas del cliente compartido contra el servidor simulado."""
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cliente_llm import chat_en_streaming  # noqa: E402
+from servidor_simulado import RUTA_OPENROUTER, crear_servidor  # noqa: E402
+
+
+@pytest.fixture
+def servidor():
+    # 1000 tokens/s: unas 250 palabras llegan en ~0.25 s, en fragmentos de una palabra
+    servidor = crear_servidor(puerto=0, tokens_por_segundo=1000)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    yield f"http://127.0.0.1:{servidor.server_address[1]}"
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_streaming_limita_las_actualizaciones(servidor):
+    recibidos = []
+    payload = {"messages": [{"role": "user", "content": "Escribe."}], "max_tokens": 500}
+    respuesta = chat_en_streaming(servidor + RUTA_OPENROUTER, {}, payload, al_recibir=recibidos.append)
+    texto = respuesta["choices"][0]["message"]["content"]
+    palabras = len(texto.split())
+    assert palabras >= 200
+    # Muchas menos actualizaciones que fragmentos, cada una con más texto, y la última con todo
+    assert 1 < len(recibidos) < palabras / 4
+    assert all(len(a) < len(b) and b.startswith(a) for a, b in zip(recibidos, recibidos[1:]))
+    assert recibidos[-1] == texto
@@ -0,0 +1,95 @@
+"""Pruebas del contexto de libros: digestos por niveles y contexto acotado al crecer el libro."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contexto_libros  # noqa: E402
+from contexto_libros import (  # noqa: E402
+    ELEMENTOS_POR_DIGESTO, PRESUPUESTO_CONTEXTO, RESUMENES_RECIENTES,
+    compactacion_pendiente, compactar, contexto_libro, piezas_contexto,
+)
+from estado_libros import AlmacenLibros  # noqa: E402
+from tokens import contar_tokens  # noqa: E402
+
+ID = "libro"
+
+
+def resumen(numero, palabras=80):
+    return " ".join(f"idea{numero}-{i}" if i % 4 == 0 else "el capítulo desarrolla" for i in range(palabras // 3))
+
+
+def fundir(piezas):
+    # Digesto de longitud fija, como pide el prompt (como máximo PALABRAS_DIGESTO palabras)
+    return f"digesto de {piezas[0]['desde']} a {piezas[-1]['hasta']}: " + resumen(piezas[0]['desde'])
+
+
+@pytest.fixture
+def almacen(tmp_path):
+    almacen = AlmacenLibros(str(tmp_path / "libros.sqlite3"))
+    almacen.crear(ID, "idea", "Ensayo", "Español")
+    yield almacen
+    almacen.cerrar()
+
+
+def cubiertos(piezas):
+    # Capítulos que cubre el contexto, en orden, sin huecos ni solapes
+    return [numero for p in piezas for numero in range(p['desde'], p['hasta'] + 1)]
+
+
+def test_contexto_acotado_al_crecer_el_libro(almacen):
+    tamanos = []
+    for numero in range(1, 61):
+        piezas = piezas_contexto(almacen, ID)
+        assert cubiertos(piezas) == list(range(1, numero))
+        tamanos.append(contar_tokens(contexto_libro(piezas)))
+        almacen.agregar_capitulo(ID, numero, f"Capítulo {numero}", "texto", resumen(numero))
+        compactar(almacen, ID, fundir)
+
+    assert max(tamanos) <= PRESUPUESTO_CONTEXTO
+    # Sin digestos, el contexto crecería con cada capítulo
+    sin_compactar = " ".join(f"(Capítulo {n}) {resumen(n)}" for n in range(1, 60))
+    assert contar_tokens(sin_compactar) > 3 * PRESUPUESTO_CONTEXTO
+
+
+def test_recientes_completos(almacen):
+    for numero in range(1, 11):
+        almacen.agregar_capitulo(ID, numero, "", "texto", resumen(numero))
+        compactar(almacen, ID, fundir)
+    piezas = piezas_contexto(almacen, ID)
+    recientes = piezas[-RESUMENES_RECIENTES:]
+    assert [p['nivel'] for p in recientes] == [0] * RESUMENES_RECIENTES
+    assert [p['resumen'] for p in recientes] == [resumen(n) for n in range(7, 11)]
+
+
+def test_digestos_suben_de_nivel(almacen):
+    total = ELEMENTOS_POR_DIGESTO * ELEMENTOS_POR_DIGESTO + RESUMENES_RECIENTES
+    for numero in range(1, total + 1):
+        almacen.agregar_capitulo(ID, numero, "", "texto", resumen(numero))
+        compactar(almacen, ID, fundir)
+    piezas = piezas_contexto(almacen, ID)
+    # Los cuatro digestos de nivel 1 se fundieron en uno de nivel 2 que los sustituye
+    assert (piezas[0]['nivel'], piezas[0]['desde'], piezas[0]['hasta']) == (2, 1, ELEMENTOS_POR_DIGESTO ** 2)
+    assert cubiertos(piezas) == list(range(1, total + 1))
+
+
+def test_fusion_fallida_conserva_los_resumenes(almacen):
+    for numero in range(1, 10):
+        almacen.agregar_capitulo(ID, numero, "", "texto", resumen(numero))
+    compactar(almacen, ID, lambda piezas: None)
+    piezas = piezas_contexto(almacen, ID)
+    assert almacen.digestos(ID) == []
+    assert cubiertos(piezas) == list(range(1, 10))
+
+
+def test_funde_todo_lo_antiguo_si_supera_el_presupuesto(monkeypatch):
+    piezas = [{'nivel': 0, 'desde': n, 'hasta': n, 'resumen': resumen(n)} for n in range(1, RESUMENES_RECIENTES + 3)]
+    # Menos capítulos antiguos que ELEMENTOS_POR_DIGESTO: solo se funden si el contexto no cabe
+    assert compactacion_pendiente(piezas) is None
+    monkeypatch.setattr(contexto_libros, "PRESUPUESTO_CONTEXTO", 100)
+    nivel, antiguas = compactacion_pendiente(piezas)
+    assert nivel == 1
+    assert antiguas == piezas[:2]
@@ -0,0 +1,73 @@
+"""Pruebas del enrutador: niveles por tarea y presupuesto de tokens del modelo enviado."""
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import enrutador  # noqa: E402
+from enrutador import MODELOS_EQUIVALENTES, MODELOS_NIVELES, NIVELES_TAREAS, chat_tarea, modelo_enviado, modelo_tarea  # noqa: E402
+from servidor_simulado import RUTA_OPENROUTER, RUTA_TOGETHER, crear_servidor  # noqa: E402
+from tokens import CONTEXTO_MODELOS, PresupuestoExcedido  # noqa: E402
+
+
+@pytest.fixture
+def servidor(monkeypatch):
+    servidor = crear_servidor(puerto=0)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    base = f"http://127.0.0.1:{servidor.server_address[1]}"
+    monkeypatch.setattr(enrutador, "URLS_CHAT", {"openrouter": base + RUTA_OPENROUTER, "together": base + RUTA_TOGETHER})
+    yield base
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.mark.parametrize("tarea", ["resumen", "momentos_clave", "prompt_imagen"])
+def test_tareas_auxiliares_en_nivel_rapido(tarea):
+    assert modelo_tarea(tarea) == MODELOS_NIVELES["rapido"]
+
+
+@pytest.mark.parametrize("tarea", ["prosa", "estructura", "plan", "memoria", "desconocida"])
+def test_tareas_principales_en_nivel_equilibrado(tarea):
+    assert modelo_tarea(tarea) == MODELOS_NIVELES["equilibrado"]
+
+
+def test_modelos_de_los_niveles_tienen_proveedores():
+    for nivel in set(NIVELES_TAREAS.values()):
+        assert MODELOS_EQUIVALENTES[MODELOS_NIVELES[nivel]]
+
+
+def test_sustitucion_por_entorno(monkeypatch):
+    monkeypatch.setenv("LLM_NIVELES_TAREAS", "momentos_clave=equilibrado")
+    monkeypatch.setenv("LLM_MODELOS_NIVELES", "equilibrado=qwen-2.5-72b")
+    assert modelo_tarea("momentos_clave") == "qwen-2.5-72b"
+
+
+def test_nivel_desconocido(monkeypatch):
+    monkeypatch.setenv("LLM_NIVELES_TAREAS", "resumen=inexistente")
+    with pytest.raises(ValueError):
+        modelo_tarea("resumen")
+
+
+def test_modelo_enviado_por_proveedor_disponible():
+    assert modelo_enviado("prosa", {"openrouter": "k"}) == "openai/gpt-4o-mini"
+    assert modelo_enviado("prosa", {"together": "k"}) == "meta-llama/Llama-3.3-70B-Instruct-Turbo"
+    assert modelo_enviado("resumen", {"openrouter": "k"}) == "qwen/qwen-2.5-7b-instruct"
+
+
+def test_max_tokens_ajustado_al_modelo_enviado(servidor):
+    payload = {"messages": [{"role": "user", "content": "Resume."}], "max_tokens": 100000}
+    respuesta = chat_tarea("resumen", payload, {"openrouter": "k"})
+    assert respuesta["model"] == "qwen/qwen-2.5-7b-instruct"
+    # El simulador escribe max_tokens / 2 palabras: la salida se limitó al contexto de 32k de qwen
+    assert respuesta["usage"]["completion_tokens"] <= CONTEXTO_MODELOS["qwen/qwen-2.5-7b-instruct"] // 2
+
+
+def test_prompt_que_no_cabe_en_ningun_candidato(servidor):
+    payload = {"messages": [{"role": "user", "content": "palabra " * 200000}], "max_tokens": 1000}
+    with pytest.raises(PresupuestoExcedido):
+        chat_tarea("resumen", payload, {"openrouter": "k", "together": "k"})
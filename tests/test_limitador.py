@@ -0,0 +1,40 @@
+"""Pruebas de la identificación del proveedor de cada URL."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limitador import proveedor_de_url  # noqa: E402
+
+
+@pytest.mark.parametrize("url, proveedor", [
+    ("https://openrouter.ai/api/v1/chat/completions", "openrouter"),
+    ("https://api.together.xyz/v1/chat/completions", "together"),
+    ("https://api.together.xyz/v1/images/generations", "together"),
+])
+def test_proveedores_reales(url, proveedor):
+    assert proveedor_de_url(url) == proveedor
+
+
+def test_servidor_compartido_por_ruta(monkeypatch):
+    monkeypatch.setenv("LLM_OPENROUTER_BASE", "http://127.0.0.1:8765")
+    monkeypatch.setenv("LLM_TOGETHER_BASE", "http://127.0.0.1:8765")
+    assert proveedor_de_url("http://127.0.0.1:8765/api/v1/chat/completions") == "openrouter"
+    assert proveedor_de_url("http://127.0.0.1:8765/v1/chat/completions") == "together"
+    assert proveedor_de_url("http://127.0.0.1:8765/v1/images/generations") == "together"
+
+
+def test_bases_distintas(monkeypatch):
+    monkeypatch.setenv("LLM_OPENROUTER_BASE", "http://proxy-a:9000/openrouter")
+    monkeypatch.setenv("LLM_TOGETHER_BASE", "http://proxy-b:9000")
+    assert proveedor_de_url("http://proxy-a:9000/openrouter/api/v1/chat/completions") == "openrouter"
+    assert proveedor_de_url("http://proxy-b:9000/v1/chat/completions") == "together"
+
+
+def test_url_desconocida(monkeypatch):
+    monkeypatch.delenv("LLM_OPENROUTER_BASE", raising=False)
+    monkeypatch.delenv("LLM_TOGETHER_BASE", raising=False)
+    assert proveedor_de_url("http://ejemplo.com/otra") == "ejemplo.com"
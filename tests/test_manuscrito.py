@@ -0,0 +1,79 @@
+"""Pruebas del manuscrito: lectura de textos con encabezados y recuentos al colocar escenas."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from manuscrito import Manuscrito  # noqa: E402
+
+
+def estructura(manuscrito):
+    return [
+        (capitulo.numero, capitulo.titulo, [(escena.numero, escena.titulo, escena.texto) for escena in capitulo.escenas])
+        for capitulo in manuscrito.capitulos
+    ]
+
+
+def test_texto_anterior_al_primer_encabezado_se_descarta():
+    manuscrito = Manuscrito.desde_texto("Prólogo suelto sin encabezado.\n\nCapítulo 1\n\nEscena 1\nHabía una vez.")
+    assert estructura(manuscrito) == [(1, "Capítulo 1", [(1, "Escena 1", "Había una vez.")])]
+    assert manuscrito.palabras == 3
+
+
+def test_escenas_sin_capitulo_van_a_un_capitulo_sin_encabezado():
+    manuscrito = Manuscrito.desde_texto("Escena 1\nUno dos.\n\nEscena 2\nTres.")
+    assert estructura(manuscrito) == [(None, None, [(1, "Escena 1", "Uno dos."), (2, "Escena 2", "Tres.")])]
+    assert manuscrito.texto(marcas=False) == "Escena 1\n\nUno dos.\n\nEscena 2\n\nTres."
+
+
+def test_texto_del_capitulo_antes_de_su_primera_escena():
+    manuscrito = Manuscrito.desde_texto("Capítulo 2: El regreso\nIntroducción breve.\n\nEscena 1\nLa escena.")
+    assert estructura(manuscrito) == [
+        (2, "Capítulo 2: El regreso", [(None, None, "Introducción breve."), (1, "Escena 1", "La escena.")]),
+    ]
+    assert manuscrito.capitulo(2).palabras == 4
+
+
+def test_encabezados_en_ingles_y_markdown():
+    texto = "# Chapter 1\n\n## Escena 1\nFirst scene.\n\n### Scene 2\nSecond.\n\nchapter 3 - The end\n## Escena 1\nLast."
+    manuscrito = Manuscrito.desde_texto(texto, "Obra")
+    assert estructura(manuscrito) == [
+        (1, "Chapter 1", [(1, "Escena 1", "First scene."), (2, "Scene 2", "Second.")]),
+        (3, "chapter 3 - The end", [(1, "Escena 1", "Last.")]),
+    ]
+    assert manuscrito.titulo == "Obra"
+    assert len(manuscrito) == 3
+
+
+def test_encabezado_en_medio_de_una_linea_no_cuenta():
+    manuscrito = Manuscrito.desde_texto("Capítulo 1\nComo se dijo en la Escena 4 anterior.")
+    assert estructura(manuscrito) == [(1, "Capítulo 1", [(None, None, "Como se dijo en la Escena 4 anterior.")])]
+
+
+def test_poner_escena_fuera_de_orden():
+    manuscrito = Manuscrito("Novela")
+    manuscrito.poner_escena(2, 1, "dos uno")
+    manuscrito.poner_escena(1, 2, "uno dos tres")
+    manuscrito.poner_escena(1, 1, "uno")
+    assert [(c.numero, [e.numero for e in c.escenas]) for c in manuscrito.capitulos] == [(1, [1, 2]), (2, [1])]
+    assert manuscrito.capitulo(1).palabras == 4
+    assert manuscrito.palabras == 6
+
+
+def test_reemplazar_escena_ajusta_los_totales():
+    manuscrito = Manuscrito()
+    for capitulo, escena, texto in [(1, 3, "a b c"), (1, 1, "a"), (2, 2, "a b"), (1, 2, "a b c d")]:
+        manuscrito.poner_escena(capitulo, escena, texto)
+    assert manuscrito.palabras == 10
+
+    # Reemplazar una escena anterior a otras ya colocadas, y otra de un capítulo posterior
+    colocada = manuscrito.poner_escena(1, 1, "uno dos tres cuatro cinco")
+    manuscrito.poner_escena(2, 2, "x")
+    assert colocada is manuscrito.escena(1, 1)
+    assert colocada.palabras == 5
+    assert len(manuscrito) == 4
+    assert manuscrito.capitulo(1).palabras == 5 + 4 + 3
+    assert manuscrito.capitulo(2).palabras == 1
+    assert manuscrito.palabras == sum(e.palabras for _, e in manuscrito.escenas()) == 13
+    assert [e.texto for e in manuscrito.capitulo(1).escenas] == ["uno dos tres cuatro cinco", "a b c d", "a b c"]
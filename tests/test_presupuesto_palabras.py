@@ -0,0 +1,96 @@
+"""Pruebas del presupuesto de palabras: reparto, redistribución del restante y sesgo del modelo."""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from presupuesto_palabras import (  # noqa: E402
+    ALFA_SESGO, LIMITES_AJUSTE, LIMITES_SESGO, MINIMO_PALABRAS_SUBTRAMAS, MINIMO_PALABRAS_TRAMA,
+    actualizar_sesgo, redistribuir_palabras, repartir_palabras,
+)
+
+
+def test_reparto_respeta_minimos_y_total_aproximado():
+    random.seed(0)
+    palabras = repartir_palabras(40, 70, total=20000)
+    assert len(palabras) == 40
+    assert all(trama >= MINIMO_PALABRAS_TRAMA and subtramas >= MINIMO_PALABRAS_SUBTRAMAS
+               for trama, subtramas in palabras)
+    assert abs(sum(map(sum, palabras)) - 20000) <= 40 * 120
+
+
+def test_reescala_al_presupuesto_restante():
+    palabras = [[1000, 500] for _ in range(4)]
+    # Dos escenas terminadas que se pasaron: quedan 6000 - 3600 = 2400 para las dos pendientes
+    proyeccion = redistribuir_palabras(palabras, {0: 1800, 1: 1800}, [], [2, 3], total=6000)
+    assert palabras[2] == palabras[3] == [800, 400]
+    assert proyeccion == 6000
+
+
+def test_escenas_en_curso_cuentan_como_comprometidas():
+    palabras = [[1000, 500] for _ in range(4)]
+    proyeccion = redistribuir_palabras(palabras, {0: 1500}, [1], [2, 3], total=5400)
+    # 5400 - 1500 reales - 1500 en curso = 2400 para 3000 asignadas
+    assert palabras[1] == [1000, 500]
+    assert palabras[2] == [800, 400]
+    assert proyeccion == 5400
+
+
+@pytest.mark.parametrize("reales, ajuste", [
+    ({0: 5800}, LIMITES_AJUSTE[0]),  # casi todo el presupuesto ya gastado
+    ({0: 100}, LIMITES_AJUSTE[1]),   # la primera escena se quedó muy corta
+])
+def test_ajuste_limitado(reales, ajuste):
+    palabras = [[1000, 500] for _ in range(3)]
+    proyeccion = redistribuir_palabras(palabras, reales, [], [1, 2], total=6000)
+    esperado = [max(MINIMO_PALABRAS_TRAMA, round(1000 * ajuste)),
+                max(MINIMO_PALABRAS_SUBTRAMAS, round(500 * ajuste))]
+    assert palabras[1] == palabras[2] == esperado
+    assert proyeccion == sum(reales.values()) + 2 * sum(esperado)
+
+
+def test_ajuste_no_baja_de_los_minimos():
+    palabras = [[MINIMO_PALABRAS_TRAMA, MINIMO_PALABRAS_SUBTRAMAS]]
+    redistribuir_palabras(palabras, {}, [], [0], total=100)
+    assert palabras[0] == [MINIMO_PALABRAS_TRAMA, MINIMO_PALABRAS_SUBTRAMAS]
+
+
+def test_sin_escenas_por_pedir_devuelve_lo_comprometido():
+    palabras = [[1000, 500], [1000, 500]]
+    assert redistribuir_palabras(palabras, {0: 1234}, [1], []) == 1234 + 1500
+    assert palabras == [[1000, 500], [1000, 500]]
+
+
+def test_reanudacion_reparte_solo_entre_las_faltantes():
+    # Como al reanudar en novelas.py: reales de las escenas guardadas, nada en curso, faltantes por pedir
+    palabras = [[1000, 500] for _ in range(6)]
+    guardadas = {0: 1400, 2: 1600, 3: 1500}
+    faltantes = [1, 4, 5]
+    proyeccion = redistribuir_palabras(palabras, guardadas, [], faltantes, total=9000)
+    assert proyeccion == 9000
+    assert all(palabras[i] == [1000, 500] for i in guardadas)
+    assert all(palabras[i] == [1000, 500] for i in faltantes)
+
+    # Una segunda reanudación con más escenas guardadas sigue apuntando al total
+    guardadas[1] = 1900
+    proyeccion = redistribuir_palabras(palabras, guardadas, [], [4, 5], total=9000)
+    assert proyeccion == 9000
+    assert palabras[4] == palabras[5] == [867, 433]
+
+
+def test_sesgo_media_movil():
+    assert actualizar_sesgo(1.0, 1200, 1000) == pytest.approx((1 - ALFA_SESGO) + ALFA_SESGO * 1.2)
+    # Una escena sin palabras pedidas no mueve el sesgo hacia ningún lado
+    assert actualizar_sesgo(1.0, 500, 0) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("producidas, limite", [(100000, LIMITES_SESGO[1]), (0, LIMITES_SESGO[0])])
+def test_sesgo_limitado(producidas, limite):
+    sesgo = 1.0
+    for _ in range(50):
+        sesgo = actualizar_sesgo(sesgo, producidas, 1000)
+    assert sesgo == limite
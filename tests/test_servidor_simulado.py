@@ -0,0 +1,66 @@
+"""Pruebas del servidor simulado: las peticiones JSON reciben respuestas conformes al esquema."""
+
+import os
+import sys
+import threading
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from salida_json import ENTERO, TEXTO, analizar, formato_json, lista, objeto, pedir_json  # noqa: E402
+from servidor_simulado import RUTA_OPENROUTER, RUTA_TOGETHER, crear_servidor  # noqa: E402
+
+ESQUEMA = objeto(
+    titulo=TEXTO,
+    escenas=lista(objeto(capitulo=ENTERO, escena=ENTERO, objetivo=TEXTO)),
+    tono={"type": "string", "enum": ["grave", "ligero"]},
+)
+
+
+@pytest.fixture
+def servidor():
+    servidor = crear_servidor(puerto=0)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    yield f"http://127.0.0.1:{servidor.server_address[1]}"
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def contenido(url, formato, prompt="Planifica la novela."):
+    payload = {"messages": [{"role": "user", "content": prompt}], "max_tokens": 500}
+    if formato:
+        payload["response_format"] = formato
+    response = requests.post(url, json=payload, timeout=10)
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"]
+
+
+@pytest.mark.parametrize("ruta, proveedor", [(RUTA_OPENROUTER, "openrouter"), (RUTA_TOGETHER, "together")])
+def test_respuesta_conforme_al_esquema(servidor, ruta, proveedor):
+    texto = contenido(servidor + ruta, formato_json("plan", ESQUEMA, proveedor))
+    valor = analizar(texto, ESQUEMA)
+    assert valor["escenas"] and valor["tono"] in ("grave", "ligero")
+
+
+def test_respuesta_determinista(servidor):
+    formato = formato_json("plan", ESQUEMA)
+    assert contenido(servidor + RUTA_OPENROUTER, formato) == contenido(servidor + RUTA_OPENROUTER, formato)
+
+
+def test_texto_libre_sin_formato(servidor):
+    with pytest.raises(ValueError):
+        analizar(contenido(servidor + RUTA_OPENROUTER, None), ESQUEMA)
+
+
+def test_pedir_json_sin_reparacion(servidor):
+    llamadas = []
+
+    def llamar(prompt, formato):
+        llamadas.append(prompt)
+        return contenido(servidor + RUTA_OPENROUTER, formato, prompt)
+
+    assert pedir_json(llamar, "Planifica la novela.", ESQUEMA, "plan") is not None
+    assert len(llamadas) == 1
@@ -0,0 +1,52 @@
+"""Pruebas del gestor de trabajos en segundo plano."""
+
+import os
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("streamlit")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trabajos import COMPLETADO, PENDIENTE, GestorTrabajos  # noqa: E402
+
+
+def test_trabajo_encadenado_no_ocupa_hilo_mientras_espera():
+    gestor = GestorTrabajos(max_trabajos=1)
+    liberar = threading.Event()
+    orden = []
+
+    def primero(trabajo):
+        liberar.wait(5)
+        orden.append("primero")
+
+    def segundo(trabajo):
+        orden.append("segundo")
+        return "hecho"
+
+    anterior = gestor.enviar("a", primero)
+    while anterior.estado == PENDIENTE:
+        threading.Event().wait(0.01)
+    siguiente = gestor.enviar("b", segundo, despues_de=anterior)
+    # Con un único hilo ocupado por el primero, el segundo sigue pendiente y fuera del pool
+    assert siguiente.estado == PENDIENTE
+    assert gestor._ejecutor._work_queue.qsize() == 0
+    liberar.set()
+    for _ in range(100):
+        if siguiente.estado == COMPLETADO:
+            break
+        threading.Event().wait(0.05)
+    assert orden == ["primero", "segundo"]
+    assert siguiente.resultado == "hecho"
+
+
+def test_encadenado_a_un_trabajo_terminado_se_lanza_enseguida():
+    gestor = GestorTrabajos(max_trabajos=1)
+    anterior = gestor.enviar("a", lambda trabajo: None)
+    while anterior.activo():
+        threading.Event().wait(0.01)
+    siguiente = gestor.enviar("b", lambda trabajo: 1, despues_de=anterior)
+    while siguiente.activo():
+        threading.Event().wait(0.01)
+    assert siguiente.resultado == 1
@@ -0,0 +1,167 @@
+"""
+Conteo de tokens y presupuestos de prompt/salida por idioma.
+
+Usa `tiktoken` cuando está instalado (con el tokenizador cacheado por modelo)
+y, si no, una estimación por caracteres. El presupuesto de salida se calcula a
+partir de una relación tokens/palabra calibrada por idioma, que se ajusta con
+el texto realmente generado.
+"""
+
+import threading
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Ventana de contexto (prompt + salida) de los modelos usados en las aplicaciones
+CONTEXTO_MODELOS = {
+    "openai/gpt-4o-mini": 128000,
+    "gpt-4": 8192,
+    "openai/gpt-4": 8192,
+    "meta-llama/Llama-3.3-70B-Instruct-Turbo": 131072,
+    "qwen/qwen-2.5-72b-instruct": 32768,
+    "Qwen/Qwen2.5-72B-Instruct-Turbo": 32768,
+    "qwen/qwen-2.5-7b-instruct": 32768,
+    "Qwen/Qwen2.5-7B-Instruct-Turbo": 32768,
+}
+CONTEXTO_POR_DEFECTO = 8192
+
+# Tokens por palabra medidos en prosa narrativa con el tokenizador de gpt-4o
+TOKENS_POR_PALABRA = {
+    "es": 1.6,
+    "en": 1.35,
+    "la": 2.1,
+}
+IDIOMAS = {"Español": "es", "Inglés": "en", "Latín": "la"}
+
+# Tokens reservados por mensaje para el formato del chat
+TOKENS_POR_MENSAJE = 4
+# Margen sobre la estimación para que la salida no se corte
+MARGEN_SALIDA = 1.15
+# Salida mínima aceptable antes de rechazar un prompt demasiado largo
+SALIDA_MINIMA = 256
+
+_calibracion_lock = threading.Lock()
+
+
+class PresupuestoExcedido(ValueError):
+    """El prompt no deja espacio suficiente para la salida en el contexto del modelo."""
+
+
+def _codigo_idioma(idioma):
+    return IDIOMAS.get(idioma, idioma)
+
+
+@lru_cache(maxsize=None)
+def _codificador(modelo):
+    if tiktoken is None:
+        return None
+    nombre = modelo.split("/")[-1]
+    try:
+        try:
+            return tiktoken.encoding_for_model(nombre)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # tiktoken descarga el vocabulario la primera vez; sin red se usa la estimación
+        return None
+
+
+def contar_tokens(texto, modelo="openai/gpt-4o-mini"):
+    """Cuenta los tokens de `texto` con el tokenizador del modelo (o una estimación)."""
+    if not texto:
+        return 0
+    codificador = _codificador(modelo)
+    if codificador is None:
+        # Sin tiktoken: ~3.5 caracteres por token en español e inglés
+        return int(len(texto) / 3.5) + 1
+    return len(codificador.encode(texto, disallowed_special=()))
+
+
+def contar_tokens_mensajes(mensajes, modelo="openai/gpt-4o-mini"):
+    """Cuenta los tokens de prompt de una lista de mensajes de chat."""
+    return sum(contar_tokens(m.get("content") or "", modelo) + TOKENS_POR_MENSAJE for m in mensajes) + 3
+
+
+def presupuesto_salida(palabras, idioma="es"):
+    """
+    Calcula `max_tokens` para una salida de `palabras` palabras en `idioma`.
+
+    Parámetros:
+        palabras (int): Longitud deseada del texto.
+        idioma (str): Código (`es`, `en`, `la`) o nombre del idioma.
+
+    Retorna:
+        int: Presupuesto de tokens de salida con margen.
+    """
+    ratio = TOKENS_POR_PALABRA.get(_codigo_idioma(idioma), TOKENS_POR_PALABRA["es"])
+    return int(palabras * ratio * MARGEN_SALIDA)
+
+
+def registrar_salida(texto, idioma="es", modelo="openai/gpt-4o-mini"):
+    """Recalibra la relación tokens/palabra del idioma con un texto generado."""
+    palabras = len(texto.split())
+    if palabras < 50:
+        return
+    codigo = _codigo_idioma(idioma)
+    observado = contar_tokens(texto, modelo) / palabras
+    with _calibracion_lock:
+        anterior = TOKENS_POR_PALABRA.get(codigo, observado)
+        TOKENS_POR_PALABRA[codigo] = round(0.8 * anterior + 0.2 * observado, 3)
+
+
+def recortar_texto(texto, max_tokens, modelo="openai/gpt-4o-mini"):
+    """Recorta `texto` para que no supere `max_tokens`, conservando el principio."""
+    if contar_tokens(texto, modelo) <= max_tokens:
+        return texto
+    codificador = _codificador(modelo)
+    if codificador is None:
+        return texto[:int(max_tokens * 3.5)]
+    return codificador.decode(codificador.encode(texto, disallowed_special=())[:max_tokens])
+
+
+def recortar_bloque(prompt, bloque, max_tokens, modelo="openai/gpt-4o-mini"):
+    """
+    Recorta `bloque` (el contexto variable de `prompt`) para que el prompt y
+    `max_tokens` de salida quepan en el contexto del modelo.
+
+    Como mucho se reserva la mitad del contexto para la salida: una salida
+    mayor se reduce después con `ajustar_max_tokens` en lugar de dejar el
+    prompt sin contexto.
+
+    Retorna:
+        str: El prompt, con el bloque recortado si no cabía entero.
+    """
+    contexto = CONTEXTO_MODELOS.get(modelo, CONTEXTO_POR_DEFECTO)
+    reserva = min(max_tokens, contexto // 2)
+    exceso = contar_tokens_mensajes([{"role": "user", "content": prompt}], modelo) + reserva - contexto
+    if exceso <= 0 or not bloque or bloque not in prompt:
+        return prompt
+    # Margen de un mensaje: el recorte no conserva exactamente la cuenta de tokens
+    recortado = recortar_texto(bloque, max(contar_tokens(bloque, modelo) - exceso - TOKENS_POR_MENSAJE, 0), modelo)
+    return prompt.replace(bloque, recortado, 1)
+
+
+def ajustar_max_tokens(mensajes, max_tokens, modelo="openai/gpt-4o-mini"):
+    """
+    Comprueba que prompt y salida caben en el contexto del modelo.
+
+    Si la salida pedida no cabe, la reduce al espacio disponible; si el espacio
+    es menor que `SALIDA_MINIMA`, rechaza la petición antes de enviarla.
+
+    Retorna:
+        int: `max_tokens` ajustado.
+
+    Lanza:
+        PresupuestoExcedido: Si el prompt no deja espacio suficiente.
+    """
+    contexto = CONTEXTO_MODELOS.get(modelo, CONTEXTO_POR_DEFECTO)
+    tokens_prompt = contar_tokens_mensajes(mensajes, modelo)
+    disponible = contexto - tokens_prompt
+    if disponible < min(SALIDA_MINIMA, max_tokens):
+        raise PresupuestoExcedido(
+            f"El prompt ocupa {tokens_prompt} tokens y el contexto de {modelo} es de {contexto}."
+        )
+    return min(max_tokens, disponible)
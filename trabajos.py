@@ -0,0 +1,259 @@
+"""
+Trabajos de generación en segundo plano, independientes de la sesión de Streamlit.
+
+Las generaciones largas (una novela, un libro, una colección de cuentos) se
+envían a un pool de hilos del proceso del servidor en lugar de ejecutarse
+dentro del script. La interfaz solo consulta el progreso del trabajo, así que
+una interacción con un widget, una recarga o cerrar la pestaña no detienen la
+generación, y varias sesiones pueden generar a la vez sin bloquearse.
+
+Dentro de un trabajo no hay contexto de Streamlit: el código que se ejecuta en
+él informa con `avisar(...)` y con los métodos del trabajo (`progreso`,
+`actualizar_vista_previa`), y la interfaz lo muestra con `mostrar_trabajo`.
+
+Configuración mediante variables de entorno:
+    LLM_TRABAJOS_MAX  Trabajos simultáneos por proceso (por defecto 4).
+"""
+
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+CANCELADO = "cancelado"
+
+# Segundos entre consultas de la interfaz mientras el trabajo sigue activo
+INTERVALO_SONDEO = 2.0
+# Segundos que se conservan los trabajos terminados antes de olvidarlos
+RETENCION = 24 * 60 * 60
+# Mensajes que se conservan por trabajo
+MAX_MENSAJES = 50
+
+_trabajo_actual = contextvars.ContextVar("trabajo_fondo", default=None)
+
+
+class TrabajoCancelado(Exception):
+    """El usuario canceló el trabajo."""
+
+
+class TrabajoFondo:
+    """
+    Estado compartido entre un trabajo en segundo plano y la interfaz que lo consulta.
+
+    Parámetros:
+        id (str): Identificador del trabajo.
+        tipo (str): Tipo de trabajo ("novela", "libro"...).
+    """
+
+    def __init__(self, id, tipo):
+        self.id = id
+        self.tipo = tipo
+        self.estado = PENDIENTE
+        self.hecho = 0
+        self.total = None
+        self.texto = ""
+        self.vista_previa = None
+        self.resultado = None
+        self.error = None
+        self.creado = time.time()
+        self.terminado = None
+        self._mensajes = []
+        self._al_terminar = []
+        self._cancelar = threading.Event()
+        self._lock = threading.Lock()
+
+    def activo(self):
+        return self.estado in (PENDIENTE, EN_CURSO)
+
+    def progreso(self, hecho=None, total=None, texto=None):
+        """Actualiza las unidades terminadas, el total y el texto de progreso."""
+        if hecho is not None:
+            self.hecho = hecho
+        if total is not None:
+            self.total = total
+        if texto is not None:
+            self.texto = texto
+
+    def actualizar_vista_previa(self, texto):
+        self.vista_previa = texto
+
+    def avisar(self, mensaje, nivel="warning"):
+        """Guarda un mensaje para la interfaz (`nivel` es error, warning, info o success)."""
+        with self._lock:
+            self._mensajes.append((nivel, mensaje))
+            del self._mensajes[:-MAX_MENSAJES]
+
+    def mensajes(self):
+        with self._lock:
+            return list(self._mensajes)
+
+    def al_terminar(self, funcion):
+        """Llama a `funcion()` cuando el trabajo termine (en ese momento si ya ha terminado)."""
+        with self._lock:
+            if self.terminado is None:
+                self._al_terminar.append(funcion)
+                return
+        funcion()
+
+    def _terminar(self):
+        with self._lock:
+            self.terminado = time.time()
+            funciones, self._al_terminar = self._al_terminar, []
+        for funcion in funciones:
+            funcion()
+
+    def cancelar(self):
+        self._cancelar.set()
+
+    def cancelado(self):
+        return self._cancelar.is_set()
+
+    def comprobar_cancelacion(self):
+        """
+        Lanza:
+            TrabajoCancelado: Si se pidió cancelar el trabajo.
+        """
+        if self._cancelar.is_set():
+            raise TrabajoCancelado(f"Se canceló el trabajo {self.id}.")
+
+
+class GestorTrabajos:
+    """
+    Pool de hilos del proceso que ejecuta los trabajos y los conserva para consultarlos.
+
+    Parámetros:
+        max_trabajos (int): Trabajos que se ejecutan a la vez; el resto espera en cola.
+    """
+
+    def __init__(self, max_trabajos=4):
+        self._trabajos = {}
+        self._lock = threading.Lock()
+        self._ejecutor = ThreadPoolExecutor(max_workers=max_trabajos, thread_name_prefix="trabajo")
+
+    def enviar(self, tipo, funcion, *args, id=None, despues_de=None, **kwargs):
+        """
+        Envía `funcion(trabajo, *args, **kwargs)` al pool.
+
+        Si ya hay un trabajo activo con el mismo `id`, lo devuelve en lugar de
+        lanzar otro, de modo que reenviar tras una recarga es seguro.
+
+        Con `despues_de` (otro trabajo), el nuevo queda pendiente, sin ocupar un
+        hilo del pool, hasta que aquel termine.
+
+        Retorna:
+            TrabajoFondo: El trabajo enviado (o el que ya estaba activo).
+        """
+        with self._lock:
+            self._purgar()
+            existente = self._trabajos.get(id) if id else None
+            if existente is not None and existente.activo():
+                return existente
+            trabajo = TrabajoFondo(id or uuid.uuid4().hex[:16], tipo)
+            self._trabajos[trabajo.id] = trabajo
+        if despues_de is not None:
+            despues_de.al_terminar(lambda: self._lanzar(trabajo, funcion, args, kwargs))
+        else:
+            self._lanzar(trabajo, funcion, args, kwargs)
+        return trabajo
+
+    def _lanzar(self, trabajo, funcion, args, kwargs):
+        # Contexto limpio: el trabajo no hereda el plazo ni la telemetría de quien lo envía
+        self._ejecutor.submit(contextvars.Context().run, self._ejecutar, trabajo, funcion, args, kwargs)
+
+    def obtener(self, id):
+        """Devuelve el trabajo `id` o None si no existe (o ya se olvidó)."""
+        if not id:
+            return None
+        with self._lock:
+            return self._trabajos.get(id)
+
+    def _ejecutar(self, trabajo, funcion, args, kwargs):
+        _trabajo_actual.set(trabajo)
+        trabajo.estado = EN_CURSO
+        try:
+            trabajo.comprobar_cancelacion()
+            trabajo.resultado = funcion(trabajo, *args, **kwargs)
+            trabajo.estado = COMPLETADO
+        except TrabajoCancelado:
+            trabajo.estado = CANCELADO
+        except Exception as e:
+            trabajo.error = f"{type(e).__name__}: {e}"
+            trabajo.estado = FALLIDO
+        finally:
+            trabajo.vista_previa = None
+            trabajo._terminar()
+
+    def _purgar(self):
+        limite = time.time() - RETENCION
+        for id in [id for id, t in self._trabajos.items() if t.terminado and t.terminado < limite]:
+            del self._trabajos[id]
+
+
+_gestor = None
+_gestor_lock = threading.Lock()
+
+
+def obtener_gestor():
+    """Devuelve el gestor de trabajos del proceso (compartido por todas las sesiones)."""
+    global _gestor
+    if _gestor is None:
+        with _gestor_lock:
+            if _gestor is None:
+                try:
+                    max_trabajos = int(os.environ.get("LLM_TRABAJOS_MAX", 4))
+                except ValueError:
+                    max_trabajos = 4
+                _gestor = GestorTrabajos(max_trabajos)
+    return _gestor
+
+
+def trabajo_actual():
+    """Devuelve el trabajo en segundo plano que ejecuta el hilo actual o None."""
+    return _trabajo_actual.get()
+
+
+def avisar(mensaje, nivel="error"):
+    """
+    Muestra un mensaje: dentro de un trabajo lo guarda para la interfaz y,
+    fuera de él, lo muestra directamente con Streamlit.
+    """
+    trabajo = _trabajo_actual.get()
+    if trabajo is not None:
+        trabajo.avisar(mensaje, nivel)
+    else:
+        getattr(st, nivel)(mensaje)
+
+
+def mostrar_trabajo(trabajo):
+    """Muestra el progreso, los mensajes y la vista previa de un trabajo."""
+    if trabajo.total:
+        st.progress(min(1.0, trabajo.hecho / trabajo.total))
+    if trabajo.texto:
+        st.text(trabajo.texto)
+    for nivel, mensaje in trabajo.mensajes():
+        getattr(st, nivel)(mensaje)
+    if trabajo.vista_previa:
+        st.markdown(trabajo.vista_previa)
+    if trabajo.activo():
+        st.caption("La generación continúa en segundo plano aunque cierres la pestaña; vuelve a esta página para ver el resultado.")
+        if st.button("Cancelar la generación", key=f"cancelar_{trabajo.id}"):
+            trabajo.cancelar()
+    elif trabajo.estado == FALLIDO:
+        st.error(f"La generación falló: {trabajo.error}")
+    elif trabajo.estado == CANCELADO:
+        st.warning("La generación se canceló.")
+
+
+def sondear(trabajo):
+    """Si el trabajo sigue activo, espera un intervalo y vuelve a ejecutar el script."""
+    if trabajo.activo():
+        time.sleep(INTERVALO_SONDEO)
+        st.rerun()